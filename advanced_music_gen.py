@@ -12,60 +12,20 @@ from music21 import stream, note, chord, tempo, meter, pitch, duration
 
 # Add the ai-music-aml src to path
 sys.path.append(os.path.join(os.path.dirname(__file__), 'ai-music-aml', 'src'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ai-music-aml'))
 
 try:
     import tensorflow as tf
     from tensorflow.keras import models
+    from src.inference.registry import get_model, get_vocab, get_token_table
+    from src.utils.token_table import NOTE, CHORD, REST
+    from src.inference.engine import generate_ids
 except ImportError as e:
     print(f"❌ Error importing TensorFlow: {e}")
     sys.exit(1)
 
-def parse_token(token_str):
-    """Parse a token string into musical elements"""
-    try:
-        if token_str.startswith('P'):  # Single note
-            # Format: PD4|D0.25|S0.75
-            parts = token_str.split('|')
-            note_part = parts[0][1:]  # Remove 'P'
-            duration_part = float(parts[1][1:]) if len(parts) > 1 else 0.5  # Remove 'D'
-            
-            return {
-                'type': 'note',
-                'pitch': note_part,
-                'duration': duration_part
-            }
-            
-        elif token_str.startswith('CHORD:'):
-            # Format: CHORD:G#5,D6,E6|D0.5|S0.25
-            parts = token_str.split('|')
-            chord_part = parts[0][6:]  # Remove 'CHORD:'
-            duration_part = float(parts[1][1:]) if len(parts) > 1 else 0.5  # Remove 'D'
-            
-            notes = chord_part.split(',')
-            return {
-                'type': 'chord',
-                'notes': notes,
-                'duration': duration_part
-            }
-            
-        elif 'REST' in token_str or 'R' == token_str[0]:
-            # Rest token
-            duration_part = 0.5
-            if '|D' in token_str:
-                duration_part = float(token_str.split('|D')[1].split('|')[0])
-            
-            return {
-                'type': 'rest',
-                'duration': duration_part
-            }
-            
-    except Exception as e:
-        print(f"⚠️ Error parsing token '{token_str}': {e}")
-        
-    return None
-
-def tokens_to_midi(tokens, output_path):
-    """Convert tokens to MIDI with proper parsing"""
+def tokens_to_midi(token_ids, output_path, table):
+    """Convert token ids to MIDI (attributes come from the TokenTable)"""
     print("🎵 Creating MIDI with advanced parsing...")
     
     # Create a music21 stream
@@ -77,36 +37,27 @@ def tokens_to_midi(tokens, output_path):
     chord_count = 0
     rest_count = 0
     
-    for token in tokens:
-        parsed = parse_token(str(token))
-        
-        if parsed is None:
+    for idx in token_ids:
+        if not 0 <= idx < table.vocab_size:
             continue
+        kind, duration = table.kind[idx], float(table.duration[idx])
             
         try:
-            if parsed['type'] == 'note':
+            if kind == NOTE:
                 # Create a single note
-                n = note.Note(parsed['pitch'], quarterLength=parsed['duration'])
+                n = note.Note(table.names[idx][0], quarterLength=duration)
                 s.append(n)
                 note_count += 1
                 
-            elif parsed['type'] == 'chord':
+            elif kind == CHORD:
                 # Create a chord
-                chord_notes = []
-                for note_name in parsed['notes']:
-                    try:
-                        chord_notes.append(note_name.strip())
-                    except:
-                        continue
-                        
-                if chord_notes:
-                    c = chord.Chord(chord_notes, quarterLength=parsed['duration'])
-                    s.append(c)
-                    chord_count += 1
+                c = chord.Chord(list(table.names[idx]), quarterLength=duration)
+                s.append(c)
+                chord_count += 1
                     
-            elif parsed['type'] == 'rest':
+            elif kind == REST:
                 # Create a rest
-                r = note.Rest(quarterLength=parsed['duration'])
+                r = note.Rest(quarterLength=duration)
                 s.append(r)
                 rest_count += 1
                 
@@ -163,10 +114,8 @@ def generate_music(length=50, temperature=0.8, output_file="generated_music.mid"
     # Load vocabulary
     print("📚 Loading vocabulary...")
     try:
-        with open(vocab_path, 'r') as f:
-            vocab = json.load(f)
-        with open(itos_path, 'rb') as f:
-            itos = pickle.load(f)
+        vocab = get_vocab(vocab_path)
+        table = get_token_table(itos_path, len(vocab))  # per-token attributes, parsed once
         print(f"📚 Vocabulary size: {len(vocab)}")
     except Exception as e:
         print(f"❌ Error loading vocabulary: {e}")
@@ -175,7 +124,7 @@ def generate_music(length=50, temperature=0.8, output_file="generated_music.mid"
     # Load model
     print("🧠 Loading model...")
     try:
-        model = models.load_model(model_path)
+        model = get_model(model_path)
         print(f"🧠 Model loaded successfully")
         print(f"🧠 Model input shape: {model.input_shape}")
         print(f"🧠 Model output shape: {model.output_shape}")
@@ -190,49 +139,26 @@ def generate_music(length=50, temperature=0.8, output_file="generated_music.mid"
     sequence_length = model.input_shape[1]  # Should be 64
     seed_sequence = np.random.randint(0, len(vocab), size=sequence_length)
     
-    generated_tokens = []
-    current_sequence = seed_sequence.copy()
+    generated_ids = []
     
-    for i in range(length):
-        if i % 20 == 0:
-            print(f"Progress: {i}/{length}")
-        
-        # Prepare input
-        input_seq = current_sequence.reshape(1, sequence_length)
-        
-        # Get prediction
-        try:
-            prediction = model.predict(input_seq, verbose=0)
-            
-            # Apply temperature
-            if temperature != 1.0:
-                prediction = np.log(prediction + 1e-8) / temperature
-                prediction = np.exp(prediction)
-            
-            # Normalize probabilities
-            prediction = prediction / np.sum(prediction)
-            
-            # Sample next token
-            next_token_idx = np.random.choice(len(prediction[0]), p=prediction[0])
-            
-            # Convert to token string
-            if next_token_idx < len(itos):
-                token_str = itos[next_token_idx]
-                generated_tokens.append(token_str)
-            
-            # Update sequence for next iteration
-            current_sequence = np.append(current_sequence[1:], next_token_idx)
-            
-        except Exception as e:
-            print(f"❌ Error during generation step {i}: {e}")
-            break
+    def on_token(i, token):
+        # Collected as they arrive, so a failing step still keeps what came before it
+        generated_ids.append(token)
+        if (i + 1) % 20 == 0:
+            print(f"Progress: {i + 1}/{length}")
+    
+    try:
+        # The seed is encoded once, then each token costs a single decoder step
+        generate_ids(model, seed_sequence, length, on_token=on_token, temperature=temperature)
+    except Exception as e:
+        print(f"❌ Error during generation step {len(generated_ids)}: {e}")
     
-    print(f"✅ Generated {len(generated_tokens)} tokens!")
-    if generated_tokens:
-        print(f"Sample tokens: {generated_tokens[:10]}")
+    print(f"✅ Generated {len(generated_ids)} tokens!")
+    if generated_ids:
+        print(f"Sample tokens: {[table.tokens[idx] for idx in generated_ids[:10]]}")
     
     # Convert to MIDI
-    success = tokens_to_midi(generated_tokens, output_path)
+    success = tokens_to_midi(generated_ids, output_path, table)
     
     if success:
         print("\n🎉 SUCCESS! Music generated!")
@@ -0,0 +1,146 @@
+"""Prepared training datasets, materialised once on disk.
+
+Mapping tokens to ids, windowing and splitting the corpus is deterministic
+given the processed corpus and a few config values, so the resulting
+(window, next-token) pairs are saved with `tf.data.Dataset.save` under
+outputs/cache/datasets/<key>/ and later runs load them and start streaming
+batches immediately.
+"""
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import tensorflow as tf
+
+from src.utils.dataio import load_vocab, make_sequences
+
+# Token format produced by src.data.preprocess.event_to_token; bump when it changes
+TOKENIZER = 'event-v1'
+CACHE_ROOT = os.path.join('outputs', 'cache', 'datasets')
+
+def dataset_cache_key(proc_dir: str, data_cfg: dict) -> str:
+    """Hash of the processed corpus + every config value that changes the windows."""
+    h = hashlib.sha1()
+    for name in ('tokens.txt', 'vocab.json'):
+        with open(os.path.join(proc_dir, name), 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+    relevant = {k: data_cfg.get(k) for k in ('sequence_length', 'val_split', 'test_split')}
+    relevant['tokenizer'] = data_cfg.get('tokenizer', TOKENIZER)
+    h.update(json.dumps(relevant, sort_keys=True).encode())
+    return h.hexdigest()[:16]
+
+def load_corpus_ids(proc_dir: str):
+    """tokens.txt + vocab.json -> (flat int32 id stream, vocab size)."""
+    with open(os.path.join(proc_dir, 'tokens.txt'), 'r', encoding='utf-8') as f:
+        tokens = [line.strip() for line in f if line.strip()]
+    stoi = load_vocab(os.path.join(proc_dir, 'vocab.json'))
+    return np.array([stoi[t] for t in tokens if t in stoi], dtype=np.int32), len(stoi)
+
+def prepare_windows(proc_dir: str, seq_len: int):
+    """tokens.txt + vocab.json -> (X windows, y next-token ids, vocab size)."""
+    ids, vocab_size = load_corpus_ids(proc_dir)
+    X_ids, y_ids = make_sequences(list(ids), seq_len)
+    X = np.array(X_ids, dtype=np.int32).reshape(-1, seq_len)
+    y = np.array(y_ids, dtype=np.int32)
+    return X, y, vocab_size
+
+def gather_windows(ids, starts, seq_len):
+    """Materialise windows from an index of start positions: X = ids[s:s+L], y = ids[s+L]."""
+    starts = np.asarray(starts)
+    X = ids[starts[:, None] + np.arange(seq_len)[None, :]]
+    y = ids[starts + seq_len]
+    return X, y
+
+def split_windows(X, y, val_split=0.1, test_split=0.0):
+    """Contiguous splits taken from the end of the corpus (train | val | test)."""
+    n = len(X)
+    n_test = int(n * (test_split or 0.0))
+    n_val = int(n * (val_split or 0.0))
+    n_train = n - n_val - n_test
+    return {
+        'train': (X[:n_train], y[:n_train]),
+        'val': (X[n_train:n_train + n_val], y[n_train:n_train + n_val]),
+        'test': (X[n_train + n_val:], y[n_train + n_val:]),
+    }
+
+def load_window_index(cfg: dict, cache_root: str = CACHE_ROOT):
+    """(ids, {split: window start positions}) for the cached splits.
+
+    Window i of a split is ids[starts[i]:starts[i] + L] -> ids[starts[i] + L],
+    in the same order as the saved dataset (train is pre-shuffled).
+    """
+    _, meta = load_or_build_splits(cfg, cache_root)
+    index_path = os.path.join(cache_root, meta['key'], 'index.npz')
+    if not os.path.exists(index_path):
+        # Caches built before the index existed: derive it from the same corpus
+        ids, _ = load_corpus_ids(cfg['data']['processed_dir'])
+        starts = _split_starts(len(ids), cfg['data'])
+        np.savez(index_path, ids=ids, **starts)
+    data = np.load(index_path)
+    return data['ids'], {name: data[name] for name in ('train', 'val', 'test')}
+
+def _split_starts(n_ids, data_cfg, seed=1234):
+    n_windows = max(n_ids - data_cfg['sequence_length'], 0)
+    starts = np.arange(n_windows, dtype=np.int64)
+    splits = split_windows(starts, starts, data_cfg.get('val_split', 0.1), data_cfg.get('test_split', 0.0))
+    out = {name: s for name, (s, _) in splits.items()}
+    out['train'] = out['train'][np.random.default_rng(seed).permutation(len(out['train']))]
+    return out
+
+def load_or_build_splits(cfg: dict, cache_root: str = CACHE_ROOT, seed: int = 1234):
+    """Return ({split: unbatched tf.data.Dataset}, meta) from the on-disk cache.
+
+    The cache is built on first use; the train split is shuffled once before
+    saving so later runs only need a small per-epoch shuffle buffer.
+    """
+    data_cfg = cfg['data']
+    proc_dir = data_cfg['processed_dir']
+    key = dataset_cache_key(proc_dir, data_cfg)
+    cache_dir = os.path.join(cache_root, key)
+    meta_path = os.path.join(cache_dir, 'meta.json')
+
+    if not os.path.exists(meta_path):
+        print(f"Building dataset cache {cache_dir} ...")
+        ids, vocab_size = load_corpus_ids(proc_dir)
+        starts = _split_starts(len(ids), data_cfg, seed)
+        splits = {name: gather_windows(ids, st, data_cfg['sequence_length']) for name, st in starts.items()}
+
+        # Write to a temp dir and rename so an interrupted build is never picked up
+        tmp_dir = cache_dir + '.tmp'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        meta = {'key': key, 'vocab_size': vocab_size, 'sequence_length': data_cfg['sequence_length'],
+                'tokenizer': data_cfg.get('tokenizer', TOKENIZER), 'sizes': {}}
+        for name, (Xs, ys) in splits.items():
+            meta['sizes'][name] = int(len(Xs))
+            if len(Xs):
+                tf.data.Dataset.from_tensor_slices((Xs, ys)).save(os.path.join(tmp_dir, name))
+        np.savez(os.path.join(tmp_dir, 'index.npz'), ids=ids, **starts)
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2)
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        os.replace(tmp_dir, cache_dir)
+    else:
+        print(f"Using cached dataset {cache_dir}")
+
+    with open(meta_path, 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    datasets = {name: tf.data.Dataset.load(os.path.join(cache_dir, name)) if size else None
+                for name, size in meta['sizes'].items()}
+    return datasets, meta
+
+def make_training_datasets(cfg: dict, batch_size: int, shuffle_buffer: int = 10000, cache_root: str = CACHE_ROOT):
+    """Batched, prefetched (train, val) datasets of (window, next-token id) pairs plus cache meta.
+
+    Targets are sparse ids; compile models with sparse_categorical_crossentropy.
+    """
+    datasets, meta = load_or_build_splits(cfg, cache_root)
+    train_ds = datasets['train'].shuffle(shuffle_buffer, reshuffle_each_iteration=True)
+    train_ds = train_ds.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+    val_ds = datasets.get('val')
+    if val_ds is not None:
+        val_ds = val_ds.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+    return train_ds, val_ds, meta
@@ -7,6 +7,10 @@ from typing import List, Dict, Tuple
 from music21 import converter, instrument, note, chord
 
 from src.utils.dataio import save_vocab
+from src.utils.smf import read_smf_tracks
+
+# music21 spellings of the 12 pitch classes, as in the vocabulary
+PITCH_NAMES = ('C', 'C#', 'D', 'E-', 'E', 'F', 'F#', 'G', 'G#', 'A', 'B-', 'B')
 
 def midi_to_events(midi_path: str):
     print(f"Processing {midi_path}...")
@@ -105,6 +109,37 @@ def midi_to_events(midi_path: str):
     print(f"Extracted {len(events)} events from {midi_path}")
     return events
 
+def _quantize(ql: float) -> float:
+    """Nearest multiple of 1/4 or 1/3 quarter note, like music21's default MIDI quantization."""
+    return min((round(ql * d) / d for d in (4, 3)), key=lambda q: abs(q - ql))
+
+def fast_midi_to_events(source) -> List[dict]:
+    """Events like midi_to_events from a path or MIDI bytes, without building a music21 score.
+
+    Reads the raw note events (src/utils/smf.py), quantizes onsets and
+    durations to the 1/4 and 1/3 grids and, like music21's MIDI import, joins
+    notes of one track with the same onset and duration into a chord; all
+    tracks then share one timeline (same-onset events get step 0).
+    Interactive paths such as UI uploads use it: it takes milliseconds where
+    converter.parse takes seconds.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            source = f.read()
+    groups = {}
+    for track, notes in enumerate(read_smf_tracks(source)):
+        for start, dur, pitch, _ in notes:
+            groups.setdefault((_quantize(start), track, _quantize(dur)), set()).add(pitch)
+    events = []
+    prev_offset = None
+    for (offset, _, dur), pitches in sorted(groups.items()):
+        names = [f"{PITCH_NAMES[p % 12]}{p // 12 - 1}" for p in sorted(pitches)]
+        step = 0.0 if prev_offset is None else offset - prev_offset
+        prev_offset = offset
+        events.append({'pitch': names if len(names) > 1 else names[0], 'duration': round(dur, 3),
+                       'step': round(step, 3)})
+    return events
+
 def event_to_token(ev: dict) -> str:
     # Token: P<pitch>|D<dur>|S<step>  or  CHORD:p1,p2|D<dur>|S<step>
     pitch = ev['pitch']
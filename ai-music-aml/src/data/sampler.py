@@ -0,0 +1,108 @@
+"""Loss-aware importance sampling of training windows.
+
+Most corpus windows are easy, repetitive chord patterns that the model learns
+within an epoch or two, yet uniform epochs keep revisiting all of them.  The
+sampler keeps a per-window loss estimate over the index of window start
+positions, draws windows with probability proportional to that loss (mixed
+with a uniform floor so every window keeps being visited) and attaches the
+importance weight 1 / (N * p_i) as a Keras sample weight, which keeps the
+expected gradient equal to the uniform one.  Loss estimates are refreshed by
+a callback every `refresh_epochs` epochs.
+
+Enable with train.importance_sampling.enabled in config.yaml.
+"""
+import math
+
+import numpy as np
+import tensorflow as tf
+
+from src.data.dataset import gather_windows, load_window_index
+
+class ImportanceSampler:
+    """Draws (window, next-token, weight) batches from start positions `starts` into `ids`."""
+    def __init__(self, ids, starts, seq_len, batch_size, uniform_mix=0.2, power=1.0, seed=None):
+        self.ids = np.asarray(ids)
+        self.starts = np.asarray(starts)
+        self.seq_len = seq_len
+        self.batch_size = batch_size
+        self.uniform_mix = uniform_mix
+        self.power = power
+        self.rng = np.random.default_rng(seed)
+        # Until the first refresh every window is equally "hard" -> uniform sampling
+        self.losses = np.ones(len(self.starts), dtype=np.float64)
+        self.probs = np.full(len(self.starts), 1.0 / len(self.starts))
+
+    def __len__(self):
+        return len(self.starts)
+
+    @property
+    def steps_per_epoch(self):
+        return math.ceil(len(self.starts) / self.batch_size)
+
+    def set_losses(self, losses):
+        """Replace the per-window loss estimates and recompute sampling probabilities."""
+        self.losses = np.maximum(np.asarray(losses, dtype=np.float64), 1e-6)
+        scores = self.losses ** self.power
+        self.probs = (1.0 - self.uniform_mix) * scores / scores.sum() + self.uniform_mix / len(scores)
+
+    def score(self, model, batch_size=1024):
+        """Per-window cross-entropy of `model` over every indexed window."""
+        losses = np.empty(len(self.starts), dtype=np.float64)
+        for start in range(0, len(self.starts), batch_size):
+            X, y = gather_windows(self.ids, self.starts[start:start + batch_size], self.seq_len)
+            probs = model(X, training=False).numpy().astype(np.float32)
+            losses[start:start + len(y)] = -np.log(probs[np.arange(len(y)), y] + 1e-9)
+        return losses
+
+    def sample(self):
+        """One batch: (X, y, importance weights)."""
+        idx = self.rng.choice(len(self.starts), size=self.batch_size, p=self.probs)
+        X, y = gather_windows(self.ids, self.starts[idx], self.seq_len)
+        weights = 1.0 / (len(self.starts) * self.probs[idx])
+        return X, y, weights.astype(np.float32)
+
+    def stats(self):
+        """Summary of the current distribution: effective sample size and weight range."""
+        weights = 1.0 / (len(self.probs) * self.probs)
+        ess = 1.0 / np.sum(self.probs ** 2)
+        return {'mean_loss': float(self.losses.mean()), 'ess_fraction': float(ess / len(self.probs)),
+                'min_weight': float(weights.min()), 'max_weight': float(weights.max())}
+
+    def dataset(self):
+        """Infinite tf.data pipeline of weighted batches; pair with steps_per_epoch in fit()."""
+        def gen():
+            while True:
+                yield self.sample()
+        signature = (tf.TensorSpec((None, self.seq_len), tf.int32),
+                     tf.TensorSpec((None,), tf.int32),
+                     tf.TensorSpec((None,), tf.float32))
+        return tf.data.Dataset.from_generator(gen, output_signature=signature).prefetch(tf.data.AUTOTUNE)
+
+class RefreshWindowLosses(tf.keras.callbacks.Callback):
+    """Re-scores every training window with the current model every `refresh_epochs` epochs."""
+    def __init__(self, sampler, refresh_epochs=1, verbose=1):
+        super().__init__()
+        self.sampler = sampler
+        self.refresh_epochs = max(int(refresh_epochs), 1)
+        self.verbose = verbose
+
+    def on_epoch_end(self, epoch, logs=None):
+        if (epoch + 1) % self.refresh_epochs:
+            return
+        self.sampler.set_losses(self.sampler.score(self.model))
+        if self.verbose:
+            s = self.sampler.stats()
+            print(f"Importance sampling: mean window loss {s['mean_loss']:.3f}, "
+                  f"ESS {s['ess_fraction']:.0%}, weights {s['min_weight']:.2f}-{s['max_weight']:.2f}")
+
+def importance_sampling_enabled(cfg):
+    return bool((cfg['train'].get('importance_sampling') or {}).get('enabled'))
+
+def make_importance_sampling(cfg, batch_size):
+    """(train dataset, steps_per_epoch, refresh callback) over the cached train split."""
+    is_cfg = cfg['train'].get('importance_sampling') or {}
+    ids, starts = load_window_index(cfg)
+    sampler = ImportanceSampler(ids, starts['train'], cfg['data']['sequence_length'], batch_size,
+                                uniform_mix=is_cfg.get('uniform_mix', 0.2), power=is_cfg.get('power', 1.0))
+    callback = RefreshWindowLosses(sampler, is_cfg.get('refresh_epochs', 1))
+    return sampler.dataset(), sampler.steps_per_epoch, callback
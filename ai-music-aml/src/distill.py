@@ -0,0 +1,214 @@
+"""Knowledge distillation: train a small `build_rnn` student on a larger teacher.
+
+The teacher (RNN or transformer checkpoint) is run once over every training
+window and its output distribution is cached to disk in compressed top-k form
+(indices + log-probs).  The student is then trained on a mix of the softened
+teacher distribution and the hard next-token targets.  At the end a small
+quality-vs-latency report is printed and written next to the student.
+"""
+import argparse, os, json, time, hashlib, numpy as np, yaml
+import tensorflow as tf
+from tensorflow.keras.models import load_model
+from tensorflow.keras.callbacks import Callback, ReduceLROnPlateau
+from src.utils.batching import resolve_batch_plan, build_optimizer
+from src.utils.dataio import load_vocab, make_sequences
+from src.models.rnn import build_rnn
+from src.models.transformer import CUSTOM_OBJECTS
+
+def load_tokens_and_vocab(proc_dir):
+    with open(os.path.join(proc_dir, 'tokens.txt'), 'r', encoding='utf-8') as f:
+        tokens = [line.strip() for line in f if line.strip()]
+    vocab = load_vocab(os.path.join(proc_dir, 'vocab.json'))
+    return tokens, vocab
+
+def teacher_cache_key(teacher_path, X, top_k):
+    """Cache key: teacher file identity + the exact windows + k."""
+    h = hashlib.sha1()
+    st = os.stat(teacher_path)
+    h.update(f"{os.path.abspath(teacher_path)}|{st.st_size}|{st.st_mtime_ns}|{top_k}".encode())
+    h.update(np.ascontiguousarray(X).tobytes())
+    return h.hexdigest()[:16]
+
+def cache_teacher_topk(teacher, teacher_path, X, top_k, cache_dir, batch_size=256):
+    """Run the teacher over X once and store its top-k log-probs.
+
+    Returns (indices, log_probs) of shape (N, top_k).  Later calls with the
+    same teacher checkpoint, windows and k load straight from the .npz file.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    key = teacher_cache_key(teacher_path, X, top_k)
+    cache_path = os.path.join(cache_dir, f'teacher_top{top_k}_{key}.npz')
+    if os.path.exists(cache_path):
+        data = np.load(cache_path)
+        print(f"Loaded cached teacher outputs from {cache_path}")
+        return data['indices'].astype(np.int32), data['log_probs'].astype(np.float32)
+
+    print(f"Caching teacher top-{top_k} outputs for {len(X)} windows...")
+    idx_dtype = np.uint16 if teacher.output_shape[-1] < 2 ** 16 else np.int32
+    indices = np.empty((len(X), top_k), dtype=idx_dtype)
+    log_probs = np.empty((len(X), top_k), dtype=np.float16)
+    for start in range(0, len(X), batch_size):
+        probs = teacher(X[start:start + batch_size], training=False)
+        # Teachers end in a softmax, so go back to log space before top-k
+        top = tf.math.top_k(tf.math.log(tf.cast(probs, tf.float32) + 1e-9), k=top_k)
+        indices[start:start + batch_size] = top.indices.numpy()
+        log_probs[start:start + batch_size] = top.values.numpy()
+    np.savez_compressed(cache_path, indices=indices, log_probs=log_probs)
+    print(f"Saved teacher cache to {cache_path} ({os.path.getsize(cache_path) / 1024:.0f} KB)")
+    return indices.astype(np.int32), log_probs.astype(np.float32)
+
+class Distiller(tf.keras.Model):
+    """Wraps the student; loss = alpha * T^2 * KL(teacher_T || student_T) + (1 - alpha) * CE."""
+    def __init__(self, student, temperature=2.0, alpha=0.5):
+        super().__init__()
+        self.student = student
+        self.temperature = temperature
+        self.alpha = alpha
+
+    def call(self, x, training=False):
+        return self.student(x, training=training)
+
+    def _distill_losses(self, x, y, t_idx, t_logp, training):
+        probs = tf.cast(self.student(x, training=training), tf.float32)
+        logp = tf.math.log(probs + 1e-9)
+        hard = -tf.reduce_mean(tf.gather(logp, y, batch_dims=1))
+        # Soften both distributions with the same temperature; the teacher is
+        # renormalised over its cached top-k support
+        t_soft = tf.nn.softmax(t_logp / self.temperature, axis=-1)
+        s_soft = tf.gather(tf.nn.log_softmax(logp / self.temperature, axis=-1), t_idx, batch_dims=1)
+        kl = tf.reduce_mean(tf.reduce_sum(t_soft * (tf.math.log(t_soft + 1e-9) - s_soft), axis=-1))
+        loss = self.alpha * (self.temperature ** 2) * kl + (1.0 - self.alpha) * hard
+        return loss, kl, hard
+
+    def train_step(self, data):
+        (x, t_idx, t_logp), y = data
+        with tf.GradientTape() as tape:
+            loss, kl, hard = self._distill_losses(x, y, t_idx, t_logp, training=True)
+        grads = tape.gradient(loss, self.student.trainable_variables)
+        self.optimizer.apply_gradients(zip(grads, self.student.trainable_variables))
+        return {'loss': loss, 'kl': kl, 'ce': hard}
+
+    def test_step(self, data):
+        (x, t_idx, t_logp), y = data
+        loss, kl, hard = self._distill_losses(x, y, t_idx, t_logp, training=False)
+        return {'loss': loss, 'kl': kl, 'ce': hard}
+
+class SaveStudent(Callback):
+    """Save the bare student (not the wrapper) whenever the monitored loss improves,
+    so every generator can load it like any other checkpoint."""
+    def __init__(self, student, path, monitor='val_loss'):
+        super().__init__()
+        self.student, self.path, self.monitor = student, path, monitor
+        self.best = np.inf
+
+    def on_epoch_end(self, epoch, logs=None):
+        score = (logs or {}).get(self.monitor)
+        if score is not None and score < self.best:
+            self.best = score
+            self.student.save(self.path)
+            print(f"Saved student to {self.path} ({self.monitor}={score:.4f})")
+
+def evaluate_quality(model, X, y, batch_size=256, teacher_top1=None):
+    """Held-out next-token cross-entropy, accuracy and (optionally) top-1 agreement."""
+    nll, correct, agree = 0.0, 0, 0
+    for start in range(0, len(X), batch_size):
+        probs = model(X[start:start + batch_size], training=False).numpy().astype(np.float32)
+        yb = y[start:start + batch_size]
+        nll += float(-np.log(probs[np.arange(len(yb)), yb] + 1e-9).sum())
+        pred = probs.argmax(axis=-1)
+        correct += int((pred == yb).sum())
+        if teacher_top1 is not None:
+            agree += int((pred == teacher_top1[start:start + batch_size]).sum())
+    n = max(len(X), 1)
+    report = {'cross_entropy': nll / n, 'perplexity': float(np.exp(nll / n)), 'accuracy': correct / n}
+    if teacher_top1 is not None:
+        report['teacher_agreement'] = agree / n
+    return report
+
+def measure_latency(model, seq_len, vocab_size, n_calls=50):
+    """Median ms per generated token at batch size 1 (one forward pass per token)."""
+    x = np.random.randint(0, vocab_size, size=(1, seq_len)).astype(np.int32)
+    for _ in range(5):  # warm-up / tracing
+        model(x, training=False)
+    times = []
+    for _ in range(n_calls):
+        t0 = time.perf_counter()
+        model(x, training=False).numpy()
+        times.append((time.perf_counter() - t0) * 1000.0)
+    return float(np.median(times))
+
+def main(config_path, teacher_path, out_dir='outputs/distill'):
+    cfg = yaml.safe_load(open(config_path, 'r'))
+    dcfg = cfg.get('distill', {})
+    proc_dir = cfg['data']['processed_dir']
+    seq_len = cfg['data']['sequence_length']
+    top_k = dcfg.get('top_k', 32)
+
+    tokens, stoi = load_tokens_and_vocab(proc_dir)
+    ids = [stoi[t] for t in tokens if t in stoi]
+    X_ids, y_ids = make_sequences(ids, seq_len)
+    X = np.array(X_ids, dtype=np.int32)
+    y = np.array(y_ids, dtype=np.int32)
+
+    # Contiguous hold-out at the end of the corpus
+    n_val = int(len(X) * cfg['data'].get('val_split', 0.1))
+    X_tr, y_tr = X[:len(X) - n_val], y[:len(X) - n_val]
+    X_val, y_val = X[len(X) - n_val:], y[len(X) - n_val:]
+
+    student = build_rnn(vocab_size=len(stoi), seq_len=seq_len,
+                        embedding_dim=dcfg.get('embedding_dim', 64),
+                        rnn_units=dcfg.get('rnn_units', 128))
+    # batch_size may be 'auto' (probed on the student); accumulation then reaches effective_batch_size
+    batch_size, accum_steps = resolve_batch_plan(cfg, student)
+    distiller = Distiller(student, temperature=dcfg.get('temperature', 2.0), alpha=dcfg.get('alpha', 0.5))
+    distiller.compile(optimizer=build_optimizer(cfg['train']['learning_rate'], accum_steps))
+
+    teacher = load_model(teacher_path, compile=False, custom_objects=CUSTOM_OBJECTS)
+    t_idx, t_logp = cache_teacher_topk(teacher, teacher_path, X, top_k, os.path.join(out_dir, 'cache'), batch_size)
+
+    def to_dataset(sl, shuffle):
+        ds = tf.data.Dataset.from_tensor_slices(((X[sl], t_idx[sl], t_logp[sl]), y[sl]))
+        if shuffle:
+            ds = ds.shuffle(buffer_size=len(X))
+        return ds.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+    train_ds = to_dataset(slice(0, len(X) - n_val), shuffle=True)
+    val_ds = to_dataset(slice(len(X) - n_val, len(X)), shuffle=False) if n_val else None
+
+    os.makedirs(out_dir, exist_ok=True)
+    student_path = os.path.join(out_dir, 'student.keras')
+    monitor = 'val_loss' if val_ds is not None else 'loss'
+    rlr = ReduceLROnPlateau(monitor=monitor, factor=0.5, patience=2, verbose=1)
+    print(f"Distilling {teacher_path} into student ({student.count_params():,} params) on {len(X_tr)} windows")
+    distiller.fit(train_ds, validation_data=val_ds, epochs=dcfg.get('epochs', cfg['train']['epochs']),
+                  callbacks=[rlr, SaveStudent(student, student_path, monitor)])
+    student = load_model(student_path, compile=False)
+
+    X_eval, y_eval = (X_val, y_val) if n_val else (X_tr, y_tr)
+    t_top1 = t_idx[len(X) - len(X_eval):, 0]
+    report = {}
+    for name, model in (('teacher', teacher), ('student', student)):
+        r = evaluate_quality(model, X_eval, y_eval, batch_size, None if name == 'teacher' else t_top1)
+        r['params'] = int(model.count_params())
+        r['ms_per_token'] = measure_latency(model, seq_len, len(stoi))
+        report[name] = r
+    report['speedup'] = report['teacher']['ms_per_token'] / max(report['student']['ms_per_token'], 1e-9)
+
+    print("\nModel      params      CE     PPL    acc   ms/token")
+    for name in ('teacher', 'student'):
+        r = report[name]
+        print(f"{name:8} {r['params']:>9,} {r['cross_entropy']:7.3f} {r['perplexity']:7.1f} "
+              f"{r['accuracy']:6.3f} {r['ms_per_token']:9.2f}")
+    print(f"Student agrees with teacher top-1 on {report['student']['teacher_agreement']:.1%} of windows, "
+          f"{report['speedup']:.1f}x faster per token")
+    with open(os.path.join(out_dir, 'report.json'), 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--config', default='config.yaml')
+    ap.add_argument('--teacher', required=True, help='Path to the large teacher model (keras)')
+    ap.add_argument('--out_dir', default='outputs/distill')
+    args = ap.parse_args()
+    main(args.config, args.teacher, args.out_dir)
@@ -1,7 +1,8 @@
 import argparse, os, json, numpy as np, yaml, tensorflow as tf
 from tensorflow.keras.models import load_model
 from src.utils.dataio import load_vocab
-from src.rl.reward import in_scale, rhythm_stability
+from src.rl.reward import token_rewards
+from src.utils.token_table import TokenTable
 
 def sample_with_temperature(logits, temperature=1.0):
     logits = logits / temperature
@@ -11,7 +12,7 @@ def sample_with_temperature(logits, temperature=1.0):
 def main(config_path, checkpoint, proc_dir, out_path, episodes=1000, temperature=1.0):
     cfg = yaml.safe_load(open(config_path, 'r'))
     stoi = load_vocab(os.path.join(proc_dir, 'vocab.json'))
-    itos = {i:t for t,i in stoi.items()}
+    rewards = token_rewards(TokenTable.from_stoi(stoi))
 
     model = load_model(checkpoint)
     seq_len = cfg['data']['sequence_length']
@@ -25,10 +26,8 @@ def main(config_path, checkpoint, proc_dir, out_path, episodes=1000, temperature
         with tf.GradientTape() as tape:
             logits = model(seq, training=True)
             idx = sample_with_temperature(logits[0], temperature)
-            tok = itos[idx]
-            # reward signal
-            parts = tok.split('|')
-            r = 0.5 * in_scale(parts[0]) + 0.5 * rhythm_stability(parts[1], parts[2])
+            # reward signal (precomputed per token id)
+            r = float(rewards[idx])
             # simple objective: encourage higher prob for rewarded token
             prob = tf.nn.softmax(logits)[0, idx]
             loss = -tf.math.log(prob + 1e-9) * (r - 0.5)  # baseline 0.5
@@ -1,42 +1,69 @@
-import argparse, os, numpy as np, yaml, tensorflow as tf
-from tensorflow.keras.models import load_model
-from src.utils.dataio import load_vocab
-from src.utils.midi import save_midi_from_tokens
+import argparse, os, numpy as np, yaml
+from src.inference.registry import get_model, get_vocab, get_token_table
+from src.inference.engine import generate_batch
+from src.inference.graph_loop import generate_graph
+from src.inference.speculative import speculative_generate
+from src.inference.longform import generate_long
+from src.inference.constraints import constraint_mask
+from src.utils.midi import save_midi_from_ids
 
-def temperature_sample(probs, temperature=1.0):
-    probs = np.asarray(probs).astype('float64')
-    if temperature <= 0:
-        # argmax
-        return int(np.argmax(probs))
-    logits = np.log(probs + 1e-12) / temperature
-    exp = np.exp(logits)
-    probs = exp / np.sum(exp)
-    return int(np.random.choice(len(probs), p=probs))
+def sample_paths(out_path, n):
+    """out.mid for a single piece, out_01.mid ... out_NN.mid for several."""
+    if n == 1:
+        return [out_path]
+    root, ext = os.path.splitext(out_path)
+    return [f"{root}_{i + 1:02d}{ext or '.mid'}" for i in range(n)]
 
-def main(model_type, checkpoint, out_path, config_path):
+def main(model_type, checkpoint, out_path, config_path, num_samples=1, temperatures=None, seed=None,
+         stop_on_sep=False, graph=False, xla=False, constraints=None, draft=None, spec_k=4, minutes=None):
     cfg = yaml.safe_load(open(config_path, 'r'))
     seq_len = cfg['data']['sequence_length']
     gen_len = cfg['generate']['length']
-    temp = cfg['generate']['temperature']
+    temps = temperatures or [cfg['generate']['temperature']]
 
-    stoi = load_vocab(os.path.join('outputs', 'processed', 'vocab.json'))
-    itos = {i:t for t,i in stoi.items()}
+    vocab_path = os.path.join('outputs', 'processed', 'vocab.json')
+    stoi = get_vocab(vocab_path)
+    model = get_model(checkpoint)
+    table = get_token_table(vocab_path, model.output_shape[-1])
 
-    model = load_model(checkpoint, compile=False)
+    # One random seed window per piece; all pieces advance together in one batch
+    seeds = [None if seed is None else seed + i for i in range(num_samples)]
+    prompts = np.stack([np.random.default_rng(s).integers(0, len(stoi), size=seq_len) for s in seeds])
+    temperatures = [temps[i % len(temps)] for i in range(num_samples)]
+    stop_id = stoi.get('<SEP>', 0) if stop_on_sep else None
+    # key / pitch_range / min_duration / chords_only, compiled once into a logit mask
+    mask = constraint_mask(table, **(constraints or {}))
+    if minutes:
+        # Long-form: one piece of the requested duration, appended to the file chunk by chunk
+        os.makedirs(os.path.dirname(out_path) or '.', exist_ok=True)
+        progress = lambda tokens, done: print(f"  {done:6.1f} / {minutes:g} min, {tokens} tokens")
+        info = generate_long(model, table, out_path, minutes, seed_ids=prompts[0], on_chunk=progress,
+                             temperature=temperatures[0], logit_mask=mask, rng=np.random.default_rng(seeds[0]))
+        print(f"Saved {info['minutes']:.1f} min ({info['tokens']} tokens, {info['notes']} notes) to {out_path}")
+        if info['stopped'] != 'minutes':
+            print(f"Stopped early ({info['stopped']}): the model kept emitting tokens that don't advance time")
+        return
+    if draft:
+        # Speculative decoding: the draft proposes spec_k tokens, the checkpoint verifies them in one pass
+        draft_model, pieces = get_model(draft), []
+        for prompt, t, s in zip(prompts, temperatures, seeds):
+            ids, stats = speculative_generate(model, draft_model, prompt, gen_len, k=spec_k, temperature=t,
+                                              logit_mask=mask, stop_id=stop_id, rng=np.random.default_rng(s))
+            print(f"Draft acceptance {stats['acceptance_rate']:.0%}, "
+                  f"{stats['tokens_per_target_call']:.2f} tokens per target call")
+            pieces.append(ids)
+    elif graph or xla:
+        # Whole batch in one graph call; one seed for the batch instead of one per piece
+        pieces = generate_graph(model, prompts, gen_len, temperatures=temperatures, seed=seed,
+                                stop_id=stop_id, jit_compile=xla, logit_mask=mask)
+    else:
+        pieces = generate_batch(model, prompts, gen_len, temperatures=temperatures, seeds=seeds, stop_id=stop_id,
+                                logit_mask=mask)
 
-    # Seed sequence (random)
-    seq = np.random.randint(0, len(stoi), size=(1, seq_len))
-
-    tokens = []
-    for _ in range(gen_len):
-        logits = model.predict(seq, verbose=0)[0]
-        probs = tf.nn.softmax(logits).numpy()
-        idx = temperature_sample(probs, temperature=temp)
-        tokens.append(itos[idx])
-        seq = np.concatenate([seq[:,1:], np.array([[idx]])], axis=1)
-
-    save_midi_from_tokens(tokens, out_path)
-    print('Saved to', out_path)
+    os.makedirs(os.path.dirname(out_path) or '.', exist_ok=True)
+    for ids, path in zip(pieces, sample_paths(out_path, num_samples)):
+        save_midi_from_ids(ids, table, path)
+        print('Saved to', path)
 
 if __name__ == '__main__':
     ap = argparse.ArgumentParser()
@@ -44,5 +71,25 @@ if __name__ == '__main__':
     ap.add_argument('--checkpoint', required=True)
     ap.add_argument('--out', default='outputs/generated.mid')
     ap.add_argument('--config', default='config.yaml')
+    ap.add_argument('--num_samples', type=int, default=1, help='Pieces generated together in one batch')
+    ap.add_argument('--temperatures', default=None,
+                    help='Comma-separated temperatures, cycled over the pieces (default: generate.temperature)')
+    ap.add_argument('--seed', type=int, default=None, help='Piece i uses seed + i')
+    ap.add_argument('--stop_on_sep', action='store_true', help='End a piece early when it samples <SEP>')
+    ap.add_argument('--graph', action='store_true', help='Run the whole generation loop as one compiled graph')
+    ap.add_argument('--xla', action='store_true', help='Like --graph, XLA-compiled')
+    ap.add_argument('--key', default=None, help="Only in-key tokens, e.g. 'C' or 'A minor'")
+    ap.add_argument('--pitch_range', default=None, help='e.g. C3-C6')
+    ap.add_argument('--min_duration', type=float, default=None, help='Shortest allowed duration (quarter notes)')
+    ap.add_argument('--chords_only', action='store_true')
+    ap.add_argument('--draft', default=None,
+                    help='Small draft model (e.g. outputs/distill/student.keras) for speculative decoding')
+    ap.add_argument('--spec_k', type=int, default=4, help='Draft tokens proposed per verification')
+    ap.add_argument('--minutes', type=float, default=None,
+                    help='Long-form mode: generate this many minutes of music in constant memory')
     args = ap.parse_args()
-    main(args.model_type, args.checkpoint, args.out, args.config)
+    constraints = dict(key=args.key, pitch_range=args.pitch_range, min_duration=args.min_duration,
+                       chords_only=args.chords_only)
+    temps = [float(t) for t in args.temperatures.split(',')] if args.temperatures else None
+    main(args.model_type, args.checkpoint, args.out, args.config, args.num_samples, temps, args.seed,
+         args.stop_on_sep, args.graph, args.xla, constraints, args.draft, args.spec_k, args.minutes)
@@ -0,0 +1,434 @@
+"""Continuous batching: concurrent generation requests share one decoding loop.
+
+A worker thread owns the model.  Requests are queued with `submit`; when the
+loop is idle it waits up to `max_wait_ms` after the first arrival for more to
+coalesce (up to `max_batch` rows), and while it is busy new requests join the
+running batch between decoding steps (iteration-level batching), so a short
+request never waits for a long one to finish.  Each step is one batched
+forward pass per cohort, the rows whose decoder states can be stacked
+(`decoder.merge_key`): every row for the LSTM, every full window for the
+sliding-window decoder, rows at the same position for the KV cache.
+
+    batcher = Batcher(model, max_batch=16, max_wait_ms=5)
+    request = batcher.submit(GenerationRequest(prompt_ids, 200, temperature=0.9, seed=1))
+    ids = request.result()   # or on_token / on_done callbacks, e.g. to wake an event loop
+
+Sampling is per request (its own Sampler, seed, filters and logit mask), so a
+request's output doesn't depend on what else shares its batch.  A request
+with `forced` ids is scored instead of sampled: those ids are fed one by one
+and their log-probabilities recorded.  `request.cancel()` (e.g. when a
+streaming client disconnects) drops the request before the next decoding
+step, freeing its batch row; it then fails with RequestCancelled.
+
+Admission control: each request has a priority, 'interactive' (default) or
+'batch', with its own queue of at most `max_queue` requests; `submit`
+raises QueueFull at once when it is full.  Interactive requests are
+admitted first.  While any are running or waiting, batch rows are held to
+`batch_share` of the batch and never take a row an interactive request
+needs: the rest are preempted between decoding steps, parked with their
+decoder state, and resumed exactly where they stopped once the interactive
+load drops.  Batch-only cohorts (e.g. KV-cache rows at other positions
+than every interactive row, which need forward passes of their own) then
+take turns at one pass every other step.  So interactive latency stays
+close to that of an idle server.  A request with `deadline_s` fails with DeadlineExceeded once that
+many seconds have passed since it was created, whether it is queued,
+parked or running (the ids generated so far are kept).
+
+`swap_model` replaces the model for requests admitted from then on; rows
+already running keep their cohort's decoder, so they finish on the model
+they started with (src/inference/hot_reload.py).
+"""
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from src.inference.engine import decoder_for
+from src.inference.prefix_cache import cached_prefill
+from src.inference.sampling import Sampler, probs_to_logits
+
+PRIORITIES = ('interactive', 'batch')
+
+class RequestCancelled(RuntimeError):
+    pass
+
+class QueueFull(RuntimeError):
+    pass
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+def _stale(request, now):
+    return request.cancelled or (request.deadline is not None and now > request.deadline)
+
+class GenerationRequest:
+    """One piece to generate (or score, with `forced`); filled in by the Batcher."""
+    def __init__(self, prompt, length=0, temperature=1.0, top_k=0, top_p=1.0, repetition_penalty=1.0,
+                 logit_mask=None, seed=None, stop_id=None, forced=None, on_token=None, on_done=None,
+                 priority='interactive', deadline_s=None):
+        self.prompt = np.asarray(prompt, dtype=np.int32).reshape(-1)
+        if not len(self.prompt):
+            raise ValueError("Need at least one prompt token")
+        if priority not in PRIORITIES:
+            raise ValueError(f"priority must be one of {PRIORITIES}, got {priority!r}")
+        self.forced = None if forced is None else [int(i) for i in forced]
+        self.length = len(self.forced) if self.forced is not None else int(length)
+        self.sampling = {'temperature': temperature, 'top_k': top_k, 'top_p': top_p,
+                         'repetition_penalty': repetition_penalty, 'logit_mask': logit_mask}
+        self.seed = seed
+        self.stop_id = stop_id
+        self.priority = priority
+        self.on_token = on_token      # on_token(request, id), called from the worker thread
+        self.on_done = on_done        # on_done(request), once, also on errors
+        self.ids = []
+        self.logprobs = []
+        self.error = None
+        self.cancelled = False
+        self.submitted = time.perf_counter()
+        self.deadline = None if deadline_s is None else self.submitted + float(deadline_s)
+        self.started = self.finished = None
+        self._done = threading.Event()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def cancel(self):
+        """Ask the batcher to drop this request; safe from any thread, a no-op once it is done."""
+        self.cancelled = True
+
+    def result(self, timeout=None):
+        """Generated ids, blocking until the request finishes; re-raises its error."""
+        if not self._done.wait(timeout):
+            raise TimeoutError("Generation request still running")
+        if self.error is not None:
+            raise self.error
+        return self.ids
+
+    def timing(self):
+        """{'queue_ms', 'total_ms'} once finished."""
+        started = self.started if self.started is not None else self.finished
+        return {'queue_ms': (started - self.submitted) * 1000, 'total_ms': (self.finished - self.submitted) * 1000}
+
+    def _finish(self, error=None):
+        self.error = error
+        self.finished = time.perf_counter()
+        self._done.set()
+        if self.on_done is not None:
+            self.on_done(self)
+
+class _Cohort:
+    """Rows decoded together: one decoder state batch and the next-token probs for each row."""
+    def __init__(self, decoder, requests, samplers, probs, state):
+        self.decoder = decoder
+        self.requests = requests
+        self.samplers = samplers
+        self.probs = probs
+        self.state = state
+
+    def select(self, rows):
+        """A cohort of just these rows (same decoder, gathered state)."""
+        state = self.state if len(rows) == len(self.requests) else self.decoder.reorder(self.state, rows)
+        return _Cohort(self.decoder, [self.requests[i] for i in rows], [self.samplers[i] for i in rows],
+                       self.probs[rows], state)
+
+class Batcher:
+    """Worker thread running every submitted request of one model through a shared batched decode loop."""
+    def __init__(self, model, max_batch=16, max_wait_ms=5.0, stateful=True, max_queue=256, batch_share=0.5):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.stateful = stateful
+        self.max_queue = max_queue
+        self.batch_limit = max(1, int(max_batch * batch_share))   # batch rows while interactive work runs
+        self.vocab_size = model.output_shape[-1]
+        self._queues = {p: deque() for p in PRIORITIES}
+        self._cond = threading.Condition()
+        self._cohorts = []
+        self._parked = deque()   # preempted batch rows, a single-row cohort each
+        self._stop = threading.Event()
+        self.steps = 0           # batched forward passes
+        self.rows = 0            # rows advanced by them
+        self.completed = 0
+        self.cancelled = 0
+        self.expired = 0
+        self.rejected = 0
+        self.preempted = 0
+        self.swaps = 0
+        self._turn = 0
+        self._thread = threading.Thread(target=self._run, name='batcher', daemon=True)
+        self._thread.start()
+
+    @property
+    def active(self):
+        return sum(len(c.requests) for c in self._cohorts)
+
+    def swap_model(self, model):
+        """Serve new requests with `model`; running and parked requests finish on the old one."""
+        if model.output_shape[-1] != self.vocab_size:
+            raise ValueError(f"New model has {model.output_shape[-1]} outputs, the vocabulary has {self.vocab_size}")
+        with self._cond:
+            self.model = model
+            self.swaps += 1
+
+    def _active(self, priority):
+        return sum(r.priority == priority for c in self._cohorts for r in c.requests)
+
+    def submit(self, request):
+        """Queue a request; bad ids (ValueError) and a full queue (QueueFull) are rejected here, not in the batch."""
+        if self._stop.is_set():
+            raise RuntimeError("Batcher is closed")
+        for ids in (request.prompt, request.forced or ()):
+            if len(ids) and not (0 <= min(ids) and max(ids) < self.vocab_size):
+                raise ValueError(f"Token ids must be in [0, {self.vocab_size})")
+        with self._cond:
+            queue = self._queues[request.priority]
+            if len(queue) >= self.max_queue:
+                self.rejected += 1
+                raise QueueFull(f"{self.max_queue} {request.priority} requests already queued, try again later")
+            queue.append(request)
+            self._cond.notify()
+        return request
+
+    def stats(self):
+        with self._cond:
+            queued = {p: len(q) for p, q in self._queues.items()}
+        return {'active': self.active, 'queued': sum(queued.values()), 'queued_by_priority': queued,
+                'parked': len(self._parked), 'completed': self.completed, 'cancelled': self.cancelled,
+                'expired': self.expired, 'rejected': self.rejected, 'preempted': self.preempted, 'swaps': self.swaps,
+                'steps': self.steps, 'mean_batch': self.rows / self.steps if self.steps else 0.0}
+
+    def close(self, timeout=5.0):
+        """Stop the worker; requests still queued or running fail with RuntimeError."""
+        self._stop.set()
+        with self._cond:
+            self._cond.notify()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._admit()
+                if self._cohorts:
+                    self._step()
+            except Exception as e:
+                # Never let the worker die: fail what was running and carry on
+                for cohort in self._cohorts + list(self._parked):
+                    for request in cohort.requests:
+                        if not request.done:
+                            request._finish(e)
+                self._cohorts = []
+                self._parked.clear()
+        error = RuntimeError("Batcher closed")
+        for cohort in self._cohorts + list(self._parked):
+            for request in cohort.requests:
+                request._finish(error)
+        with self._cond:
+            for queue in self._queues.values():
+                while queue:
+                    queue.popleft()._finish(error)
+
+    def _check(self, request, now):
+        """Fail the request if it was cancelled or its deadline has passed; True if it may carry on."""
+        if request.cancelled:
+            self.cancelled += 1
+            request._finish(RequestCancelled("Request cancelled"))
+            return False
+        if request.deadline is not None and now > request.deadline:
+            self.expired += 1
+            request._finish(DeadlineExceeded(f"Deadline passed after {(now - request.submitted) * 1000:.0f} ms"))
+            return False
+        return True
+
+    def _take(self, priority, n):
+        """Pop up to n queued requests of one priority."""
+        with self._cond:
+            queue = self._queues[priority]
+            return [queue.popleft() for _ in range(min(n, len(queue)))]
+
+    def _admit(self):
+        """Fill free rows: interactive requests first, then parked and queued batch work up to its limit.
+
+        When idle, wait `max_wait` after the first arrival for others to coalesce.
+        """
+        if not self._cohorts and not self._parked:
+            with self._cond:
+                if not any(self._queues.values()):
+                    self._cond.wait(0.1)
+                deadline = time.perf_counter() + self.max_wait
+                while (0 < sum(map(len, self._queues.values())) < self.max_batch
+                       and (remaining := deadline - time.perf_counter()) > 0):
+                    self._cond.wait(remaining)
+        now = time.perf_counter()
+        self._parked = deque(c for c in self._parked if self._check(c.requests[0], now))
+        stale = []
+        with self._cond:
+            for priority, queue in self._queues.items():
+                if any(_stale(r, now) for r in queue):
+                    live = deque()
+                    for request in queue:
+                        (stale if _stale(request, now) else live).append(request)
+                    self._queues[priority] = live
+        for request in stale:   # fail them now rather than when they reach the front of the queue
+            self._check(request, now)
+        with self._cond:
+            interactive = self._active('interactive') + len(self._queues['interactive'])
+        # batch rows allowed: all of them when no interactive work, else a share that leaves room for it
+        limit = self.max_batch if not interactive else max(min(self.batch_limit, self.max_batch - interactive), 0)
+        if self._active('batch') > limit:
+            self._preempt(self._active('batch') - limit)
+        new = self._take('interactive', self.max_batch - self.active)
+        room = min(self.max_batch - self.active - len(new), limit - self._active('batch'))
+        resumed = [self._parked.popleft() for _ in range(min(max(room, 0), len(self._parked)))]
+        if resumed:
+            self._cohorts.extend(resumed)
+            self._merge()
+        if room > len(resumed):
+            new += self._take('batch', room - len(resumed))
+        if new:
+            self._prefill(new)
+
+    def _preempt(self, n):
+        """Park n running batch rows (newest cohorts first), keeping their decoder state and next-token probs."""
+        for index in range(len(self._cohorts) - 1, -1, -1):
+            cohort = self._cohorts[index]
+            rows = [i for i, r in enumerate(cohort.requests) if r.priority == 'batch'][-n:]
+            if not rows:
+                continue
+            self._parked.extend(cohort.select([row]) for row in rows)
+            keep = [i for i in range(len(cohort.requests)) if i not in rows]
+            if keep:
+                self._cohorts[index] = cohort.select(keep)
+            else:
+                del self._cohorts[index]
+            self.preempted += len(rows)
+            n -= len(rows)
+            if n <= 0:
+                break
+
+    def _prefill(self, requests):
+        """Prefill new requests (one batch per prompt length) into new cohorts."""
+        with self._cond:
+            model = self.model
+        decoder = decoder_for(model, self.stateful)
+        groups = {}
+        now = time.perf_counter()
+        for request in requests:
+            if not self._check(request, now):
+                continue
+            if request.length <= 0:
+                self._retire(request)
+                continue
+            prompt = request.prompt[-decoder.seq_len:]
+            groups.setdefault(len(prompt), []).append((request, prompt))
+        for rows in groups.values():
+            now = time.perf_counter()
+            requests, prompts, samplers = [], [], []
+            for request, prompt in rows:
+                try:
+                    sampler = None
+                    if request.forced is None:
+                        sampler = Sampler(1, self.vocab_size, rng=np.random.default_rng(request.seed),
+                                          **request.sampling)
+                        sampler.observe_prompt(prompt[None, :])
+                except Exception as e:
+                    request._finish(e)
+                    continue
+                request.started = now
+                requests.append(request)
+                prompts.append(prompt)
+                samplers.append(sampler)
+            if not requests:
+                continue
+            try:
+                probs, state = cached_prefill(decoder, np.stack(prompts))
+            except Exception as e:
+                for request in requests:
+                    request._finish(e)
+                continue
+            self._cohorts.append(_Cohort(decoder, requests, samplers, probs, state))
+        self._merge()
+
+    def _merge(self):
+        """Stack cohorts whose states are compatible, so each step runs as few forward passes as possible."""
+        groups = {}
+        for cohort in self._cohorts:
+            groups.setdefault((id(cohort.decoder), cohort.decoder.merge_key(cohort.state)), []).append(cohort)
+        merged = []
+        for group in groups.values():
+            if len(group) == 1:
+                merged.append(group[0])
+                continue
+            decoder = group[0].decoder
+            merged.append(_Cohort(decoder, [r for c in group for r in c.requests],
+                                  [s for c in group for s in c.samplers],
+                                  np.concatenate([c.probs for c in group]), decoder.concat([c.state for c in group])))
+        self._cohorts = merged
+
+    def _step(self):
+        """Sample (or force) one token per row, retire finished rows, advance the rest one step.
+
+        While interactive rows run, batch-only cohorts take turns at one forward pass every other step.
+        """
+        cohorts = []
+        now = time.perf_counter()
+        waiting = set()
+        if self._active('interactive'):
+            background = [c for c in self._cohorts if all(r.priority == 'batch' for r in c.requests)]
+            if background:
+                self._turn += 1
+                turn = self._turn // 2 % len(background) if self._turn % 2 else -1
+                waiting = {id(c) for i, c in enumerate(background) if i != turn}
+        for cohort in self._cohorts:
+            if id(cohort) in waiting:
+                # Not their turn to decode, but cancellations and deadlines still free their rows now
+                alive = [row for row, request in enumerate(cohort.requests) if self._check(request, now)]
+                if alive:
+                    cohorts.append(cohort.select(alive))
+                continue
+            tokens, keep = [], []
+            for row, (request, sampler) in enumerate(zip(cohort.requests, cohort.samplers)):
+                if not self._check(request, now):
+                    continue
+                probs = cohort.probs[row]
+                if request.forced is not None:
+                    token = request.forced[len(request.ids)]
+                else:
+                    try:
+                        token = int(sampler(probs_to_logits(probs[None, :]))[0])
+                    except Exception as e:
+                        request._finish(e)
+                        continue
+                    if request.stop_id is not None and token == request.stop_id:
+                        self._retire(request)
+                        continue
+                request.ids.append(token)
+                request.logprobs.append(float(np.log(max(probs[token], 1e-12))))
+                if request.on_token is not None:
+                    request.on_token(request, token)
+                if len(request.ids) >= request.length:
+                    self._retire(request)
+                    continue
+                tokens.append(token)
+                keep.append(row)
+            if not keep:
+                continue
+            state = cohort.state if len(keep) == len(cohort.requests) else cohort.decoder.reorder(cohort.state, keep)
+            try:
+                cohort.probs, cohort.state = cohort.decoder.step(np.array(tokens, dtype=np.int32), state)
+            except Exception as e:
+                for row in keep:
+                    cohort.requests[row]._finish(e)
+                continue
+            cohort.requests = [cohort.requests[i] for i in keep]
+            cohort.samplers = [cohort.samplers[i] for i in keep]
+            self.steps += 1
+            self.rows += len(keep)
+            cohorts.append(cohort)
+        self._cohorts = cohorts
+        self._merge()
+
+    def _retire(self, request):
+        self.completed += 1
+        request._finish()
@@ -0,0 +1,119 @@
+"""Beam search and diverse beam search over the shared decoders.
+
+All beams of all prompts live in one decoder batch of N * beam_width rows,
+so every step is a single forward pass.  Beam bookkeeping is plain arrays
+(scores and lengths (N, W), token history (N, W, length)); after each step
+the surviving beams' parents are gathered with `decoder.reorder`, so cached
+LSTM / KV state follows its beam instead of being recomputed.
+
+Diverse beam search (Vijayakumar et al., 2016) splits the beams into
+`num_groups` groups that are expanded one after another within a step; a
+group's candidates are penalised by `diversity_penalty` for every time an
+earlier group already picked the same token this step.  The penalty only
+steers selection, beam scores stay plain log-probabilities.
+
+    results = beam_search(model, prompts, length=100, beam_width=4)
+    ids, score = results[0][0]      # best continuation of the first prompt
+"""
+import numpy as np
+
+from src.inference.engine import decoder_for
+from src.inference.prefix_cache import cached_prefill
+from src.inference.sampling import Sampler, probs_to_logits
+
+def _log_softmax(logits):
+    shifted = logits - logits.max(axis=-1, keepdims=True)
+    return shifted - np.log(np.exp(shifted).sum(axis=-1, keepdims=True))
+
+def _top(scores, k):
+    """Indices of the k largest entries per row, best first."""
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1)
+
+def beam_search(model, prompts, length, beam_width=4, num_groups=1, diversity_penalty=0.0,
+                length_penalty=1.0, stop_id=None, num_return=1, stateful=True,
+                repetition_penalty=1.0, no_repeat_ngram_size=0, logit_mask=None):
+    """Most likely continuations of each prompt.
+
+    prompts: (N, T) ids (the last window-length ids are used).  beam_width
+    must be a multiple of num_groups.  A beam ends at `length` tokens or when
+    it emits `stop_id` (not included); finished beams are ranked by total
+    log-probability / length ** length_penalty.  repetition_penalty and
+    no_repeat_ngram_size adjust the log-probabilities per beam like the
+    Sampler does; logit_mask ((V,) or per-prompt (N, V), see
+    src/inference/constraints.py) restricts the beams to allowed tokens.
+    Returns, per prompt, the best `num_return` (ids, score) pairs.
+    """
+    if beam_width % num_groups:
+        raise ValueError(f"beam_width ({beam_width}) must be a multiple of num_groups ({num_groups})")
+    decoder = decoder_for(model, stateful)
+    prompts = np.asarray(prompts, dtype=np.int32)[:, -decoder.seq_len:]
+    n, width, group = len(prompts), beam_width, beam_width // num_groups
+    vocab_size = model.output_shape[-1]
+    if length <= 0:
+        return [[([], 0.0)] * min(num_return, width) for _ in range(n)]
+
+    rows = np.repeat(np.arange(n), width)
+    probs, state = cached_prefill(decoder, prompts)
+    probs, state = probs[rows], decoder.reorder(state, rows)
+    if logit_mask is not None and np.ndim(logit_mask) == 2:
+        logit_mask = np.asarray(logit_mask)[rows]
+    penalties = Sampler(n * width, vocab_size, repetition_penalty=repetition_penalty,
+                        no_repeat_ngram_size=no_repeat_ngram_size, logit_mask=logit_mask)
+    penalties.observe_prompt(prompts[rows])
+
+    # Only the first beam of each group starts live, so a group doesn't fill up with copies
+    scores = np.full((n, width), -np.inf, dtype=np.float32)
+    scores[:, ::group] = 0.0
+    history = np.zeros((n, width, length), dtype=np.int32)
+    lengths = np.zeros((n, width), dtype=np.int32)
+    finished = np.zeros((n, width), dtype=bool)
+    batch = np.arange(n)[:, None]
+
+    for t in range(length):
+        logp = _log_softmax(penalties.process(probs_to_logits(probs))).reshape(n, width, vocab_size)
+        if stop_id is not None and finished.any():
+            # A finished beam can only repeat stop_id, at no cost
+            logp[finished] = -np.inf
+            logp[finished, stop_id] = 0.0
+        total = scores[:, :, None] + logp                                    # (N, W, V)
+        parents = np.empty((n, width), dtype=np.int64)
+        tokens = np.empty((n, width), dtype=np.int32)
+        picked = np.zeros((n, vocab_size), dtype=np.float32)                 # per-step token use by earlier groups
+        for g in range(num_groups):
+            beams = slice(g * group, (g + 1) * group)
+            candidates = total[:, beams].reshape(n, -1)
+            if g and diversity_penalty:
+                candidates = candidates - diversity_penalty * np.tile(picked, group)
+            best = _top(candidates, group)
+            parents[:, beams] = best // vocab_size + g * group
+            tokens[:, beams] = best % vocab_size
+            np.add.at(picked, (np.broadcast_to(batch, (n, group)), tokens[:, beams]), 1.0)
+
+        scores = total[batch, parents, tokens]
+        was_finished = finished[batch, parents]
+        lengths = lengths[batch, parents] + ~was_finished
+        finished = was_finished | (tokens == stop_id if stop_id is not None else False)
+        if stop_id is not None:
+            lengths -= (finished & ~was_finished)   # the stop token itself doesn't count
+        history = history[batch, parents]
+        history[:, :, t] = tokens
+        if finished.all() or t + 1 == length:
+            break
+        flat = (batch * width + parents).ravel()
+        state = decoder.reorder(state, flat)
+        penalties.reorder(flat)
+        penalties.observe(tokens.ravel())
+        probs, state = decoder.step(tokens.ravel(), state)
+
+    ranked = scores / np.maximum(lengths, 1) ** length_penalty
+    results = []
+    for i in range(n):
+        order = np.argsort(-ranked[i], kind='stable')[:num_return]
+        results.append([(history[i, b, :lengths[i, b]].tolist(), float(ranked[i, b])) for b in order])
+    return results
+
+def diverse_beam_search(model, prompts, length, beam_width=4, num_groups=2, diversity_penalty=0.5, **kwargs):
+    """beam_search with `num_groups` groups pushed apart by `diversity_penalty`."""
+    return beam_search(model, prompts, length, beam_width, num_groups, diversity_penalty, **kwargs)
@@ -0,0 +1,347 @@
+"""Decoding speed benchmark: ms/token for each generation method.
+
+    python -m src.inference.benchmark --rnn outputs/rnn/best.keras \
+        --transformer outputs/transformer/best.keras
+
+Every method generates `generate.length` tokens (config.yaml) at batch size 1
+from the same random seed window, after one untimed warm-up run.  "graph
+loop" runs the whole piece as one tf.while_loop call (src/inference/graph_loop.py),
+with and without XLA, against the Python-driven loops.  With
+--batch_sizes 1,4,16 it also reports generate_batch throughput per batch size,
+with --draft (e.g. the distilled student) speculative decoding's
+acceptance rate and speedup over plain decoding of the target, per
+temperature, and with --memory_minutes 1,4,16 the peak Python heap of
+long-form generation (src/inference/longform.py) against generating the
+same tokens in memory and writing them with music21.  Every run also times
+a window-length prompt prefill against a prefix-cache hit
+(src/inference/prefix_cache.py).  With --serve_batches 1,4,16 it starts the
+local inference server (src/inference/server.py) on the first checkpoint at
+each max_batch and reports requests/s and latency under --serve_clients
+concurrent HTTP clients, and with --priority_load 64 the latency of
+interactive requests, one after another, alone and next to 64 background
+requests with and without batch priority (src/inference/batcher.py).
+"""
+import argparse, gc, json, os, tempfile, time, tracemalloc, numpy as np, yaml
+from concurrent.futures import ThreadPoolExecutor
+
+from src.inference.engine import decoder_for, generate_batch, generate_ids
+from src.inference.graph_loop import generate_graph
+from src.inference.longform import generate_long
+from src.inference.prefix_cache import PrefixCache
+from src.inference.registry import get_model, get_token_table
+from src.inference.sampling import sample_from_probs
+from src.inference.batcher import Batcher, GenerationRequest
+from src.inference.client import ServerClient
+from src.inference.server import InferenceServer
+from src.inference.speculative import speculative_generate
+from src.utils.midi import save_midi_from_ids
+
+def _sampler(rng):
+    return lambda probs: sample_from_probs(probs, rng=rng)
+
+def predict_loop(model, seed_ids, length, rng):
+    """Baseline: one `model.predict` call per token over a sliding window."""
+    sample = _sampler(rng)
+    seq = np.asarray(seed_ids, dtype=np.int32)[None, :]
+    out = []
+    for _ in range(length):
+        idx = int(sample(model.predict(seq, verbose=0)[0]))
+        out.append(idx)
+        seq = np.concatenate([seq[:, 1:], np.array([[idx]], dtype=np.int32)], axis=1)
+    return out
+
+def compiled_loop(model, seed_ids, length, rng):
+    """Compiled full-window step per token."""
+    return generate_ids(model, seed_ids, length, _sampler(rng), stateful=False)
+
+def stateful_loop(model, seed_ids, length, rng):
+    """Incremental decoder: one LSTM step (RNN) or one KV-cached position (causal transformer) per token."""
+    return generate_ids(model, seed_ids, length, _sampler(rng), stateful=True)
+
+def graph_loop(model, seed_ids, length, rng, jit_compile=False):
+    """Whole piece in one tf.while_loop call (same decoder as stateful_loop)."""
+    return generate_graph(model, [seed_ids], length, seed=int(rng.integers(2 ** 31)), jit_compile=jit_compile)[0]
+
+def xla_loop(model, seed_ids, length, rng):
+    return graph_loop(model, seed_ids, length, rng, jit_compile=True)
+
+# kind -> [(method name, fn(model, seed_ids, length, rng) -> ids)]
+METHODS = {
+    'rnn': [('predict', predict_loop), ('compiled step', compiled_loop), ('stateful LSTM', stateful_loop),
+            ('graph loop', graph_loop), ('graph loop (XLA)', xla_loop)],
+    'transformer': [('predict', predict_loop), ('compiled step', compiled_loop),
+                    ('graph loop', graph_loop), ('graph loop (XLA)', xla_loop)],
+    'causal': [('predict', predict_loop), ('compiled step', compiled_loop), ('KV cache', stateful_loop),
+               ('graph loop', graph_loop), ('graph loop (XLA)', xla_loop)],
+}
+
+def time_method(fn, model, seed_ids, length, repeats=3, seed=0):
+    """Median ms/token over `repeats` runs, after one warm-up run.
+
+    The warm-up uses the full length: XLA compiles the graph loop once per
+    generated length, and that compile shouldn't be timed.
+    """
+    fn(model, seed_ids, length, np.random.default_rng(seed))
+    times = []
+    for r in range(repeats):
+        t0 = time.perf_counter()
+        fn(model, seed_ids, length, np.random.default_rng(seed + r))
+        times.append((time.perf_counter() - t0) * 1000.0 / length)
+    return float(np.median(times))
+
+def run(checkpoints, length, repeats=3):
+    results = {}
+    for kind, path in checkpoints.items():
+        model = get_model(path)
+        vocab_size = model.output_shape[-1]
+        seed_ids = np.random.default_rng(0).integers(0, vocab_size, size=model.input_shape[1]).tolist()
+        results[kind] = {}
+        for name, fn in METHODS[kind]:
+            results[kind][name] = time_method(fn, model, seed_ids, length, repeats)
+    return results
+
+def batch_throughput(model, length, batch_sizes, repeats=2):
+    """Tokens/sec of generate_batch for each batch size (no early stopping)."""
+    vocab_size, seq_len = model.output_shape[-1], model.input_shape[1]
+    out = {}
+    for b in batch_sizes:
+        prompts = np.random.default_rng(0).integers(0, vocab_size, size=(b, seq_len))
+        generate_batch(model, prompts, 8, seeds=range(b), stop_id=None)  # warm-up
+        times = []
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            generate_batch(model, prompts, length, seeds=range(b), stop_id=None)
+            times.append(time.perf_counter() - t0)
+        out[b] = b * length / float(np.median(times))
+    return out
+
+def speculative_report(target, draft, length, temperatures, k=4, repeats=3):
+    """Per temperature: plain vs speculative ms/token, acceptance rate and target tokens per call."""
+    vocab_size = target.output_shape[-1]
+    prompt_len = max(target.input_shape[1], draft.input_shape[1]) + 1
+    seed_ids = np.random.default_rng(0).integers(0, vocab_size, size=prompt_len).tolist()
+    report = {}
+    for t in temperatures:
+        stats = []
+        plain = lambda m, s, n, rng: generate_ids(m, s, n, temperature=t, rng=rng)
+        def speculative(m, s, n, rng):
+            ids, st = speculative_generate(m, draft, s, n, k=k, temperature=t, rng=rng)
+            stats.append(st)
+            return ids
+        base = time_method(plain, target, seed_ids, length, repeats)
+        spec = time_method(speculative, target, seed_ids, length, repeats)
+        report[t] = {'plain_ms': base, 'speculative_ms': spec, 'speedup': base / spec,
+                     'acceptance_rate': float(np.mean([s['acceptance_rate'] for s in stats])),
+                     'tokens_per_target_call': float(np.mean([s['tokens_per_target_call'] for s in stats]))}
+    return report
+
+def prefill_report(checkpoints, repeats=20):
+    """Per model: ms to prefill a window-length prompt, and to fetch it from a warm prefix cache."""
+    report = {}
+    for kind, path in checkpoints.items():
+        model = get_model(path)
+        decoder = decoder_for(model)
+        prompt = np.random.default_rng(0).integers(0, model.output_shape[-1], size=(1, model.input_shape[1]))
+        cache = PrefixCache()
+        cache.prefill(decoder, prompt)
+        timings = []
+        for fn in (lambda: decoder.prefill(prompt), lambda: cache.prefill(decoder, prompt)):
+            t0 = time.perf_counter()
+            for _ in range(repeats):
+                fn()
+            timings.append((time.perf_counter() - t0) * 1000 / repeats)
+        report[kind] = {'prefill_ms': timings[0], 'cached_ms': timings[1]}
+    return report
+
+def print_prefill(report):
+    print("\nPrompt prefill vs prefix-cache hit")
+    print(f"{'model':12} {'prefill ms':>10} {'cached ms':>10}")
+    for kind, r in report.items():
+        print(f"{kind:12} {r['prefill_ms']:10.2f} {r['cached_ms']:10.3f}")
+
+def server_report(path, vocab_path, length, batch_sizes, clients=16, requests=64):
+    """Per max_batch: requests/s and latency percentiles of `requests` generate calls from `clients` threads."""
+    report = {}
+    for max_batch in batch_sizes:
+        server = InferenceServer({'model': path}, vocab_path, port=0, max_batch=max_batch).start_in_thread()
+        client = ServerClient(f'http://127.0.0.1:{server.port}')
+        try:
+            client.generate(length=4, seed=0)  # warm-up
+            latencies = []
+
+            def one(i):
+                t0 = time.perf_counter()
+                client.generate(length=length, temperature=1.0, seed=i)
+                latencies.append((time.perf_counter() - t0) * 1000)
+            t0 = time.perf_counter()
+            with ThreadPoolExecutor(clients) as pool:
+                list(pool.map(one, range(requests)))
+            elapsed = time.perf_counter() - t0
+            report[max_batch] = {'requests_per_sec': requests / elapsed, 'p50_ms': float(np.percentile(latencies, 50)),
+                                 'p95_ms': float(np.percentile(latencies, 95)),
+                                 'mean_batch': client.health()['models']['model']['mean_batch']}
+        finally:
+            server.close()
+    return report
+
+def priority_report(model, length, background, probes=16, max_batch=16):
+    """Interactive latency percentiles (ms) idle, under `background` batch requests, and under the same load
+    submitted as interactive (no priorities)."""
+    prompt = np.random.default_rng(0).integers(0, model.output_shape[-1], size=model.input_shape[1])
+    report = {}
+    for name, load, priority in (('idle', 0, 'batch'), ('batch priority', background, 'batch'),
+                                 ('no priorities', background, 'interactive')):
+        batcher = Batcher(model, max_batch=max_batch, max_queue=background + probes)
+        try:
+            batcher.submit(GenerationRequest(prompt, length, seed=0)).result()   # warm-up
+            for i in range(load):
+                batcher.submit(GenerationRequest(prompt, length, seed=i, priority=priority))
+            latencies = []
+            for i in range(probes):
+                request = batcher.submit(GenerationRequest(prompt, length, seed=background + i))
+                request.result()
+                latencies.append(request.timing()['total_ms'])
+            report[name] = {'p50_ms': float(np.percentile(latencies, 50)),
+                            'p99_ms': float(np.percentile(latencies, 99)), 'preempted': batcher.preempted}
+        finally:
+            batcher.close()
+    return report
+
+def print_priority(report, length, background):
+    print(f"\nInteractive latency at length {length}, {background} background requests")
+    print(f"{'load':16} {'p50 ms':>8} {'p99 ms':>8} {'preempted':>10}")
+    for name, r in report.items():
+        print(f"{name:16} {r['p50_ms']:8.0f} {r['p99_ms']:8.0f} {r['preempted']:10d}")
+
+def print_server(report, length, clients):
+    print(f"\nInference server, {clients} concurrent clients, length {length}")
+    print(f"{'max_batch':>9} {'req/s':>8} {'vs 1':>6} {'p50 ms':>8} {'p95 ms':>8} {'mean batch':>11}")
+    base = next(iter(report.values()))['requests_per_sec']
+    for b, r in report.items():
+        print(f"{b:9d} {r['requests_per_sec']:8.1f} {r['requests_per_sec'] / base:5.1f}x {r['p50_ms']:8.0f} "
+              f"{r['p95_ms']:8.0f} {r['mean_batch']:11.1f}")
+
+def _peak_kib(fn):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / 1024.0
+    finally:
+        tracemalloc.stop()
+
+def memory_report(model, table, minutes_list, tempo_bpm=120):
+    """Per target duration: tokens generated and peak traced KiB, long-form vs in-memory."""
+    seed_ids = np.random.default_rng(0).integers(0, model.output_shape[-1], size=model.input_shape[1])
+    report = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'piece.mid')
+        generate_long(model, table, path, minutes=0.1, seed_ids=seed_ids)  # warm-up: decoder build isn't counted
+        for minutes in minutes_list:
+            info = {}
+            longform = _peak_kib(lambda: info.update(generate_long(model, table, path, minutes, tempo_bpm, seed_ids,
+                                                                   rng=np.random.default_rng(0))))
+            in_memory = _peak_kib(lambda: save_midi_from_ids(
+                generate_ids(model, seed_ids, info['tokens'], rng=np.random.default_rng(0)), table, path))
+            report[minutes] = {'tokens': info['tokens'], 'longform_kib': longform, 'in_memory_kib': in_memory}
+    return report
+
+def print_memory(report):
+    print("\nPeak traced memory vs piece length")
+    print(f"{'minutes':>7} {'tokens':>7} {'long-form KiB':>14} {'in-memory KiB':>14}")
+    for minutes, r in report.items():
+        print(f"{minutes:7.1f} {r['tokens']:7d} {r['longform_kib']:14.0f} {r['in_memory_kib']:14.0f}")
+
+def print_speculative(report, length, k):
+    print(f"\nSpeculative decoding (k={k}) at length {length}")
+    print(f"{'temp':>5} {'plain ms':>9} {'spec ms':>8} {'speedup':>8} {'accepted':>9} {'tok/call':>9}")
+    for t, r in report.items():
+        print(f"{t:5.2f} {r['plain_ms']:9.2f} {r['speculative_ms']:8.2f} {r['speedup']:7.2f}x "
+              f"{r['acceptance_rate']:9.0%} {r['tokens_per_target_call']:9.2f}")
+
+def print_throughput(throughput, length):
+    print(f"\nBatched generation throughput at length {length}")
+    print(f"{'model':12} {'batch':>5} {'tokens/s':>10} {'vs batch 1':>11} {'efficiency':>11}")
+    for kind, by_batch in throughput.items():
+        base = by_batch[min(by_batch)] / min(by_batch)
+        for b, tps in by_batch.items():
+            print(f"{kind:12} {b:5d} {tps:10.0f} {tps / base:10.1f}x {tps / base / b:10.0%}")
+
+def print_table(results, length):
+    print(f"\nms/token at length {length} (batch size 1)")
+    print(f"{'model':12} {'method':24} {'ms/token':>9} {'speedup':>8}")
+    for kind, methods in results.items():
+        base = next(iter(methods.values()))
+        for name, ms in methods.items():
+            print(f"{kind:12} {name:24} {ms:9.2f} {base / ms:7.1f}x")
+
+def main(config_path, rnn=None, transformer=None, causal=None, repeats=3, out=None, batch_sizes=None,
+         draft=None, spec_target='transformer', spec_k=4, spec_temperatures=(0.0, 0.5, 1.0), memory_minutes=None,
+         serve_batches=None, serve_clients=16, priority_load=None):
+    cfg = yaml.safe_load(open(config_path, 'r'))
+    length = cfg['generate']['length']
+    checkpoints = {k: v for k, v in (('rnn', rnn), ('transformer', transformer), ('causal', causal))
+                   if v and os.path.exists(v)}
+    if not checkpoints:
+        raise SystemExit("No checkpoints found; pass --rnn, --transformer and/or --causal")
+    results = run(checkpoints, length, repeats)
+    print_table(results, length)
+    report = {'length': length, 'ms_per_token': results, 'prefill': prefill_report(checkpoints)}
+    print_prefill(report['prefill'])
+    if batch_sizes:
+        report['tokens_per_sec'] = {kind: batch_throughput(get_model(path), length, batch_sizes)
+                                    for kind, path in checkpoints.items()}
+        print_throughput(report['tokens_per_sec'], length)
+    if draft:
+        if spec_target not in checkpoints:
+            raise SystemExit(f"--draft needs a --{spec_target} checkpoint to verify against")
+        report['speculative'] = speculative_report(get_model(checkpoints[spec_target]), get_model(draft), length,
+                                                   spec_temperatures, spec_k, repeats)
+        print_speculative(report['speculative'], length, spec_k)
+    if memory_minutes:
+        model = get_model(next(iter(checkpoints.values())))
+        table = get_token_table(os.path.join(cfg['data']['processed_dir'], 'vocab.json'), model.output_shape[-1])
+        report['memory'] = memory_report(model, table, memory_minutes)
+        print_memory(report['memory'])
+    if serve_batches:
+        vocab_path = os.path.join(cfg['data']['processed_dir'], 'vocab.json')
+        report['server'] = server_report(next(iter(checkpoints.values())), vocab_path, length, serve_batches,
+                                         serve_clients, 4 * serve_clients)
+        print_server(report['server'], length, serve_clients)
+    if priority_load:
+        report['priority'] = priority_report(get_model(next(iter(checkpoints.values()))), length, priority_load)
+        print_priority(report['priority'], length, priority_load)
+    if out:
+        with open(out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--config', default='config.yaml')
+    ap.add_argument('--rnn', default=os.path.join('outputs', 'rnn', 'best.keras'))
+    ap.add_argument('--transformer', default=os.path.join('outputs', 'transformer', 'best.keras'))
+    ap.add_argument('--causal', default=None, help='Checkpoint trained with model.transformer.causal: true')
+    ap.add_argument('--repeats', type=int, default=3)
+    ap.add_argument('--batch_sizes', default=None, help='e.g. 1,4,16: also measure batched throughput')
+    ap.add_argument('--out', default=None, help='Optional JSON file for the results')
+    ap.add_argument('--draft', default=None, help='Small draft model (e.g. outputs/distill/student.keras): '
+                                                  'also benchmark speculative decoding')
+    ap.add_argument('--spec_target', choices=['rnn', 'transformer', 'causal'], default='transformer',
+                    help='Which checkpoint verifies the draft')
+    ap.add_argument('--spec_k', type=int, default=4, help='Draft tokens per target call')
+    ap.add_argument('--spec_temperatures', default='0,0.5,1.0')
+    ap.add_argument('--memory_minutes', default=None,
+                    help='e.g. 1,4,16: peak memory of long-form vs in-memory generation (first checkpoint)')
+    ap.add_argument('--serve_batches', default=None,
+                    help='e.g. 1,4,16: inference server requests/s per max_batch (first checkpoint)')
+    ap.add_argument('--serve_clients', type=int, default=16, help='Concurrent clients for --serve_batches')
+    ap.add_argument('--priority_load', type=int, default=None,
+                    help='e.g. 64: interactive latency next to that many background requests (first checkpoint)')
+    args = ap.parse_args()
+    batch_sizes = [int(b) for b in args.batch_sizes.split(',')] if args.batch_sizes else None
+    main(args.config, args.rnn, args.transformer, args.causal, args.repeats, args.out, batch_sizes,
+         args.draft, args.spec_target, args.spec_k, [float(t) for t in args.spec_temperatures.split(',')],
+         [float(m) for m in args.memory_minutes.split(',')] if args.memory_minutes else None,
+         [int(b) for b in args.serve_batches.split(',')] if args.serve_batches else None, args.serve_clients,
+         args.priority_load)
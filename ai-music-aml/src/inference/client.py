@@ -0,0 +1,97 @@
+"""Client for the local inference server (src/inference/server.py); stdlib only, no TensorFlow import.
+
+    client = ServerClient('http://127.0.0.1:8765')
+    piece = client.generate(length=200, temperature=0.9, seed=1, as_midi=True)
+    open('piece.mid', 'wb').write(piece['midi'])
+    client.continue_midi(open('song.mid', 'rb').read(), length=150, mode='variation')
+    client.score(ids=piece['ids'])['perplexity']
+    for event, data in client.stream(length=200, temperature=0.9):   # 'token', 'chunk', then 'done'
+        ...
+
+Options are passed through as the JSON body (see the server docstring);
+'midi' in a response is decoded to bytes.  Errors raise ServerError with the
+HTTP status.
+"""
+import base64
+import json
+import urllib.error
+import urllib.request
+
+class ServerError(RuntimeError):
+    def __init__(self, status, message):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+
+class ServerClient:
+    def __init__(self, url='http://127.0.0.1:8765', timeout=300.0):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def _open(self, path, payload=None):
+        data = None if payload is None else json.dumps(payload).encode()
+        req = urllib.request.Request(self.url + path, data=data, headers={'Content-Type': 'application/json'})
+        try:
+            return urllib.request.urlopen(req, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read()).get('error', e.reason)
+            except ValueError:
+                message = e.reason
+            raise ServerError(e.code, message) from None
+
+    @staticmethod
+    def _decode(out):
+        if isinstance(out.get('midi'), str):
+            out['midi'] = base64.b64decode(out['midi'])
+        return out
+
+    def _request(self, path, payload=None):
+        with self._open(path, payload) as resp:
+            return self._decode(json.loads(resp.read()))
+
+    def health(self):
+        return self._request('/health')
+
+    def generate(self, **options):
+        return self._request('/generate', options)
+
+    def continue_midi(self, midi, **options):
+        """midi: bytes of a .mid file."""
+        return self._request('/continue', {**options, 'midi': base64.b64encode(midi).decode('ascii')})
+
+    def stream(self, midi=None, **options):
+        """Yield (event, data) while the server generates: /generate/stream, or /continue/stream with `midi`.
+
+        Events are 'token', 'chunk' (with chunk_tokens=N) and a final 'done'
+        (the normal response) or 'error' (raised as ServerError).  Closing the
+        generator early disconnects, which cancels the request on the server.
+        """
+        path = '/generate/stream'
+        if midi is not None:
+            path, options = '/continue/stream', {**options, 'midi': base64.b64encode(midi).decode('ascii')}
+        with self._open(path, options) as resp:
+            event, data = None, []
+            for line in resp:
+                line = line.decode().rstrip('\r\n')
+                if line.startswith('event:'):
+                    event = line[6:].strip()
+                elif line.startswith('data:'):
+                    data.append(line[5:].strip())
+                elif not line and event:
+                    payload = self._decode(json.loads('\n'.join(data)))
+                    if event == 'error':
+                        raise ServerError(500, payload.get('error'))
+                    yield event, payload
+                    if event == 'done':
+                        return
+                    event, data = None, []
+
+    def score(self, ids=None, tokens=None, midi=None, **options):
+        """Log-likelihood of token ids, token strings or a .mid file (bytes) under the served model."""
+        if midi is not None:
+            options['midi'] = base64.b64encode(midi).decode('ascii')
+        elif tokens is not None:
+            options['tokens'] = list(tokens)
+        else:
+            options['ids'] = [int(i) for i in ids]
+        return self._request('/score', options)
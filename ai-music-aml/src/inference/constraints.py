@@ -0,0 +1,122 @@
+"""Constrained decoding: vocabulary predicates compiled into logit masks.
+
+Each predicate ("stay in key", "pitch range", "minimum duration", "chords
+only", ...) is evaluated once over the whole vocabulary into a boolean
+(vocab,) array.  `logit_mask` combines any number of them, plus optional soft
+biases, into one additive float32 mask (0 = allowed, NEG_INF = banned), which
+the Sampler adds to the logits in a single vectorized operation per step:
+
+    vc = VocabConstraints(get_token_table(vocab_path))
+    mask = vc.logit_mask(vc.in_key('A', 'minor'), vc.pitch_range('C3', 'C6'),
+                         vc.min_duration(0.25), bias={'chords': np.log(1.1)})
+    generate_batch(model, prompts, 200, logit_mask=mask)
+
+Masks are plain arrays, so per-step constraints are just different masks (or
+a (batch, vocab) mask for per-row constraints) passed to `Sampler(...,
+logit_mask=...)` or `sampler(logits, mask)`.  Tokens without pitches
+(<SEP>) pass the pitch and duration predicates, so constraining never bans
+the stop token.
+"""
+import re
+
+import numpy as np
+
+from src.inference.sampling import NEG_INF
+from src.utils.token_table import TokenTable, pitch_class, pitch_to_midi
+
+SCALES = {
+    'major': (0, 2, 4, 5, 7, 9, 11),
+    'minor': (0, 2, 3, 5, 7, 8, 10),
+    'harmonic_minor': (0, 2, 3, 5, 7, 8, 11),
+    'dorian': (0, 2, 3, 5, 7, 9, 10),
+    'mixolydian': (0, 2, 4, 5, 7, 9, 10),
+    'pentatonic': (0, 2, 4, 7, 9),
+    'blues': (0, 3, 5, 6, 7, 10),
+}
+
+class VocabConstraints:
+    """Predicates over a TokenTable (or an id -> token mapping, parsed into one)."""
+    def __init__(self, table, vocab_size=None):
+        if not isinstance(table, TokenTable):
+            table = TokenTable(table, vocab_size)
+        self.table = table
+        self.vocab_size = table.vocab_size
+        self.is_chord = table.is_chord
+        self.is_special = table.is_special
+        self._cache = {}
+
+    def _cached(self, key, build):
+        if key not in self._cache:
+            self._cache[key] = build()
+        return self._cache[key]
+
+    def in_key(self, tonic, mode='major'):
+        """Every pitch of the token is in the scale (see SCALES)."""
+        def build():
+            root = pitch_class(tonic)
+            scale = sum(1 << ((root + i) % 12) for i in SCALES[mode])
+            return self.is_special | ((self.table.pc_mask & ~scale) == 0)
+        return self._cached(('key', tonic, mode), build)
+
+    def pitch_range(self, low='C3', high='C6'):
+        """Every pitch of the token lies in [low, high] (names or MIDI numbers)."""
+        lo = low if isinstance(low, int) else pitch_to_midi(low)
+        hi = high if isinstance(high, int) else pitch_to_midi(high)
+        return self._cached(('range', lo, hi),
+                            lambda: self.is_special | (self.table.n_pitches == 0)
+                            | ((self.table.low >= lo) & (self.table.high <= hi)))
+
+    def min_duration(self, quarter_length):
+        return self._cached(('min_dur', float(quarter_length)),
+                            lambda: self.is_special | (self.table.duration >= quarter_length - 1e-6))
+
+    def max_duration(self, quarter_length):
+        return self._cached(('max_dur', float(quarter_length)),
+                            lambda: self.is_special | (self.table.duration <= quarter_length + 1e-6))
+
+    def chords_only(self):
+        return self._cached(('chords',), lambda: self.is_special | self.is_chord)
+
+    def notes_only(self):
+        return self._cached(('notes',), lambda: self.is_special | ~self.is_chord)
+
+    def chord_tones(self, pitch_classes):
+        """Tokens whose pitches all belong to the given pitch classes (names or 0..11)."""
+        pcs = sorted({p % 12 if isinstance(p, int) else pitch_class(p) for p in pitch_classes})
+        allowed = sum(1 << p for p in pcs)
+        return self._cached(('tones', tuple(pcs)), lambda: self.is_special | ((self.table.pc_mask & ~allowed) == 0))
+
+    def logit_mask(self, *allowed, bias=None):
+        """Additive (vocab,) mask: NEG_INF unless every `allowed` array permits the token.
+
+        bias: optional soft log-space boosts added on top, as {'chords' | 'notes':
+        value} or [(bool array, value), ...] (log(1.1) makes tokens 10% likelier).
+        """
+        mask = np.zeros(self.vocab_size, dtype=np.float32)
+        if allowed:
+            mask[~np.logical_and.reduce(allowed)] = NEG_INF
+        for which, value in (bias.items() if isinstance(bias, dict) else bias or ()):
+            if isinstance(which, str):
+                which = {'chords': self.is_chord, 'notes': self.table.is_note}[which]
+            mask += np.where(which, np.float32(value), np.float32(0.0))
+        return mask
+
+def constraint_mask(table, vocab_size=None, key=None, pitch_range=None, min_duration=None, chords_only=False):
+    """Logit mask from CLI/UI-style options, or None when nothing is constrained.
+
+    table: a TokenTable or an id -> token mapping.
+    key: 'C', 'A minor', 'D dorian'; pitch_range: 'C3-C6'; min_duration in quarter notes.
+    """
+    vc = VocabConstraints(table, vocab_size)
+    allowed = []
+    if key:
+        tonic, _, mode = key.strip().partition(' ')
+        allowed.append(vc.in_key(tonic, mode.strip().lower().replace(' ', '_') or 'major'))
+    if pitch_range:
+        low, high = re.split(r'(?<=\d)-', pitch_range.strip(), maxsplit=1)  # 'B-2-C6' is B-flat 2 to C6
+        allowed.append(vc.pitch_range(low, high))
+    if min_duration:
+        allowed.append(vc.min_duration(min_duration))
+    if chords_only:
+        allowed.append(vc.chords_only())
+    return vc.logit_mask(*allowed) if allowed else None
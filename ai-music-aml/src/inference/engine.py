@@ -0,0 +1,284 @@
+"""Generation core: compiled single-step inference and incremental decoders.
+
+`model.predict` is built for large batched datasets; called once per token on
+a batch of one, its per-call overhead (data adapter, callbacks, retracing)
+dwarfs the actual network math.  `compiled_step` wraps the model's forward
+pass in a `tf.function` with a fixed input signature, traced once per model
+and reused for every token of every generation in the process.
+
+On top of that, decoders share one interface so generation loops don't care
+how a model carries its context:
+
+    probs, state = decoder.prefill(ids)          # ids (B, T) -> probs (B, V)
+    probs, state = decoder.step(tokens, state)   # tokens (B,) -> next probs
+    state = decoder.reorder(state, indices)      # keep/duplicate batch rows
+    state = decoder.concat([state, ...])         # stack states with equal merge_key(state)
+
+`graph_prefill` / `graph_step` are the same two calls on tensors, for use
+inside a larger tf.function (src/inference/graph_loop.py); their state is a
+tuple of tensors whose shapes don't change from step to step.
+
+`WindowDecoder` re-runs the full window every token and works for any model;
+`LSTMDecoder` carries (h, c) and costs one LSTM step per token, so it can
+also run past the training window; `KVCacheDecoder` (src/inference/kv_cache.py)
+does the same for causal transformers with per-layer key/value caches.
+
+Prompts shorter than the model's window are prefilled as they are, in one
+forward pass (one LSTM scan for LSTMDecoder, one causal pass filling the KV
+cache for KVCacheDecoder), never padded: zero-padding would feed the model
+<SEP> tokens as context.  WindowDecoder runs short windows unpadded too, and
+grows the window with each sampled token until it reaches full length; for
+the non-causal transformer, attention and average pooling then cover only
+the real tokens, which is the masked forward pass.
+
+The generation loops prefill through `cached_prefill`
+(src/inference/prefix_cache.py), so a prompt seen before (a preset
+progression, a popular seed) starts decoding without any prefill.
+"""
+import itertools
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras import layers
+
+from src.inference.kv_cache import KVCacheDecoder, is_causal_transformer
+from src.inference.prefix_cache import cached_prefill
+from src.inference.sampling import Sampler, probs_to_logits
+from src.models.rnn import build_rnn_decoder
+
+def _cached(model, key, build):
+    """Per-model {key: compiled function / decoder}, kept on the model itself.
+
+    The cached functions and decoders refer back to the model, so a table
+    keyed by the model (even a WeakKeyDictionary) would keep it alive
+    forever; stored as a plain attribute they form a cycle the garbage
+    collector frees together with the model.  Written through vars() so
+    Keras' attribute tracking never sees it.
+    """
+    entry = vars(model).setdefault('_inference_cache', {})
+    if key not in entry:
+        entry[key] = build()
+    return entry[key]
+
+def compiled_step(model, jit_compile=False):
+    """tf.function mapping an int32 window batch (B, L) to float32 next-token probs (B, V)."""
+    def build():
+        seq_len = model.input_shape[1]
+
+        @tf.function(input_signature=[tf.TensorSpec([None, seq_len], tf.int32)], jit_compile=jit_compile)
+        def step(window):
+            return tf.cast(model(window, training=False), tf.float32)
+        return step
+    return _cached(model, ('step', bool(jit_compile)), build)
+
+def compiled_prefix_step(model):
+    """Like compiled_step, but for windows of any length up to the model's (short prompts)."""
+    def build():
+        @tf.function(input_signature=[tf.TensorSpec([None, None], tf.int32)])
+        def step(window):
+            return tf.cast(model(window, training=False), tf.float32)
+        return step
+    return _cached(model, 'prefix_step', build)
+
+def predict_next(model, window):
+    """Next-token probabilities (B, V) as NumPy for a window batch (or a single window)."""
+    window = np.asarray(window, dtype=np.int32)
+    if window.ndim == 1:
+        window = window[None, :]
+    return compiled_step(model)(window).numpy()
+
+class WindowDecoder:
+    """Sliding-window decoding: state is the (B, L) window, every step re-runs it.
+
+    A window shorter than L (a short prompt) grows by one token per step until
+    it is full, in graph_step too.  Causal transformers can't run short
+    windows (their output crops to the last of L positions); use
+    stateful=True (KVCacheDecoder).
+    """
+    def __init__(self, model):
+        self.model = model
+        self.seq_len = model.input_shape[1]
+        self._step = compiled_step(model)
+
+    def _run(self, window):
+        if window.shape[1] == self.seq_len:
+            return self._step(window).numpy()
+        return compiled_prefix_step(self.model)(window).numpy()
+
+    def prefill(self, ids):
+        window = np.asarray(ids, dtype=np.int32)[:, -self.seq_len:]
+        if not window.shape[1]:
+            raise ValueError("Need at least one prompt token")
+        if window.shape[1] < self.seq_len and is_causal_transformer(self.model):
+            raise ValueError(f"Need {self.seq_len} prompt tokens for a causal transformer without its KV cache, "
+                             f"got {window.shape[1]} (decode with stateful=True)")
+        return self._run(window), window
+
+    def step(self, tokens, window):
+        keep = window if window.shape[1] < self.seq_len else window[:, 1:]
+        window = np.concatenate([keep, np.asarray(tokens, dtype=np.int32)[:, None]], axis=1)
+        return self._run(window), window
+
+    def reorder(self, window, indices):
+        return window[np.asarray(indices)]
+
+    def concat(self, windows):
+        return np.concatenate(windows, axis=0)
+
+    def merge_key(self, window):
+        return window.shape[1]
+
+    def graph_prefill(self, ids):
+        window = ids[:, -self.seq_len:]
+        return tf.cast(self.model(window, training=False), tf.float32), (window,)
+
+    def graph_step(self, tokens, state):
+        # Same as step: drop the oldest id only once the window is full
+        window = tf.concat([state[0], tokens[:, None]], axis=1)[:, -self.seq_len:]
+        return tf.cast(self.model(window, training=False), tf.float32), (window,)
+
+class LSTMDecoder:
+    """Stateful decoding for `build_rnn` models: state is (h, c), O(1) work per token."""
+    def __init__(self, model):
+        self.model = model
+        self.seq_len = model.input_shape[1]
+        prefill, step = build_rnn_decoder(model)
+        self.prefill_model, self.step_model = prefill, step
+        self.units = step.input[1].shape[-1]
+        self._prefill = tf.function(lambda ids: prefill(ids, training=False),
+                                    input_signature=[tf.TensorSpec([None, None], tf.int32)])
+        self._step = tf.function(lambda token, h, c: step([token, h, c], training=False),
+                                 input_signature=[tf.TensorSpec([None, 1], tf.int32),
+                                                  tf.TensorSpec([None, self.units], tf.float32),
+                                                  tf.TensorSpec([None, self.units], tf.float32)])
+
+    def prefill(self, ids):
+        probs, h, c = self._prefill(np.asarray(ids, dtype=np.int32))
+        return probs.numpy(), (h, c)
+
+    def step(self, tokens, state):
+        probs, h, c = self._step(np.asarray(tokens, dtype=np.int32)[:, None], *state)
+        return probs.numpy(), (h, c)
+
+    def reorder(self, state, indices):
+        return tuple(tf.gather(s, indices) for s in state)
+
+    def concat(self, states):
+        return tuple(tf.concat(s, axis=0) for s in zip(*states))
+
+    def merge_key(self, state):
+        return None  # rows carry their own (h, c), whatever their position
+
+    def graph_prefill(self, ids):
+        probs, h, c = self.prefill_model(ids, training=False)
+        return probs, (h, c)
+
+    def graph_step(self, tokens, state):
+        probs, h, c = self.step_model([tokens[:, None], *state], training=False)
+        return probs, (h, c)
+
+def is_lstm_model(model):
+    return any(isinstance(l, layers.LSTM) for l in model.layers)
+
+def decoder_for(model, stateful=True):
+    """Cached decoder for `model`.
+
+    stateful=True picks LSTMDecoder for build_rnn models and KVCacheDecoder for
+    causal transformers; everything else (and stateful=False) uses WindowDecoder.
+    """
+    if stateful and is_lstm_model(model):
+        return _cached(model, ('decoder', 'lstm'), lambda: LSTMDecoder(model))
+    if stateful and is_causal_transformer(model):
+        return _cached(model, ('decoder', 'kv'), lambda: KVCacheDecoder(model))
+    return _cached(model, ('decoder', 'window'), lambda: WindowDecoder(model))
+
+def iter_ids(model, seed_ids, length, sample_fn=None, stateful=True, **sampling):
+    """Yield `length` new ids after `seed_ids`, each as soon as it is sampled.
+
+    The next step is only computed when the consumer asks for the next id, so
+    the first id arrives after just the prompt prefill.  length=None never
+    stops (the consumer decides when to).  Other arguments are as for
+    generate_ids.
+    """
+    decoder = decoder_for(model, stateful)
+    prompt = np.asarray(seed_ids[-decoder.seq_len:], dtype=np.int32)[None, :]
+    if sample_fn is None:
+        sampler = Sampler(1, model.output_shape[-1], **sampling)
+        sampler.observe_prompt(prompt)
+        sample_fn = lambda probs: sampler(probs_to_logits(probs[None, :]))[0]
+    probs, state = cached_prefill(decoder, prompt)
+    for i in (itertools.count() if length is None else range(length)):
+        idx = int(sample_fn(probs[0]))
+        yield idx
+        if length is None or i + 1 < length:
+            probs, state = decoder.step(np.array([idx]), state)
+
+def generate_ids(model, seed_ids, length, sample_fn=None, on_token=None, stateful=True, **sampling):
+    """Generate `length` new ids after `seed_ids` (the last window-length ids are the prompt).
+
+    Shorter seeds are fine: the prompt is prefilled as it is (see the module
+    docstring) rather than padded.
+
+    sample_fn(probs (V,)) -> id, or by default a Sampler built from **sampling
+    (temperature, top_k, top_p, repetition_penalty, no_repeat_ngram_size, rng,
+    logit_mask);
+    on_token(step, id) is called after each token.
+    With stateful=True an RNN carries its LSTM state (a causal transformer its
+    KV cache) instead of re-reading the window, so the result can depend on
+    more than the last window of tokens.
+    """
+    out = []
+    for i, idx in enumerate(iter_ids(model, seed_ids, length, sample_fn, stateful, **sampling)):
+        out.append(idx)
+        if on_token is not None:
+            on_token(i, idx)
+    return out
+
+def generate_batch(model, prompts, lengths, temperatures=1.0, seeds=None, stop_id=0, stateful=True,
+                   top_k=0, top_p=1.0, repetition_penalty=1.0, no_repeat_ngram_size=0, logit_mask=None):
+    """Generate several pieces together, one batched forward pass per step.
+
+    prompts: (N, T) ids (equal length; the last window-length ids are used).
+    lengths / temperatures / seeds: scalars or per-piece lists.  A piece stops
+    at its own length or when it samples `stop_id` (<SEP>, not included in
+    the output); finished rows are dropped from the batch so the remaining
+    ones don't pay for them.  Each piece samples from its own seeded
+    generator, so its output doesn't depend on what else is in the batch.
+    top_k / top_p / repetition_penalty / no_repeat_ngram_size configure the
+    Sampler (src/inference/sampling.py); logit_mask is a (V,) or per-piece
+    (N, V) additive constraint mask (src/inference/constraints.py).
+    Returns a list of N id lists.
+    """
+    decoder = decoder_for(model, stateful)
+    prompts = np.asarray(prompts, dtype=np.int32)[:, -decoder.seq_len:]
+    n = len(prompts)
+    lengths = np.broadcast_to(np.asarray(lengths, dtype=np.int64), (n,))
+    seeds = [None] * n if seeds is None else list(seeds)
+
+    outputs = [[] for _ in range(n)]
+    active = np.flatnonzero(lengths > 0)  # original index of each live batch row
+    if not len(active):
+        return outputs
+    sampler = Sampler(n, model.output_shape[-1], temperature=temperatures, top_k=top_k, top_p=top_p,
+                      repetition_penalty=repetition_penalty, no_repeat_ngram_size=no_repeat_ngram_size,
+                      rng=[np.random.default_rng(s) for s in seeds], logit_mask=logit_mask)
+    sampler.reorder(active)
+    sampler.observe_prompt(prompts[active])
+    probs, state = cached_prefill(decoder, prompts[active])
+    while len(active):
+        tokens = sampler(probs_to_logits(probs))
+        keep = []
+        for row, (i, tok) in enumerate(zip(active, tokens)):
+            if stop_id is not None and tok == stop_id:
+                continue
+            outputs[i].append(int(tok))
+            if len(outputs[i]) < lengths[i]:
+                keep.append(row)
+        if not keep:
+            break
+        if len(keep) < len(active):
+            state = decoder.reorder(state, keep)
+            sampler.reorder(keep)
+            tokens, active = tokens[keep], active[keep]
+        probs, state = decoder.step(tokens, state)
+    return outputs
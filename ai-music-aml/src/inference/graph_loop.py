@@ -0,0 +1,138 @@
+"""Whole-piece generation as a single graph call.
+
+`generate_batch` still returns to Python once per token to sample and feed
+the next step.  Here prefill, the sampling filters (src/inference/sampling.py
+tf_* functions), the decoder step and token emission all run inside one
+`tf.while_loop` in a `tf.function`, optionally XLA-compiled, so generating a
+piece is a single call with no per-token Python overhead:
+
+    ids = generate_graph(model, prompts, length=200, temperatures=0.9, seed=1, top_k=40)
+
+Filters that change the graph (top_k, top_p, repetition_penalty,
+no_repeat_ngram_size, stop_id) are fixed per compiled function; prompts,
+length, per-row temperatures, the seed and the constraint mask
+(src/inference/constraints.py) are inputs, so changing them doesn't retrace.  Sampling is stateless Gumbel-max keyed on (seed, step):
+the same seed and batch give the same pieces, but unlike generate_batch a
+row's draws depend on its position in the batch.
+"""
+import numpy as np
+import tensorflow as tf
+
+from src.inference.engine import WindowDecoder, _cached, decoder_for
+from src.inference.kv_cache import is_causal_transformer
+from src.inference.sampling import (tf_apply_repetition_penalty, tf_apply_temperature,
+                                    tf_apply_top_k, tf_apply_top_p, tf_gumbel_sample,
+                                    tf_no_repeat_ngram_mask)
+
+class GraphGenerator:
+    """Compiled prompt -> (B, length) ids loop around a decoder's graph_prefill/graph_step."""
+    def __init__(self, decoder, vocab_size, top_k=0, top_p=1.0, repetition_penalty=1.0,
+                 no_repeat_ngram_size=0, stop_id=None, jit_compile=False):
+        self.decoder = decoder
+        self.vocab_size = vocab_size
+        self.top_k = top_k
+        self.top_p = top_p
+        self.repetition_penalty = repetition_penalty
+        self.ngram = no_repeat_ngram_size
+        self.stop_id = stop_id
+        self._run = tf.function(self._graph, jit_compile=jit_compile, input_signature=[
+            tf.TensorSpec([None, None], tf.int32), tf.TensorSpec([], tf.int32),
+            tf.TensorSpec([None], tf.float32), tf.TensorSpec([2], tf.int32),
+            tf.TensorSpec([None, vocab_size], tf.float32)])
+
+    def _sample(self, probs, history, counts, pos, temperature, seed, step, mask):
+        """Filters + Gumbel-max on one (B, V) step; history[:, :pos] are the ids so far."""
+        logits = tf.math.log(tf.maximum(probs, 1e-12))
+        logits = tf_apply_repetition_penalty(logits, counts, self.repetition_penalty)
+        if self.ngram > 1:
+            logits += tf_no_repeat_ngram_mask(history, pos, self.ngram, self.vocab_size)
+        logits = tf_apply_temperature(logits, temperature) + mask
+        logits = tf_apply_top_p(tf_apply_top_k(logits, self.top_k), self.top_p)
+        ids = tf_gumbel_sample(logits, tf.stack([seed[0], seed[1] + step]))
+        return tf.where(temperature <= 0, tf.cast(tf.argmax(logits, axis=-1), tf.int32), ids)
+
+    def _graph(self, prompts, length, temperature, seed, mask):
+        batch, prompt_len = tf.shape(prompts)[0], tf.shape(prompts)[1]
+        # Prompt + generated ids; only needed by the penalties, but cheap to keep
+        history = tf.concat([prompts, tf.zeros([batch, length], tf.int32)], axis=1)
+        columns = tf.range(prompt_len + length)[None, :]
+        stop = -1 if self.stop_id is None else self.stop_id
+
+        # Token counts for the repetition penalty, updated per step like Sampler.observe
+        counts = tf.reduce_sum(tf.one_hot(prompts, self.vocab_size, dtype=tf.int32), axis=1)
+
+        probs, state = self.decoder.graph_prefill(prompts)
+        tokens = self._sample(probs, history, counts, prompt_len, temperature, seed, 0, mask)
+        history = tf.where(columns == prompt_len, tokens[:, None], history)
+        counts += tf.one_hot(tokens, self.vocab_size, dtype=tf.int32)
+        done = tf.equal(tokens, stop)
+
+        def cond(i, tokens, history, counts, done, state):
+            return tf.logical_and(i < length, tf.logical_not(tf.reduce_all(done)))
+
+        def body(i, tokens, history, counts, done, state):
+            probs, state = self.decoder.graph_step(tokens, state)
+            pos = prompt_len + i
+            tokens = self._sample(probs, history, counts, pos, temperature, seed, i, mask)
+            # Finished rows keep emitting the stop id so the batch stays rectangular
+            tokens = tf.where(done, stop, tokens)
+            history = tf.where(columns == pos, tokens[:, None], history)
+            counts += tf.one_hot(tokens, self.vocab_size, dtype=tf.int32)
+            return i + 1, tokens, history, counts, tf.logical_or(done, tf.equal(tokens, stop)), state
+
+        steps, _, history, _, _, _ = tf.while_loop(
+            cond, body, (tf.constant(1), tokens, history, counts, done, state))
+        return history[:, prompt_len:prompt_len + steps]
+
+    def __call__(self, prompts, length, temperatures=1.0, seed=None, logit_mask=None):
+        """(B, n) ids as NumPy; n <= length (shorter if every row hit stop_id).
+
+        logit_mask: optional additive (V,) or (B, V) constraint mask.
+        """
+        prompts = np.asarray(prompts, dtype=np.int32)
+        temperatures = np.broadcast_to(np.asarray(temperatures, dtype=np.float32), (len(prompts),))
+        if seed is None:
+            seed = np.random.randint(2 ** 31)
+        if logit_mask is None:
+            logit_mask = np.zeros(self.vocab_size, dtype=np.float32)
+        mask = np.asarray(logit_mask, dtype=np.float32).reshape(-1, self.vocab_size)
+        out = self._run(prompts, np.int32(length), temperatures, np.array([seed, 0], dtype=np.int32), mask)
+        return out.numpy()
+
+def graph_generator(model, stateful=True, jit_compile=False, top_k=0, top_p=1.0,
+                    repetition_penalty=1.0, no_repeat_ngram_size=0, stop_id=None):
+    """Cached GraphGenerator for `model` and this filter configuration."""
+    decoder = decoder_for(model, stateful)
+    key = ('graph', type(decoder).__name__, bool(jit_compile), int(top_k or 0), float(top_p),
+           float(repetition_penalty), int(no_repeat_ngram_size), stop_id)
+    return _cached(model, key, lambda: GraphGenerator(
+        decoder, model.output_shape[-1], top_k, top_p, repetition_penalty,
+        no_repeat_ngram_size, stop_id, jit_compile))
+
+def generate_graph(model, prompts, length, temperatures=1.0, seed=None, stop_id=None, stateful=True,
+                   jit_compile=False, top_k=0, top_p=1.0, repetition_penalty=1.0, no_repeat_ngram_size=0,
+                   logit_mask=None):
+    """generate_batch counterpart running in one graph call; returns a list of id lists.
+
+    Rows stop at `length` or after sampling `stop_id` (not included), as in
+    generate_batch.  jit_compile=True compiles the loop with XLA.  A prompt
+    shorter than the window grows like in generate_batch, except under XLA
+    (shapes must stay fixed) or for a causal transformer without its KV
+    cache, which both need full windows.
+    """
+    prompts = np.asarray(prompts, dtype=np.int32)
+    if length <= 0:
+        return [[] for _ in prompts]
+    gen = graph_generator(model, stateful, jit_compile, top_k, top_p, repetition_penalty,
+                          no_repeat_ngram_size, stop_id)
+    if (isinstance(gen.decoder, WindowDecoder) and prompts.shape[1] < gen.decoder.seq_len
+            and (jit_compile or is_causal_transformer(model))):
+        raise ValueError(f"Need {gen.decoder.seq_len} prompt tokens for window decoding "
+                         f"{'under XLA' if jit_compile else 'of a causal transformer'}, got {prompts.shape[1]}")
+    ids = gen(prompts[:, -gen.decoder.seq_len:], length, temperatures, seed, logit_mask)
+    out = []
+    for row in ids.tolist():
+        if stop_id is not None and stop_id in row:
+            row = row[:row.index(stop_id)]
+        out.append(row)
+    return out
@@ -0,0 +1,134 @@
+"""Pick up retrained checkpoints without restarting the process.
+
+The registry already keys models by file mtime, but only notices a new
+checkpoint when the next request asks for it, which then pays the load,
+and the inference server keeps whatever model it started with.
+`CheckpointWatcher` polls registered checkpoints from a background thread:
+
+    watcher = CheckpointWatcher(interval=2.0)
+    watcher.watch('outputs/rnn/best.keras', on_reload=lambda path, model: batcher.swap_model(model))
+
+When a file changes it waits until its size and mtime have stayed the same
+for `settle` seconds (ModelCheckpoint writes in place), then loads it
+through the registry, warms it up (a forward pass plus a prefill and a few
+decoding steps at batch sizes 1 and 2, so the decoders' tf.functions are
+traced and the prefix-cache fingerprint is computed), and only then calls
+`on_reload(path, model)`.  Requests never see a half-loaded model or pay
+the tracing.  A checkpoint that fails to load is reported in `stats()` and
+left alone until it changes again; the old model stays in service.
+"""
+import os
+import threading
+import time
+
+import numpy as np
+
+from src.inference.engine import decoder_for
+from src.inference.prefix_cache import model_fingerprint
+from src.inference.registry import REGISTRY
+
+def warm_up_decoders(model, stateful=True):
+    """Trace the decoder functions a generation request will call: prefill and step at batch 1 and 2."""
+    decoder = decoder_for(model, stateful)
+    model_fingerprint(model)
+    rng = np.random.default_rng(0)
+    for batch in (1, 2):
+        for length in {decoder.seq_len, min(4, decoder.seq_len)}:
+            try:
+                probs, state = decoder.prefill(rng.integers(0, model.output_shape[-1], size=(batch, length)))
+            except ValueError:   # short prompts on a causal model without its KV cache
+                continue
+            for _ in range(2):
+                probs, state = decoder.step(probs.argmax(axis=-1).astype(np.int32), state)
+            decoder.reorder(state, [0])
+
+def _signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+class _Watched:
+    def __init__(self, path, signature):
+        self.path = path
+        self.callbacks = []
+        self.loaded = signature      # signature of the version in service
+        self.pending = None          # (signature, first seen) of a change still being written
+        self.failed = None           # signature that failed to load
+        self.reloads = 0
+        self.error = None
+
+class CheckpointWatcher:
+    """Background thread reloading watched checkpoints when they change on disk (see module docstring)."""
+    def __init__(self, interval=2.0, settle=1.0, registry=REGISTRY, stateful=True):
+        self.interval = interval
+        self.settle = settle
+        self.registry = registry
+        self.stateful = stateful
+        self._watched = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def watch(self, path, on_reload=None):
+        """Start watching `path` (the version on disk now counts as loaded); on_reload(path, model) on changes."""
+        path = os.path.abspath(path)
+        with self._lock:
+            entry = self._watched.setdefault(path, _Watched(path, _signature(path)))
+            if on_reload is not None:
+                entry.callbacks.append(on_reload)
+            if self._thread is None and self.interval > 0:
+                self._thread = threading.Thread(target=self._run, name='checkpoint-watcher', daemon=True)
+                self._thread.start()
+
+    def unwatch(self, path):
+        with self._lock:
+            self._watched.pop(os.path.abspath(path), None)
+
+    def stats(self):
+        with self._lock:
+            return {path: {'reloads': w.reloads, 'error': w.error} for path, w in self._watched.items()}
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.interval + 1.0)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def check(self):
+        """One poll of every watched file; returns the paths reloaded."""
+        with self._lock:
+            watched = list(self._watched.values())
+        reloaded = []
+        now = time.monotonic()
+        for w in watched:
+            signature = _signature(w.path)
+            if signature is None or signature in (w.loaded, w.failed):
+                w.pending = None
+                continue
+            if w.pending is None or w.pending[0] != signature:
+                w.pending = (signature, now)   # still being written, or just finished: look again later
+                continue
+            if now - w.pending[1] < self.settle:
+                continue
+            w.pending = None
+            try:
+                model = self.registry.get_model(w.path)
+                warm_up_decoders(model, self.stateful)
+            except Exception as e:
+                w.failed = signature
+                w.error = f"{type(e).__name__}: {e}"
+                continue
+            w.loaded, w.failed, w.error = signature, None, None
+            w.reloads += 1
+            for callback in list(w.callbacks):
+                try:
+                    callback(w.path, model)
+                except Exception as e:
+                    w.error = f"{type(e).__name__}: {e}"
+            reloaded.append(w.path)
+        return reloaded
@@ -0,0 +1,149 @@
+"""KV-cached incremental decoding for `build_causal_transformer` models.
+
+Re-running the transformer over the whole window costs O(L^2) attention per
+generated token.  Here each layer's keys and values for past positions are
+kept in a fixed-size cache, so a step only embeds the new token, attends once
+over at most `capacity` cached positions and appends its own key/value: O(L)
+per token.
+
+The cache is a ring buffer of `capacity` slots (the training window by
+default).  Once it is full the oldest position is overwritten.  Because the
+causal model has no positional encoding, attention doesn't depend on where a
+key sits in the buffer, so decoding is exact up to `capacity` tokens and past
+that behaves like sliding-window attention (cached upper-layer keys still
+reflect the context they were computed in).
+
+The forward pass is written against float32 snapshots of the trained weights
+rather than the Keras layers, so mixed-precision policies set by training
+don't leak into decoding.
+"""
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras import layers
+
+def is_causal_transformer(model):
+    """build_causal_transformer models: attention layers but no pooling over the window."""
+    has_attention = any(isinstance(l, layers.MultiHeadAttention) for l in model.layers)
+    pooled = any(isinstance(l, layers.GlobalAveragePooling1D) for l in model.layers)
+    return has_attention and not pooled
+
+def _f32(v):
+    return tf.constant(np.asarray(v), dtype=tf.float32)
+
+def _layer_norm(x, gamma, beta, eps):
+    mean, var = tf.nn.moments(x, axes=[-1], keepdims=True)
+    return (x - mean) * tf.math.rsqrt(var + eps) * gamma + beta
+
+class KVCacheDecoder:
+    """prefill(ids) / step(tokens, state) decoder; state = (keys, values, count).
+
+    keys/values: (num_layers, B, capacity, heads, key_dim); count: tokens seen so far.
+    """
+    def __init__(self, model, capacity=None):
+        self.model = model
+        self.seq_len = model.input_shape[1]
+        self.capacity = capacity or self.seq_len
+        emb = next(l for l in model.layers if isinstance(l, layers.Embedding))
+        mhas = [l for l in model.layers if isinstance(l, layers.MultiHeadAttention)]
+        norms = [l for l in model.layers if isinstance(l, layers.LayerNormalization)]
+        denses = [l for l in model.layers if isinstance(l, layers.Dense)]
+        self.embeddings = _f32(emb.embeddings)
+        self.blocks = []
+        for i, mha in enumerate(mhas):
+            ln1, ln2 = norms[2 * i], norms[2 * i + 1]
+            ff1, ff2 = denses[2 * i], denses[2 * i + 1]
+            self.blocks.append({
+                'wq': _f32(mha._query_dense.kernel), 'bq': _f32(mha._query_dense.bias),
+                'wk': _f32(mha._key_dense.kernel), 'bk': _f32(mha._key_dense.bias),
+                'wv': _f32(mha._value_dense.kernel), 'bv': _f32(mha._value_dense.bias),
+                'wo': _f32(mha._output_dense.kernel), 'bo': _f32(mha._output_dense.bias),
+                'ln1': (_f32(ln1.gamma), _f32(ln1.beta), ln1.epsilon),
+                'ln2': (_f32(ln2.gamma), _f32(ln2.beta), ln2.epsilon),
+                'ff1': (_f32(ff1.kernel), _f32(ff1.bias)), 'ff2': (_f32(ff2.kernel), _f32(ff2.bias)),
+            })
+        self.head = (_f32(denses[-1].kernel), _f32(denses[-1].bias))
+        self.num_heads, self.key_dim = self.blocks[0]['wq'].shape[1:]
+        self.scale = 1.0 / float(np.sqrt(self.key_dim))
+
+        cache_spec = tf.TensorSpec([len(self.blocks), None, self.capacity, self.num_heads, self.key_dim], tf.float32)
+        self._prefill = tf.function(self._prefill_graph, input_signature=[tf.TensorSpec([None, None], tf.int32)])
+        self._step = tf.function(self._step_graph, input_signature=[
+            tf.TensorSpec([None], tf.int32), cache_spec, cache_spec, tf.TensorSpec([], tf.int32)])
+
+    def _block(self, blk, x, keys, values, mask):
+        """Post-LN block on x (B, T, d) attending over keys/values (B, S, h, k) under mask (T, S)."""
+        q = tf.einsum('btd,dhk->bthk', x, blk['wq']) + blk['bq']
+        scores = tf.einsum('bthk,bshk->bhts', q, keys) * self.scale
+        scores = tf.where(mask[None, None], scores, tf.constant(-1e9, tf.float32))
+        attn = tf.einsum('bhts,bshk->bthk', tf.nn.softmax(scores, axis=-1), values)
+        attn = tf.einsum('bthk,hkd->btd', attn, blk['wo']) + blk['bo']
+        x = _layer_norm(x + attn, *blk['ln1'])
+        ffn = tf.nn.relu(tf.matmul(x, blk['ff1'][0]) + blk['ff1'][1])
+        ffn = tf.matmul(ffn, blk['ff2'][0]) + blk['ff2'][1]
+        return _layer_norm(x + ffn, *blk['ln2'])
+
+    def _kv(self, blk, x):
+        return (tf.einsum('btd,dhk->bthk', x, blk['wk']) + blk['bk'],
+                tf.einsum('btd,dhk->bthk', x, blk['wv']) + blk['bv'])
+
+    def _probs(self, x_last):
+        return tf.nn.softmax(tf.matmul(x_last, self.head[0]) + self.head[1], axis=-1)
+
+    def _prefill_graph(self, ids):
+        """Whole prompt in parallel (causal mask), then pad each layer's K/V into the cache."""
+        ids = ids[:, -self.capacity:]
+        t = tf.shape(ids)[1]
+        mask = tf.linalg.band_part(tf.ones([t, t], tf.bool), -1, 0)
+        pad = [[0, 0], [0, self.capacity - t], [0, 0], [0, 0]]
+        x = tf.gather(self.embeddings, ids)
+        all_k, all_v = [], []
+        for blk in self.blocks:
+            k, v = self._kv(blk, x)
+            all_k.append(tf.pad(k, pad))
+            all_v.append(tf.pad(v, pad))
+            x = self._block(blk, x, k, v, mask)
+        return self._probs(x[:, -1]), tf.stack(all_k), tf.stack(all_v), t
+
+    def _step_graph(self, tokens, keys, values, count):
+        slot = count % self.capacity
+        write = tf.equal(tf.range(self.capacity), slot)[None, :, None, None]
+        valid = (tf.range(self.capacity) < tf.minimum(count + 1, self.capacity))[None, :]
+        x = tf.gather(self.embeddings, tokens)[:, None, :]
+        new_k, new_v = [], []
+        for i, blk in enumerate(self.blocks):
+            k, v = self._kv(blk, x)
+            k_all = tf.where(write, k, keys[i])
+            v_all = tf.where(write, v, values[i])
+            new_k.append(k_all)
+            new_v.append(v_all)
+            x = self._block(blk, x, k_all, v_all, valid)
+        return self._probs(x[:, 0]), tf.stack(new_k), tf.stack(new_v), count + 1
+
+    def prefill(self, ids):
+        probs, keys, values, count = self._prefill(np.asarray(ids, dtype=np.int32))
+        return probs.numpy(), (keys, values, count)
+
+    def step(self, tokens, state):
+        probs, keys, values, count = self._step(np.asarray(tokens, dtype=np.int32), *state)
+        return probs.numpy(), (keys, values, count)
+
+    def reorder(self, state, indices):
+        keys, values, count = state
+        return tf.gather(keys, indices, axis=1), tf.gather(values, indices, axis=1), count
+
+    def concat(self, states):
+        """Stack states along the batch axis (prompts of equal length share `count`)."""
+        keys, values, counts = zip(*states)
+        return tf.concat(keys, axis=1), tf.concat(values, axis=1), counts[0]
+
+    def merge_key(self, state):
+        """States can be concatenated only at the same position (the ring slot depends on it)."""
+        return int(state[2])
+
+    def graph_prefill(self, ids):
+        probs, keys, values, count = self._prefill_graph(ids)
+        return probs, (keys, values, count)
+
+    def graph_step(self, tokens, state):
+        probs, keys, values, count = self._step_graph(tokens, *state)
+        return probs, (keys, values, count)
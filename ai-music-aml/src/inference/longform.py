@@ -0,0 +1,78 @@
+"""Long-form generation: a target duration instead of a token count, in constant memory.
+
+The regular generators hold every token (and then a whole music21 stream)
+until the end, which is why the CLIs cap `length`.  `generate_long` keeps
+only what the next step needs: the decoder state (LSTM (h, c), a KV ring
+buffer or the sliding window, all bounded by the model's window), the
+Sampler's per-token counters and the notes still sounding.  Note events are
+appended to the MIDI file through `SMFWriter` and flushed every
+`chunk_tokens` tokens, so memory stays flat however long the piece runs and
+the file on disk is playable at every flush.
+
+    info = generate_long(model, table, 'outputs/long.mid', minutes=30, temperature=0.9)
+    info['tokens'], info['notes'], info['minutes']
+
+Only the memory-bounded sampling options are accepted (temperature, top_k,
+top_p, logit_mask, rng): the no-repeat n-gram table grows with the history.
+
+Zero-step tokens (chord tones, rests, specials) don't move the clock, so a
+model stuck on them would never reach `minutes`.  Generation therefore also
+stops after `max_tokens` (by default MAX_TOKENS_PER_BEAT per target beat,
+about four times the training corpus' density) or after `max_stalled`
+consecutive tokens that don't advance the onset.
+"""
+import math
+
+import numpy as np
+
+from src.inference.engine import iter_ids
+from src.inference.streaming import VELOCITY, iter_events
+from src.utils.smf import SMFWriter
+
+MAX_TOKENS_PER_BEAT = 16
+MAX_STALLED_TOKENS = 256
+
+def generate_long(model, table, out_path, minutes=30.0, tempo_bpm=120, seed_ids=None, chunk_tokens=256,
+                  max_tokens=None, max_stalled=MAX_STALLED_TOKENS, stateful=True, on_chunk=None,
+                  temperature=1.0, top_k=0, top_p=1.0, logit_mask=None, rng=None):
+    """Generate until the music reaches `minutes` at `tempo_bpm`, or a token bound is hit.
+
+    max_tokens defaults to MAX_TOKENS_PER_BEAT per target beat; max_stalled
+    ends a run of tokens that don't advance the onset (see the module
+    docstring).  seed_ids default to a random window.  on_chunk(tokens,
+    minutes) is called after every flush.  Returns {'tokens', 'notes',
+    'minutes', 'path', 'stopped'} with stopped one of 'minutes', 'max_tokens'
+    or 'stalled'.
+    """
+    target_beats = minutes * tempo_bpm
+    if max_tokens is None:
+        max_tokens = max(math.ceil(target_beats * MAX_TOKENS_PER_BEAT), 1)
+    if seed_ids is None:
+        seed_ids = np.random.default_rng().integers(0, model.output_shape[-1], size=model.input_shape[1])
+    ids = iter_ids(model, seed_ids, max_tokens, stateful=stateful, temperature=temperature, top_k=top_k,
+                   top_p=top_p, logit_mask=logit_mask, rng=rng)
+    tokens = notes = stalled = 0
+    beats = 0.0
+    stopped = 'max_tokens'
+    with SMFWriter(out_path, tempo_bpm) as midi:
+        for _, event in iter_events(ids, table):
+            tokens += 1
+            if event is not None:
+                if event['offset'] >= target_beats:
+                    stopped = 'minutes'
+                    break
+                for pitch in event['pitches']:
+                    midi.add(event['offset'], event['duration'], pitch, VELOCITY)
+                notes += 1
+            stalled = stalled + 1 if event is None or event['offset'] <= beats else 0
+            if event is not None:
+                beats = event['offset']
+            if tokens % chunk_tokens == 0:
+                midi.flush()
+                if on_chunk is not None:
+                    on_chunk(tokens, beats / tempo_bpm)
+            if max_stalled and stalled >= max_stalled:
+                stopped = 'stalled'
+                break
+    return {'tokens': tokens, 'notes': notes, 'minutes': beats / tempo_bpm, 'path': out_path,
+            'stopped': stopped}
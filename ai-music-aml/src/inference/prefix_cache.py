@@ -0,0 +1,118 @@
+"""LRU cache of decoder states reached after a prompt.
+
+The same prompts come back again and again: every chord_generator_v2
+preset (pop, jazz, blues, ...) encodes to a fixed seed, and the UI's note
+seeds repeat.  Each request used to prefill them from scratch.
+`cached_prefill` keeps the (probs, state) a decoder reached after each
+distinct prompt, keyed by (model fingerprint, decoder kind, prompt ids), so
+a repeated prompt skips prefill entirely and decoding starts straight from
+the stored LSTM (h, c), KV cache or window:
+
+    probs, state = cached_prefill(decoder, prompts)   # drop-in for decoder.prefill
+
+The fingerprint hashes the model's weights, so a retrained or reloaded
+checkpoint never sees states from the old one.  Entries are bounded both in
+number and in bytes (KV caches are much larger than LSTM states); the least
+recently used go first.  Decoder states are never modified in place (every
+step returns new arrays), which is what makes sharing them safe.
+"""
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import tensorflow as tf
+
+# model -> weights fingerprint; entries go away with the model
+_FINGERPRINTS = weakref.WeakKeyDictionary()
+
+def model_fingerprint(model):
+    """Hex digest of the model's architecture name and weights, computed once per model object."""
+    if model not in _FINGERPRINTS:
+        h = hashlib.sha1(model.__class__.__name__.encode())
+        for w in model.weights:
+            value = np.ascontiguousarray(w.numpy())
+            h.update(str(value.shape).encode())
+            h.update(value.tobytes())
+        _FINGERPRINTS[model] = h.hexdigest()
+    return _FINGERPRINTS[model]
+
+def _nbytes(state):
+    return sum(s.nbytes if isinstance(s, np.ndarray) else s.shape.num_elements() * s.dtype.size
+               for s in tf.nest.flatten(state))
+
+class PrefixCache:
+    """LRU-bounded, thread-safe map of (fingerprint, decoder kind, prompt ids) -> (probs, state)."""
+    def __init__(self, max_entries=256, max_bytes=64 * 2 ** 20):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()   # key -> (probs (V,), single-row state, nbytes)
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _kind(decoder):
+        return type(decoder).__name__, getattr(decoder, 'capacity', None)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[:2]
+
+    def put(self, key, probs, state):
+        size = probs.nbytes + _nbytes(state)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)[2]
+            self._entries[key] = (probs, state, size)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self.bytes -= self._entries.popitem(last=False)[1][2]
+
+    def prefill(self, decoder, ids):
+        """decoder.prefill(ids) for an (B, T) prompt batch, reusing the states of prompts seen before.
+
+        Rows are looked up one by one; the missing ones are prefilled together
+        in one batch and stored.  Returned probs are a fresh array.
+        """
+        ids = np.asarray(ids, dtype=np.int32)
+        base = (model_fingerprint(decoder.model), self._kind(decoder))
+        keys = [base + (row.tobytes(),) for row in ids]
+        found = [self.get(k) for k in keys]
+        missing = list(dict.fromkeys(k for k, f in zip(keys, found) if f is None))
+        if missing:
+            rows = [keys.index(k) for k in missing]
+            probs, state = decoder.prefill(ids[rows])
+            for j, k in enumerate(missing):
+                row = (probs[j].copy(), decoder.reorder(state, [j]) if len(rows) > 1 else state)
+                self.put(k, *row)
+                for i, key in enumerate(keys):
+                    if key == k:
+                        found[i] = row
+        if len(found) == 1:
+            return found[0][0][None, :].copy(), found[0][1]
+        return np.stack([f[0] for f in found]), decoder.concat([f[1] for f in found])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self.bytes, 'hits': self.hits, 'misses': self.misses}
+
+PREFIX_CACHE = PrefixCache()
+
+def cached_prefill(decoder, ids):
+    return PREFIX_CACHE.prefill(decoder, ids)
@@ -0,0 +1,154 @@
+"""Process-wide cache of loaded models and vocabularies.
+
+Every generator used to call `load_model` and re-read vocab.json / itos.pkl
+on each request, paying seconds of deserialisation per click in the UI.  The
+registry keys entries by (absolute path, mtime), so a retrained checkpoint is
+picked up automatically while repeated generations in the same process skip
+loading entirely.  Models are LRU-bounded; each model entry also carries a
+`state` dict for per-model inference artifacts (warm-up flag, compiled step
+functions, ...) that should live exactly as long as the loaded weights.
+Files are loaded outside the registry lock (one loader per file version),
+so a slow load never stalls callers of other, already cached entries.
+src/inference/hot_reload.py builds on this to swap in retrained checkpoints
+without a restart.
+
+Cached objects are shared: callers must not mutate returned vocabularies.
+"""
+import json
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import tensorflow as tf
+
+from src.models.transformer import CUSTOM_OBJECTS
+from src.utils.token_table import TokenTable
+
+def _file_key(path):
+    path = os.path.abspath(path)
+    return path, os.stat(path).st_mtime_ns
+
+class ModelEntry:
+    """A loaded model plus the per-model inference state kept alongside it."""
+    def __init__(self, key, model):
+        self.key = key
+        self.model = model
+        self.state = {'warm': False}
+
+    @property
+    def path(self):
+        return self.key[0]
+
+class ModelRegistry:
+    """LRU-bounded, thread-safe cache of models and vocab files keyed by (path, mtime)."""
+    def __init__(self, max_models=4, max_vocabs=8):
+        self.max_models = max_models
+        self.max_vocabs = max_vocabs
+        self._models = OrderedDict()
+        self._vocabs = OrderedDict()
+        self._lock = threading.RLock()
+        self._loading = {}   # key -> lock held while that file version loads
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, cache, key, limit, load):
+        with self._lock:
+            if key in cache:
+                cache.move_to_end(key)
+                self.hits += 1
+                return cache[key]
+            loading = self._loading.setdefault(key, threading.Lock())
+        with loading:   # concurrent misses on the same key wait for one load
+            with self._lock:
+                if key in cache:
+                    self.hits += 1
+                    return cache[key]
+                self.misses += 1
+            try:
+                value = load()
+            except BaseException:
+                with self._lock:
+                    self._loading.pop(key, None)
+                raise
+            with self._lock:
+                # Drop stale versions of the same file; whoever still holds them keeps them
+                for old in [k for k in cache if k[0] == key[0] and k[2:] == key[2:]]:
+                    del cache[old]
+                cache[key] = value
+                self._loading.pop(key, None)
+                while len(cache) > limit:
+                    cache.popitem(last=False)
+                return value
+
+    def get_entry(self, path, warm_up=True):
+        """ModelEntry for the checkpoint at `path`, loading it on first use."""
+        key = _file_key(path)
+        entry = self._lookup(self._models, key, self.max_models,
+                             lambda: ModelEntry(key, tf.keras.models.load_model(
+                                 key[0], compile=False, custom_objects=CUSTOM_OBJECTS)))
+        if warm_up and not entry.state['warm']:
+            warm_up_model(entry.model)
+            entry.state['warm'] = True
+        return entry
+
+    def get_model(self, path, warm_up=True):
+        return self.get_entry(path, warm_up).model
+
+    def get_vocab(self, path):
+        """Parsed vocab file: vocab.json -> stoi dict, *.pkl -> unpickled object (e.g. itos)."""
+        key = _file_key(path)
+
+        def load():
+            if key[0].endswith('.pkl'):
+                with open(key[0], 'rb') as f:
+                    return pickle.load(f)
+            with open(key[0], 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return self._lookup(self._vocabs, key, self.max_vocabs, load)
+
+    def get_itos(self, vocab_path):
+        """id -> token dict derived from vocab.json (cached with it)."""
+        key = _file_key(vocab_path) + ('itos',)
+        return self._lookup(self._vocabs, key, self.max_vocabs,
+                            lambda: {i: t for t, i in self.get_vocab(vocab_path).items()})
+
+    def get_token_table(self, vocab_path, vocab_size=None):
+        """TokenTable for vocab.json (or itos.pkl), parsed once and cached with the file."""
+        key = _file_key(vocab_path) + ('table', vocab_size)
+
+        def load():
+            vocab = self.get_vocab(vocab_path)
+            return TokenTable(vocab, vocab_size) if key[0].endswith('.pkl') else TokenTable.from_stoi(vocab, vocab_size)
+        return self._lookup(self._vocabs, key, self.max_vocabs, load)
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self._vocabs.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'models': [k[0] for k in self._models], 'vocabs': [k[0] for k in self._vocabs],
+                    'hits': self.hits, 'misses': self.misses}
+
+def warm_up_model(model):
+    """One dummy forward pass so the first real token doesn't pay graph building."""
+    shape = [d if d is not None else 1 for d in model.input_shape]
+    shape[0] = 1
+    model(np.zeros(shape, dtype=np.int32), training=False)
+
+REGISTRY = ModelRegistry()
+
+def get_model(path, warm_up=True):
+    return REGISTRY.get_model(path, warm_up)
+
+def get_vocab(path):
+    return REGISTRY.get_vocab(path)
+
+def get_itos(vocab_path):
+    return REGISTRY.get_itos(vocab_path)
+
+def get_token_table(vocab_path, vocab_size=None):
+    return REGISTRY.get_token_table(vocab_path, vocab_size)
@@ -0,0 +1,490 @@
+"""Local inference server: one process holds the models, clients share them over HTTP.
+
+The UI and every CLI used to import TensorFlow and load their own copy of the
+model.  This server loads each checkpoint once and serves it on localhost
+(stdlib asyncio, no extra dependencies):
+
+    python -m src.inference.server --checkpoint rnn=outputs/rnn/best.keras
+
+    POST /generate  {"length": 200, "temperature": 0.9, "seed": 1, "prompt": [ids],
+                     "constraints": {"key": "A minor"}, "as_midi": true}
+    POST /continue  {"midi": "<base64 .mid>", "length": 150, "mode": "continue" | "variation",
+                     "similarity": 0.7}
+    POST /score     {"ids": [...]} | {"tokens": [...]} | {"midi": "<base64 .mid>"}
+    POST /generate/stream, /continue/stream   (same bodies, server-sent events)
+    GET  /health
+
+Any body may name a "model" (a --checkpoint name, default the first);
+"as_midi": true adds the generated piece as base64 SMF ("midi") to the response.
+Requests go to that model's Batcher (src/inference/batcher.py), so
+concurrent requests are decoded together in micro-batches instead of one
+after another; `max_batch` and `max_wait_ms` (config.yaml `serve:`) trade
+latency for throughput.  "priority": "batch" marks background work that
+interactive requests (the default) preempt, and "deadline_s" gives up on a
+request after that many seconds.  Responses are JSON, errors {"error":
+message} with status 400 (bad request), 404 (unknown path or model), 503
+(that priority's queue is full, retry later), 504 (deadline passed) or 500.
+
+Checkpoints are watched (`reload_interval_s`, 0 turns it off): when
+training writes a new best.keras, it is loaded and warmed up in the
+background and swapped in for new requests while running ones finish on
+the old model (src/inference/hot_reload.py), with no restart and nothing
+dropped.
+src/inference/client.py is the matching client.
+
+The /stream variants answer with server-sent events instead: a "token" event
+per token as soon as it is sampled ({"index", "id", "token", "logprob",
+"event": the decoded note/chord or null}), with "chunk_tokens": N also a
+"chunk" event every N tokens (base64 SMF of the new notes, from "start"
+beats), then one "done" event carrying the normal response, or "error".
+A client that reads slowly gets the tokens sampled meanwhile in one write
+rather than a growing backlog, and one that stalls for `stream_timeout_s`
+or disconnects has its request cancelled, which frees its batch row before
+the next decoding step.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import yaml
+
+from src.inference.batcher import PRIORITIES, Batcher, DeadlineExceeded, GenerationRequest, QueueFull
+from src.inference.constraints import constraint_mask
+from src.inference.continuation import prepare_continuation, similarity_score
+from src.inference.hot_reload import CheckpointWatcher
+from src.inference.registry import get_model, get_token_table, get_vocab
+from src.inference.streaming import VELOCITY, MidiStream, iter_events, token_event
+from src.utils.smf import smf_bytes
+
+MAX_BODY = 16 * 2 ** 20
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+            413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable',
+            504: 'Gateway Timeout'}
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def _number(body, key, default, cast=float, lo=None, hi=None):
+    """body[key] as `cast`, within [lo, hi]; HTTPError 400 otherwise."""
+    try:
+        value = cast(body.get(key, default))
+    except (TypeError, ValueError):
+        raise HTTPError(400, f"'{key}' must be a number") from None
+    if (lo is not None and value < lo) or (hi is not None and value > hi):
+        raise HTTPError(400, f"'{key}' must be between {lo} and {hi}")
+    return value
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+
+def _midi_bytes(body):
+    try:
+        return base64.b64decode(body['midi'], validate=True)
+    except (KeyError, TypeError, ValueError):
+        raise HTTPError(400, "'midi' must be a base64-encoded MIDI file") from None
+
+class ModelSlot:
+    """A served model with its vocabulary table and batcher."""
+    def __init__(self, name, path, vocab_path, **batching):
+        self.name = name
+        self.path = path
+        model = get_model(path)
+        self.table = get_token_table(vocab_path, model.output_shape[-1])
+        self.stoi = get_vocab(vocab_path)
+        self.batcher = Batcher(model, **batching)
+        self.loaded_at = time.time()
+
+    @property
+    def model(self):
+        """The model new requests run on (the batcher's, replaced on reload)."""
+        return self.batcher.model
+
+    @property
+    def seq_len(self):
+        return self.model.input_shape[1]
+
+    def swap(self, path, model):
+        self.batcher.swap_model(model)
+        self.loaded_at = time.time()
+
+class InferenceServer:
+    """HTTP front end over one Batcher per model (see module docstring)."""
+    def __init__(self, checkpoints, vocab_path, host='127.0.0.1', port=8765, max_batch=16, max_wait_ms=5.0,
+                 max_length=2000, stream_timeout_s=30.0, max_queue=256, batch_share=0.5, reload_interval_s=2.0):
+        if not checkpoints:
+            raise ValueError("No checkpoints to serve")
+        self.slots = {name: ModelSlot(name, path, vocab_path, max_batch=max_batch, max_wait_ms=max_wait_ms,
+                                         max_queue=max_queue, batch_share=batch_share)
+                      for name, path in checkpoints.items()}
+        self.host = host
+        self.port = port
+        self.max_length = max_length
+        self.stream_timeout = stream_timeout_s
+        self.watcher = CheckpointWatcher(reload_interval_s)
+        for slot in self.slots.values():
+            self.watcher.watch(slot.path, on_reload=slot.swap)
+        self._server = None
+        self._loop = None
+        self._routes = {('GET', '/health'): self.health, ('POST', '/generate'): self.generate,
+                        ('POST', '/continue'): self.continue_midi, ('POST', '/score'): self.score}
+        self._streams = {'/generate/stream': self._generate_request, '/continue/stream': self._continue_request}
+
+    # ---- endpoints -------------------------------------------------------------------------
+
+    def _slot(self, body):
+        name = body.get('model') or next(iter(self.slots))
+        if name not in self.slots:
+            raise HTTPError(404, f"Unknown model {name!r} (serving {', '.join(self.slots)})")
+        return self.slots[name]
+
+    def _sampling(self, body, slot):
+        options = {'temperature': _number(body, 'temperature', 1.0, float, 0.0, 10.0),
+                   'top_k': _number(body, 'top_k', 0, int, 0),
+                   'top_p': _number(body, 'top_p', 1.0, float, 0.0, 1.0),
+                   'repetition_penalty': _number(body, 'repetition_penalty', 1.0, float, 0.1, 10.0),
+                   'seed': body.get('seed')}
+        if body.get('constraints'):
+            try:
+                options['logit_mask'] = constraint_mask(slot.table, **body['constraints'])
+            except (TypeError, ValueError, KeyError) as e:
+                raise HTTPError(400, f"Bad constraints: {e}") from None
+        if body.get('stop_on_sep'):
+            options['stop_id'] = slot.stoi.get('<SEP>', 0)
+        return {**options, **self._admission(body)}
+
+    @staticmethod
+    def _admission(body):
+        priority = body.get('priority', 'interactive')
+        if priority not in PRIORITIES:
+            raise HTTPError(400, f"'priority' must be one of {', '.join(PRIORITIES)}")
+        deadline = body.get('deadline_s')
+        return {'priority': priority,
+                'deadline_s': None if deadline is None else _number(body, 'deadline_s', 0, float, 0.0)}
+
+    def _ids(self, body, slot, key='prompt', tokens_key='prompt_tokens'):
+        """Ids from body[key] (ids) or body[tokens_key] (token strings); None if neither is given."""
+        if body.get(tokens_key) is not None:
+            try:
+                return [slot.stoi[t] for t in body[tokens_key]]
+            except (KeyError, TypeError) as e:
+                raise HTTPError(400, f"Unknown token {e}") from None
+        if body.get(key) is not None:
+            try:
+                return [int(i) for i in body[key]]
+            except (TypeError, ValueError):
+                raise HTTPError(400, f"'{key}' must be a list of token ids") from None
+        return None
+
+    def _render(self, slot, ids, request, with_midi):
+        out = {'model': slot.name, 'ids': ids, 'tokens': [slot.table.tokens[i] for i in ids],
+               'logprob': float(np.mean(request.logprobs)) if request.logprobs else 0.0,
+               'timing': request.timing()}
+        if with_midi:
+            events = [ev for _, ev in iter_events(ids, slot.table) if ev is not None]
+            data = smf_bytes([(ev['offset'], ev['duration'], p, VELOCITY) for ev in events for p in ev['pitches']])
+            out['midi'] = base64.b64encode(data).decode('ascii')
+        return out
+
+    @staticmethod
+    def _submit(slot, request, on_done):
+        """Hand the request to the model's batcher; on_done runs on the event loop when it finishes."""
+        loop = asyncio.get_running_loop()
+
+        def done(req):
+            try:
+                loop.call_soon_threadsafe(on_done, req)
+            except RuntimeError:  # event loop already closed
+                pass
+        request.on_done = done
+        try:
+            slot.batcher.submit(request)
+        except ValueError as e:
+            raise HTTPError(400, str(e)) from None
+        except QueueFull as e:
+            raise HTTPError(503, str(e)) from None
+
+    async def _run(self, slot, request):
+        """Submit and wait for the worker thread to finish the request; cancelled with the awaiting task."""
+        future = asyncio.get_running_loop().create_future()
+        self._submit(slot, request, lambda req: future.done() or future.set_result(req))
+        try:
+            await future
+        except asyncio.CancelledError:
+            request.cancel()
+            raise
+        if request.error is not None:
+            raise request.error
+        return request
+
+    async def health(self, body):
+        reloads = self.watcher.stats()
+        return {'status': 'ok', 'models': {name: {'path': slot.path, 'seq_len': slot.seq_len,
+                                                  'loaded_at': slot.loaded_at,
+                                                  'reload': reloads.get(os.path.abspath(slot.path)),
+                                                  **slot.batcher.stats()} for name, slot in self.slots.items()}}
+
+    def _generate_request(self, body):
+        """(slot, request, extra) for /generate; extra(request) -> fields added to the response."""
+        slot = self._slot(body)
+        length = _number(body, 'length', 200, int, 1, self.max_length)
+        prompt = self._ids(body, slot)
+        if prompt is None:
+            prompt = np.random.default_rng(body.get('seed')).integers(0, slot.model.output_shape[-1], size=slot.seq_len)
+        return slot, GenerationRequest(prompt, length, **self._sampling(body, slot)), lambda request: {}
+
+    def _continue_request(self, body):
+        slot = self._slot(body)
+        length = _number(body, 'length', 150, int, 1, self.max_length)
+        context = _number(body, 'context', slot.seq_len, int, 1)
+        similarity = _number(body, 'similarity', 0.5, float, 0.0, 1.0)
+        options = self._sampling(body, slot)
+        try:
+            events, prompt, mask = prepare_continuation(slot.table, _midi_bytes(body), context,
+                                                        body.get('mode', 'continue'), similarity)
+        except ValueError as e:
+            raise HTTPError(400, str(e)) from None
+        if mask is not None:
+            options['logit_mask'] = mask + options['logit_mask'] if 'logit_mask' in options else mask
+        return slot, GenerationRequest(prompt, length, **options), lambda request: {
+            'prompt': prompt, 'source_events': len(events),
+            'similarity': similarity_score(events, slot.table.events(request.ids))}
+
+    async def _respond(self, build, body):
+        slot, request, extra = build(body)
+        await self._run(slot, request)
+        return {**self._render(slot, request.ids, request, body.get('as_midi', False)), **extra(request)}
+
+    async def generate(self, body):
+        return await self._respond(self._generate_request, body)
+
+    async def continue_midi(self, body):
+        return await self._respond(self._continue_request, body)
+
+    async def score(self, body):
+        """Log-likelihood of a sequence: ids[context:] teacher-forced after the first `context` ids."""
+        slot = self._slot(body)
+        if body.get('midi') is not None:
+            from src.data.preprocess import fast_midi_to_events
+            try:
+                ids = slot.table.nearest_ids(fast_midi_to_events(_midi_bytes(body)))
+            except ValueError as e:
+                raise HTTPError(400, str(e)) from None
+        else:
+            ids = self._ids(body, slot, 'ids', 'tokens')
+        context = _number(body, 'context', 1, int, 1)
+        if not ids or len(ids) <= context:
+            raise HTTPError(400, f"Need more than {context} ids to score")
+        ids = ids[:context + self.max_length]
+        request = await self._run(slot, GenerationRequest(ids[:context], forced=ids[context:],
+                                                                **self._admission(body)))
+        total = float(np.sum(request.logprobs))
+        return {'model': slot.name, 'scored': len(request.logprobs), 'logprob': total,
+                'mean_logprob': total / len(request.logprobs),
+                'perplexity': float(np.exp(-total / len(request.logprobs))),
+                'logprobs': request.logprobs, 'timing': request.timing()}
+
+    # ---- HTTP ------------------------------------------------------------------------------
+
+    async def _stream(self, slot, request, extra, body, reader, writer):
+        """Send one generation as server-sent events (see module docstring); cancel it if the client goes."""
+        chunk_tokens = _number(body, 'chunk_tokens', 0, int, 0)
+        midi = MidiStream() if chunk_tokens else None
+        loop = asyncio.get_running_loop()
+        pending = asyncio.Queue()   # (id, logprob) per token, then None
+
+        def on_token(req, idx):
+            try:
+                loop.call_soon_threadsafe(pending.put_nowait, (idx, req.logprobs[-1]))
+            except RuntimeError:  # event loop already closed
+                req.cancel()
+        request.on_token = on_token
+        self._submit(slot, request, lambda req: pending.put_nowait(None))
+        gone = asyncio.ensure_future(reader.read())   # EOF: the client disconnected
+        offset, index, finished = 0.0, 0, False
+        try:
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                         b"Connection: close\r\n\r\n")
+            while not finished:
+                getter = asyncio.ensure_future(pending.get())
+                await asyncio.wait({getter, gone}, return_when=asyncio.FIRST_COMPLETED)
+                if not getter.done():
+                    getter.cancel()
+                    return
+                items = [getter.result()]
+                while not pending.empty():   # everything sampled while the client was reading: one write
+                    items.append(pending.get_nowait())
+                out = []
+                for item in items:
+                    if item is None:
+                        finished = True
+                        break
+                    idx, logprob = item
+                    event, offset = token_event(slot.table, idx, offset)
+                    out.append(_sse('token', {'index': index, 'id': idx, 'token': slot.table.tokens[idx],
+                                              'logprob': logprob, 'event': event}))
+                    index += 1
+                    if midi is not None:
+                        if event is not None:
+                            midi.add(event)
+                        chunk = midi.flush() if index % chunk_tokens == 0 else None
+                        if chunk:
+                            out.append(_sse('chunk', {'start': chunk[0],
+                                                      'midi': base64.b64encode(chunk[1]).decode('ascii')}))
+                if finished:
+                    chunk = midi.flush() if midi is not None else None
+                    if chunk:
+                        out.append(_sse('chunk', {'start': chunk[0], 'midi': base64.b64encode(chunk[1]).decode('ascii')}))
+                    try:
+                        if request.error is not None:
+                            raise request.error
+                        out.append(_sse('done', {**self._render(slot, request.ids, request, body.get('as_midi', False)),
+                                                 **extra(request)}))
+                    except Exception as e:
+                        out.append(_sse('error', {'error': f"{type(e).__name__}: {e}"}))
+                writer.write(b''.join(out))
+                await asyncio.wait_for(writer.drain(), self.stream_timeout)
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            gone.cancel()
+            if not request.done:
+                request.cancel()
+
+    def _body(self, raw):
+        try:
+            body = json.loads(raw or b'{}')
+        except ValueError:
+            body = None
+        if not isinstance(body, dict):
+            raise HTTPError(400, 'Body must be a JSON object')
+        return body
+
+    async def _dispatch(self, method, path, raw):
+        handler = self._routes.get((method, path))
+        if handler is None:
+            known = {p for _, p in self._routes} | set(self._streams)
+            return (405, {'error': f"{method} not allowed"}) if path in known else (404, {'error': 'Not found'})
+        try:
+            return 200, await handler(self._body(raw))
+        except HTTPError as e:
+            return e.status, {'error': str(e)}
+        except DeadlineExceeded as e:
+            return 504, {'error': str(e)}
+        except Exception as e:
+            return 500, {'error': f"{type(e).__name__}: {e}"}
+
+    @staticmethod
+    async def _reply(writer, status, payload, keep_alive):
+        data = json.dumps(payload).encode()
+        writer.write(f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(data)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}"
+                     f"\r\n\r\n".encode('latin-1') + data)
+        await writer.drain()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    method, path, version = line.decode('latin-1').split()
+                except ValueError:
+                    break
+                headers = {}
+                while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                length = int(headers.get('content-length') or 0)
+                if length > MAX_BODY:
+                    await self._reply(writer, 413, {'error': f"Body larger than {MAX_BODY} bytes"}, False)
+                    break
+                raw = await reader.readexactly(length)
+                path = path.split('?', 1)[0]
+                if method == 'POST' and path in self._streams:
+                    try:   # errors are only raised before the event stream starts
+                        body = self._body(raw)
+                        await self._stream(*self._streams[path](body), body, reader, writer)
+                    except HTTPError as e:
+                        await self._reply(writer, e.status, {'error': str(e)}, False)
+                    break
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                await self._reply(writer, *await self._dispatch(method, path, raw), keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        print(f"Serving {', '.join(self.slots)} on http://{self.host}:{self.port}")
+        async with self._server:
+            await self._server.serve_forever()
+
+    def start_in_thread(self):
+        """Run the event loop in a daemon thread (tests, benchmarks, embedding); returns once listening."""
+        ready = threading.Event()
+
+        def run():
+            loop = asyncio.new_event_loop()
+            loop.run_until_complete(self.start())
+            ready.set()
+            loop.run_forever()
+        threading.Thread(target=run, name='inference-server', daemon=True).start()
+        ready.wait()
+        return self
+
+    def close(self):
+        self.watcher.stop()
+        if self._server is not None and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+        for slot in self.slots.values():
+            slot.batcher.close()
+
+def main(config_path, checkpoints, vocab_path, host=None, port=None, max_batch=None, max_wait_ms=None):
+    serve = (yaml.safe_load(open(config_path, 'r')) or {}).get('serve', {}) if os.path.exists(config_path) else {}
+    server = InferenceServer(checkpoints, vocab_path, host or serve.get('host', '127.0.0.1'),
+                             port if port is not None else serve.get('port', 8765),
+                             max_batch or serve.get('max_batch', 16),
+                             max_wait_ms if max_wait_ms is not None else serve.get('max_wait_ms', 5.0),
+                             serve.get('max_length', 2000), serve.get('stream_timeout_s', 30.0),
+                             serve.get('max_queue', 256), serve.get('batch_share', 0.5),
+                             serve.get('reload_interval_s', 2.0))
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--config', default='config.yaml')
+    ap.add_argument('--checkpoint', action='append', default=None,
+                    help='name=path, repeatable (default: rnn=outputs/rnn/best.keras)')
+    ap.add_argument('--vocab', default=os.path.join('outputs', 'processed', 'vocab.json'))
+    ap.add_argument('--host', default=None, help='Default 127.0.0.1 (serve.host)')
+    ap.add_argument('--port', type=int, default=None)
+    ap.add_argument('--max_batch', type=int, default=None, help='Rows decoded together per step')
+    ap.add_argument('--max_wait_ms', type=float, default=None,
+                    help='How long an idle server waits for more requests to batch with the first')
+    args = ap.parse_args()
+    pairs = [c.split('=', 1) if '=' in c else (os.path.basename(os.path.dirname(c)) or 'model', c)
+             for c in (args.checkpoint or [os.path.join('outputs', 'rnn', 'best.keras')])]
+    main(args.config, dict(pairs), args.vocab, args.host, args.port, args.max_batch, args.max_wait_ms)
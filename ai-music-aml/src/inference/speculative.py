@@ -0,0 +1,150 @@
+"""Speculative decoding: a small draft model proposes, the large model verifies.
+
+Each round the draft model (typically the small `build_rnn` student from
+src/distill.py, decoded one LSTM step per token) samples `k` tokens ahead,
+and the target scores all of them in one forward pass: the k + 1 sliding
+windows ending before each draft token go through it as a single (k + 1, L)
+batch.  Drafting and verification are traced together into one tf.function,
+so a round costs one call, about as much as a single plain decoding step.
+
+Standard speculative sampling (Leviathan et al., 2023; Chen et al., 2023)
+then accepts draft token x_i with probability min(1, p_i(x_i) / q_i(x_i)),
+resamples the first rejected position from the residual max(0, p_i - q_i),
+and takes a bonus token from p_k when all k are accepted.  Every emitted
+token is distributed exactly as if sampled from the target alone, while the
+target runs once per round instead of once per token.
+
+    ids, stats = speculative_generate(target, draft, seed_ids, 200, k=4, temperature=0.9)
+    stats['acceptance_rate'], stats['tokens_per_target_call']
+
+Temperature, top-k, top-p and logit_mask are applied identically to both
+models' distributions, so the output follows the processed target
+distribution.  At temperature <= 0 both sides are greedy and the result
+equals greedy decoding of the target.  Draft and target must share the
+vocabulary.
+"""
+import weakref
+
+import numpy as np
+import tensorflow as tf
+
+from src.inference.engine import _cached, decoder_for
+from src.inference.sampling import default_rng, tf_apply_temperature, tf_apply_top_k, tf_apply_top_p, tf_gumbel_sample
+
+def _draw(p, rng):
+    """One id from an (unnormalised) distribution (V,)."""
+    cdf = np.cumsum(p)
+    return int(min(np.searchsorted(cdf, rng.random() * cdf[-1], side='right'), len(p) - 1))
+
+def speculative_round(target, draft, k, top_k=0, top_p=1.0):
+    """Cached tf.function for one round: k draft tokens plus the target's verdict on them.
+
+    round_(context (1, L), draft_states (k + 1, ...), accepted, temperature, mask (V,), seed (2,))
+    -> drafts (k,), q (k, V), p (k + 1, V), draft_states (k + 1, ...)
+
+    `context` is the target's window ending with the last accepted token,
+    which the draft hasn't read yet: its state is draft_states[accepted],
+    i.e. the previous round's states (state i has consumed that round's
+    drafts[:i]) indexed in-graph, so rolling back costs nothing extra.  q[i]
+    and p[i] are the processed draft and target distributions for position i.
+
+    Rounds are cached on the target per draft in a WeakKeyDictionary, and
+    the round only reaches the draft through a weak reference (tf.function
+    holds captured variables weakly too), so a target doesn't keep every
+    draft it was ever paired with alive.
+    """
+    draft_ref = weakref.ref(draft)
+
+    def build():
+        seq_len = target.input_shape[1]
+        windows = tf.range(k + 1)[:, None] + tf.range(seq_len)[None, :]
+
+        def process(probs, temperature, mask):
+            logits = tf_apply_temperature(tf.math.log(tf.maximum(probs, 1e-12)), temperature) + mask
+            logits = tf_apply_top_p(tf_apply_top_k(logits, top_k), top_p)
+            greedy = tf.one_hot(tf.argmax(logits, axis=-1), tf.shape(logits)[-1])
+            return logits, tf.where(temperature > 0, tf.nn.softmax(logits, axis=-1), greedy)
+
+        @tf.function
+        def round_(context, states, accepted, temperature, mask, seed):
+            decoder = decoder_for(draft_ref())   # traced while speculative_generate holds the draft
+            state = tf.nest.map_structure(lambda s: s[accepted], states)
+            probs, state = decoder.graph_step(context[:, -1], state)
+            drafts, qs, states = [], [], [state]
+            for i in range(k):
+                logits, q = process(probs, temperature, mask)
+                x = tf.where(temperature > 0, tf_gumbel_sample(logits, seed + [0, i]),
+                             tf.cast(tf.argmax(logits, axis=-1), tf.int32))
+                probs, state = decoder.graph_step(x, state)
+                drafts.append(x[0])
+                qs.append(q[0])
+                states.append(state)
+            tokens = tf.concat([context[0], tf.stack(drafts)], axis=0)
+            target_probs = tf.cast(target(tf.gather(tokens, windows), training=False), tf.float32)
+            _, p = process(target_probs, temperature, mask)
+            stacked = tf.nest.map_structure(lambda *s: tf.stack(s), *states)
+            return tf.stack(drafts), tf.stack(qs), p, stacked
+        return round_
+    rounds = _cached(target, 'speculative', weakref.WeakKeyDictionary).setdefault(draft, {})
+    if (k, top_k, top_p) not in rounds:
+        rounds[k, top_k, top_p] = build()
+    return rounds[k, top_k, top_p]
+
+def speculative_generate(target, draft, seed_ids, length, k=4, temperature=1.0, top_k=0, top_p=1.0,
+                         logit_mask=None, stop_id=None, rng=None):
+    """Generate `length` ids after `seed_ids` with `draft` proposing k tokens per target call.
+
+    seed_ids must cover the target's window (and the draft's, for non-LSTM
+    drafts, plus one token).  Generation ends early at `stop_id` (not
+    included).  Returns (ids, stats) with stats = {'rounds', 'proposed',
+    'accepted', 'acceptance_rate', 'tokens_per_target_call'}.
+    """
+    vocab_size = target.output_shape[-1]
+    if draft.output_shape[-1] != vocab_size:
+        raise ValueError(f"Draft vocabulary ({draft.output_shape[-1]}) differs from the target's ({vocab_size})")
+    seq_len = target.input_shape[1]
+    history = [int(i) for i in seed_ids]
+    if len(history) < seq_len:
+        raise ValueError(f"Need at least {seq_len} prompt tokens, got {len(history)}")
+    rng = rng if rng is not None else default_rng()
+    round_ = speculative_round(target, draft, k, top_k, top_p)
+    decoder = decoder_for(draft)
+    temperature = tf.constant(temperature, tf.float32)
+    mask = tf.zeros([vocab_size]) if logit_mask is None else tf.constant(logit_mask, tf.float32)
+
+    # The draft reads everything but the last token; each round starts by feeding it that token
+    _, state = decoder.graph_prefill(tf.constant([history[-decoder.seq_len - 1:-1]], tf.int32))
+    states = tf.nest.map_structure(lambda s: tf.stack([s] * (k + 1)), state)
+    out = []
+    rounds = proposed = accepted = accepted_total = 0
+    while len(out) < length:
+        # Every round emits one target-sampled token after the accepted drafts, so never overshoot
+        n = min(k, length - len(out) - 1)
+        drafts, q, p, states = round_(np.array([history[-seq_len:]], np.int32), states, np.int32(accepted),
+                                      temperature, mask, rng.integers(2 ** 31, size=2, dtype=np.int32))
+        drafts, q, p = drafts.numpy().tolist(), q.numpy(), p.numpy()
+
+        accepted = 0
+        while accepted < n and rng.random() * q[accepted, drafts[accepted]] < p[accepted, drafts[accepted]]:
+            accepted += 1
+        if accepted < n:
+            residual = np.maximum(p[accepted] - q[accepted], 0.0)
+            nxt = _draw(residual if residual.sum() > 0 else p[accepted], rng)
+        else:
+            nxt = _draw(p[n], rng)
+        rounds += 1
+        proposed += n
+        accepted_total += accepted
+
+        new = drafts[:accepted] + [nxt]
+        if stop_id is not None and stop_id in new:
+            out.extend(new[:new.index(stop_id)])
+            break
+        out.extend(new)
+        history.extend(new)
+        # The next round rolls the draft back to states[accepted] and feeds it `nxt`
+
+    stats = {'rounds': rounds, 'proposed': proposed, 'accepted': accepted_total,
+             'acceptance_rate': accepted_total / proposed if proposed else 0.0,
+             'tokens_per_target_call': len(out) / rounds if rounds else 0.0}
+    return out, stats
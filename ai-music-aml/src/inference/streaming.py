@@ -0,0 +1,95 @@
+"""Streaming generation: tokens, note events and playable MIDI as they are sampled.
+
+The batch generators return only once every token is sampled and the MIDI
+file is written.  `stream_music` is a generator instead: each sampled token
+is yielded immediately, together with its decoded note event (when it is a
+note or chord), and every `chunk_tokens` tokens the notes gathered so far are
+flushed as a small standalone MIDI file.  Time to first note is then one
+prompt prefill plus one sample.
+
+    for update in stream_music(model, table, seed_ids, 200, temperature=0.9, midi_path='out.mid'):
+        if update['event']:
+            piano_roll.add(update['event'])
+        if update['chunk']:
+            start, data = update['chunk']   # SMF bytes of the new notes, starting at `start` beats
+
+Onsets follow the token encoding (src/data/preprocess.py): a token's step is
+its offset from the previous event's onset; specials and rests produce no
+event.  With
+`midi_path` the whole piece so far is rewritten (atomically) at every chunk,
+so the file on disk is always playable and grows while generation runs.
+"""
+import time
+
+from src.inference.engine import iter_ids
+from src.utils.smf import smf_bytes, write_smf
+from src.utils.token_table import CHORD, NOTE
+
+VELOCITY = 80
+
+def token_event(table, idx, offset):
+    """(event or None, new offset) for token `idx` after an event with onset `offset` beats."""
+    if not (0 <= idx < table.vocab_size and table.kind[idx] in (NOTE, CHORD)):
+        return None, offset
+    offset += float(table.step[idx])
+    return {'offset': offset, 'duration': float(table.duration[idx]),
+            'pitches': table.pitches[idx, :table.n_pitches[idx]].tolist(), 'names': list(table.names[idx])}, offset
+
+def iter_events(ids, table):
+    """Yield (id, event or None) for each id; event = {'offset', 'duration', 'pitches', 'names'}."""
+    offset = 0.0
+    for idx in ids:
+        event, offset = token_event(table, idx, offset)
+        yield idx, event
+
+class MidiStream:
+    """Growing list of note events that renders to SMF bytes, in chunks or as a whole."""
+    def __init__(self, tempo_bpm=120, path=None):
+        self.tempo_bpm = tempo_bpm
+        self.path = path
+        self.notes = []      # (start, duration, pitch, velocity)
+        self._flushed = 0
+
+    def add(self, event):
+        for pitch in event['pitches']:
+            self.notes.append((event['offset'], event['duration'], pitch, VELOCITY))
+
+    def flush(self):
+        """(start, SMF bytes) of the notes added since the last flush, shifted to begin at 0; None if none."""
+        new = self.notes[self._flushed:]
+        if not new:
+            return None
+        self._flushed = len(self.notes)
+        start = min(n[0] for n in new)
+        if self.path:
+            write_smf(self.path, self.notes, self.tempo_bpm)
+        return start, smf_bytes([(s - start, d, p, v) for s, d, p, v in new], self.tempo_bpm)
+
+    def to_bytes(self):
+        return smf_bytes(self.notes, self.tempo_bpm)
+
+def stream_music(model, table, seed_ids, length, chunk_tokens=16, midi_path=None, tempo_bpm=120,
+                 stop_id=None, stateful=True, **sampling):
+    """Generate like engine.generate_ids, yielding an update dict per token.
+
+    update = {'index', 'id', 'token', 'event' (or None), 'chunk' ((start, bytes) or None),
+              'elapsed' (seconds since the call)}.  **sampling are the Sampler
+    options (temperature, top_k, top_p, repetition_penalty, ...).  Generation
+    ends early at `stop_id`: it is not yielded, and a last update with
+    id None flushes the remaining notes.
+    """
+    t0 = time.perf_counter()
+    midi = MidiStream(tempo_bpm, midi_path)
+    ids = iter_ids(model, seed_ids, length, stateful=stateful, **sampling)
+    for i, (idx, event) in enumerate(iter_events(ids, table)):
+        if stop_id is not None and idx == stop_id:
+            chunk = midi.flush()
+            if chunk:
+                yield {'index': i, 'id': None, 'token': None, 'event': None, 'chunk': chunk,
+                       'elapsed': time.perf_counter() - t0}
+            return
+        if event is not None:
+            midi.add(event)
+        flush = (i + 1) % chunk_tokens == 0 or i + 1 == length
+        yield {'index': i, 'id': idx, 'token': table.tokens[idx], 'event': event,
+               'chunk': midi.flush() if flush else None, 'elapsed': time.perf_counter() - t0}
@@ -9,3 +9,35 @@ def build_rnn(vocab_size: int, seq_len: int, embedding_dim: int = 256, rnn_units
     out = layers.Dense(vocab_size, activation='softmax')(x)
     model = models.Model(inp, out)
     return model
+
+def build_rnn_decoder(model):
+    """Stateful inference graphs sharing the weights of a trained `build_rnn` model.
+
+    Returns (prefill, step):
+      prefill: ids (B, T) -> (probs, h, c) for any prompt length T
+      step:    (token (B, 1), h, c) -> (probs, h', c'), one LSTM step per token
+    Dropout is inference-time identity, so it is simply left out.
+    """
+    emb_src = next(l for l in model.layers if isinstance(l, layers.Embedding))
+    lstm_src = next(l for l in model.layers if isinstance(l, layers.LSTM))
+    head_src = [l for l in model.layers if isinstance(l, layers.Dense)][-1]
+    units = lstm_src.units
+
+    # Always float32: a mixed-precision policy set by training must not leak in here
+    embedding = layers.Embedding(emb_src.input_dim, emb_src.output_dim, dtype='float32')
+    lstm = layers.LSTM(units, return_state=True, dtype='float32')
+    head = layers.Dense(head_src.units, activation='softmax', dtype='float32')
+
+    ids = layers.Input(shape=(None,), dtype='int32')
+    x, h, c = lstm(embedding(ids))
+    prefill = models.Model(ids, [head(x), h, c])
+
+    token = layers.Input(shape=(1,), dtype='int32')
+    h_in = layers.Input(shape=(units,))
+    c_in = layers.Input(shape=(units,))
+    x, h, c = lstm(embedding(token), initial_state=[h_in, c_in])
+    step = models.Model([token, h_in, c_in], [head(x), h, c])
+
+    for new, src in ((embedding, emb_src), (lstm, lstm_src), (head, head_src)):
+        new.set_weights(src.get_weights())
+    return prefill, step
@@ -2,8 +2,10 @@ from tensorflow.keras import layers, models
 import tensorflow as tf
 
 class PositionalEncoding(layers.Layer):
-    def __init__(self, d_model, max_len=5000):
-        super().__init__()
+    def __init__(self, d_model, max_len=5000, **kwargs):
+        super().__init__(**kwargs)
+        self.d_model = d_model
+        self.max_len = max_len
         import numpy as np
         pos = np.arange(max_len)[:, None]
         i = np.arange(d_model)[None, :]
@@ -16,7 +18,16 @@ class PositionalEncoding(layers.Layer):
 
     def call(self, x):
         seq_len = tf.shape(x)[1]
-        return x + self.pe[:, :seq_len, :]
+        # x is float16 under a mixed precision policy
+        return x + tf.cast(self.pe[:, :seq_len, :], x.dtype)
+
+    def get_config(self):
+        config = super().get_config()
+        config.update({'d_model': self.d_model, 'max_len': self.max_len})
+        return config
+
+# Pass to load_model(..., custom_objects=CUSTOM_OBJECTS) when loading transformer checkpoints
+CUSTOM_OBJECTS = {'PositionalEncoding': PositionalEncoding}
 
 def transformer_block(x, num_heads, dff, dropout):
     attn = layers.MultiHeadAttention(num_heads=num_heads, key_dim=x.shape[-1])(x, x)
@@ -37,3 +48,32 @@ def build_transformer(vocab_size: int, seq_len: int, d_model: int = 256, num_lay
     x = layers.GlobalAveragePooling1D()(x)
     out = layers.Dense(vocab_size, activation='softmax')(x)
     return models.Model(inp, out)
+
+def causal_transformer_block(x, num_heads, dff, dropout):
+    """transformer_block with a causal attention mask (position t only sees <= t)."""
+    attn = layers.MultiHeadAttention(num_heads=num_heads, key_dim=x.shape[-1])(x, x, use_causal_mask=True)
+    x = layers.LayerNormalization(epsilon=1e-6)(x + attn)
+    ffn = layers.Dense(dff, activation='relu')(x)
+    ffn = layers.Dense(x.shape[-1])(ffn)
+    x = layers.LayerNormalization(epsilon=1e-6)(x + ffn)
+    if dropout:
+        x = layers.Dropout(dropout)(x)
+    return x
+
+def build_causal_transformer(vocab_size: int, seq_len: int, d_model: int = 256, num_layers: int = 4, num_heads: int = 4, dff: int = 512, dropout: float = 0.1):
+    """Decoder-only variant that predicts the next token from the last position.
+
+    Unlike build_transformer it never looks ahead, so past keys/values stay
+    valid as new tokens arrive and can be cached (src/inference/kv_cache.py).
+    There is no positional encoding: the causal mask alone lets the model infer
+    order, and attention over cached keys is then independent of where they
+    sit in the cache, so a ring buffer can slide past seq_len.
+    """
+    inp = layers.Input(shape=(seq_len,), dtype='int32')
+    x = layers.Embedding(vocab_size, d_model)(inp)
+    for _ in range(num_layers):
+        x = causal_transformer_block(x, num_heads=num_heads, dff=dff, dropout=dropout)
+    x = layers.Cropping1D((seq_len - 1, 0))(x)  # keep the last position only
+    x = layers.Flatten()(x)
+    out = layers.Dense(vocab_size, activation='softmax')(x)
+    return models.Model(inp, out, name='causal_transformer')
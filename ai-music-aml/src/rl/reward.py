@@ -1,34 +1,32 @@
 """Simple reward functions and a REINFORCE-style fine-tune skeleton.
 This keeps things compact; for serious RL you may integrate stable-baselines.
+
+Rewards are computed for the whole vocabulary at once from a TokenTable
+(src/utils/token_table.py) and then looked up by token id.
 """
 import numpy as np
 
-SCALE = set(['C', 'D', 'E', 'F', 'G', 'A', 'B'])
+from src.utils.token_table import CHORD, NOTE
+
+C_MAJOR = sum(1 << pc for pc in (0, 2, 4, 5, 7, 9, 11))
+STABLE_DURATIONS = (0.25, 0.5, 1.0, 2.0)
+STABLE_STEPS = (0.25, 0.5, 1.0)
+
+def in_scale(table, scale_mask=C_MAJOR) -> np.ndarray:
+    """(V,) reward: 1.0 per in-scale pitch, 0.5 per other pitch, averaged over chord notes."""
+    pitches = table.pitches
+    valid = pitches >= 0
+    in_key = (scale_mask >> np.where(valid, pitches % 12, 0)) & 1
+    per_note = np.where(in_key == 1, 1.0, 0.5)
+    counts = np.maximum(valid.sum(axis=1), 1)
+    score = (per_note * valid).sum(axis=1) / counts
+    return np.where(np.isin(table.kind, (NOTE, CHORD)), score, 0.5).astype(np.float32)
 
-def in_scale(pitch_token: str) -> float:
-    # pitch_token like 'PC4' or 'PFS#4' etc; we check first char after 'P'
-    try:
-        if pitch_token.startswith('P'):
-            p = pitch_token[1:]
-        elif pitch_token.startswith('CHORD:'):
-            # reward avg over chord notes
-            notes = pitch_token.split(':',1)[1].split(',')
-            return float(np.mean([in_scale('P'+n) for n in notes]))
-        else:
-            p = pitch_token
-        letter = p[0].upper()
-        return 1.0 if letter in SCALE else 0.5
-    except Exception:
-        return 0.2
+def rhythm_stability(table) -> np.ndarray:
+    """(V,) reward encouraging quarter/half notes and steady steps."""
+    score = 0.5 * np.isin(table.duration, STABLE_DURATIONS) + 0.5 * np.isin(table.step, STABLE_STEPS)
+    return np.where(np.isin(table.kind, (NOTE, CHORD)), score, 0.2).astype(np.float32)
 
-def rhythm_stability(duration_token: str, step_token: str) -> float:
-    # encourage quarter/half notes and steady steps
-    score = 0.0
-    try:
-        d = float(duration_token[1:]) if duration_token.startswith('D') else float(duration_token)
-        s = float(step_token[1:]) if step_token.startswith('S') else float(step_token)
-        if d in (0.25, 0.5, 1.0, 2.0): score += 0.5
-        if s in (0.25, 0.5, 1.0): score += 0.5
-        return score
-    except Exception:
-        return 0.2
+def token_rewards(table) -> np.ndarray:
+    """(V,) combined reward used by fine_tune_rl; index it with sampled ids."""
+    return 0.5 * in_scale(table) + 0.5 * rhythm_stability(table)
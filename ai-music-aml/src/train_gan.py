@@ -10,8 +10,12 @@ def load_tokens_and_vocab(proc_dir):
     vocab = load_vocab(os.path.join(proc_dir, 'vocab.json'))
     return tokens, vocab
 
-def main(config_path):
-    cfg = yaml.safe_load(open(config_path, 'r'))
+def train(cfg, callbacks=None, epochs=5):
+    """Train the GAN from a config dict.
+
+    The loop is hand-written, so Keras callbacks (e.g. the UI's live-metrics
+    callback) are driven manually; setting gan.stop_training ends training.
+    """
     proc_dir = cfg['data']['processed_dir']
     seq_len = cfg['data']['sequence_length']
 
@@ -20,6 +24,8 @@ def main(config_path):
     ids = [stoi[t] for t in tokens if t in stoi]
 
     X_ids, y_ids = make_sequences(ids, seq_len)
+    if not X_ids:
+        raise ValueError(f"Need more than {seq_len} known tokens in {proc_dir} to train, got {len(ids)}")
     X = np.array(X_ids, dtype=np.int32)
     # Build one-hot sequences as 'real' samples for discriminator
     X_oh = to_categorical(X, num_classes=len(stoi))
@@ -32,14 +38,40 @@ def main(config_path):
     out_dir = os.path.join('outputs', 'gan')
     os.makedirs(out_dir, exist_ok=True)
 
-    for epoch in range(5):  # keep short (you can increase)
-        for batch in dataset:
+    callbacks = list(callbacks or [])
+    for cb in callbacks:
+        cb.set_model(gan)
+        cb.set_params({'epochs': epochs, 'steps': int(dataset.cardinality())})
+        cb.on_train_begin()
+    gan.stop_training = False
+    for epoch in range(epochs):  # keep short (you can increase)
+        for cb in callbacks:
+            cb.on_epoch_begin(epoch)
+        for step, batch in enumerate(dataset):
             metrics = gan.train_step(batch)
-        print(f"Epoch {epoch+1}:", {k: float(v.numpy()) for k, v in metrics.items()})
+            if callbacks:
+                logs = {k: float(v.numpy()) for k, v in metrics.items()}
+                for cb in callbacks:
+                    cb.on_train_batch_end(step, logs)
+            if gan.stop_training:
+                break
+        logs = {k: float(v.numpy()) for k, v in metrics.items()}
+        print(f"Epoch {epoch+1}:", logs)
+        for cb in callbacks:
+            cb.on_epoch_end(epoch, logs)
+        if gan.stop_training:
+            break
+    for cb in callbacks:
+        cb.on_train_end()
 
     gan.gen.save(os.path.join(out_dir, 'generator.keras'))
     gan.disc.save(os.path.join(out_dir, 'discriminator.keras'))
     print('Saved GAN components.')
+    return gan
+
+def main(config_path):
+    cfg = yaml.safe_load(open(config_path, 'r'))
+    train(cfg)
 
 if __name__ == '__main__':
     ap = argparse.ArgumentParser()
@@ -1,50 +1,71 @@
-import argparse, os, json, numpy as np, yaml
+import argparse, contextlib, os, json, numpy as np, yaml
 import tensorflow as tf
 from tensorflow.keras.callbacks import ModelCheckpoint, ReduceLROnPlateau, EarlyStopping
-from tensorflow.keras.utils import to_categorical
-from tensorflow.keras.optimizers import Adam
-from src.utils.dataio import load_vocab, make_sequences
+from tensorflow.keras.models import load_model
+from src.data.dataset import make_training_datasets
+from src.data.sampler import importance_sampling_enabled, make_importance_sampling
+from src.utils.batching import resolve_batch_plan, build_optimizer
 from src.models.rnn import build_rnn
 
-# Enable mixed precision training for faster performance
-try:
-    policy = tf.keras.mixed_precision.Policy('mixed_float16')
-    tf.keras.mixed_precision.set_global_policy(policy)
-    print("Using mixed precision training")
-except:
-    print("Mixed precision training not available, using default")
+@contextlib.contextmanager
+def fast_training():
+    """Mixed precision + XLA for the duration of an RNN run, restoring the previous global settings.
 
-# Optimize TensorFlow performance
-tf.config.optimizer.set_jit(True)  # Enable XLA compilation
-tf.data.experimental.enable_debug_mode()
+    Both are process-wide: the UI trains in threads of one process, so leaving
+    mixed_float16 set would make the next transformer/GAN build mix float16
+    and float32 tensors.
+    """
+    previous_policy = tf.keras.mixed_precision.global_policy()
+    previous_jit = tf.config.optimizer.get_jit() == 'autoclustering'
+    try:
+        tf.keras.mixed_precision.set_global_policy('mixed_float16')
+        print("Using mixed precision training")
+    except Exception:
+        print("Mixed precision training not available, using default")
+    tf.config.optimizer.set_jit(True)  # Enable XLA compilation
+    try:
+        yield
+    finally:
+        tf.keras.mixed_precision.set_global_policy(previous_policy)
+        tf.config.optimizer.set_jit(previous_jit)
 
-def load_tokens_and_vocab(proc_dir):
-    with open(os.path.join(proc_dir, 'tokens.txt'), 'r', encoding='utf-8') as f:
-        tokens = [line.strip() for line in f if line.strip()]
-    vocab = load_vocab(os.path.join(proc_dir, 'vocab.json'))
-    return tokens, vocab
+def train(cfg, callbacks=None, initial_epoch=0, resume_from=None):
+    """Train the RNN from a config dict.
 
-def main(config_path):
-    cfg = yaml.safe_load(open(config_path, 'r'))
-    proc_dir = cfg['data']['processed_dir']
-    seq_len = cfg['data']['sequence_length']
+    callbacks are appended to the default ones (the UI job runner passes its
+    live-metrics callback here); resume_from/initial_epoch continue an
+    interrupted run from a full checkpoint including optimizer state.
+    """
+    with fast_training():
+        return _train(cfg, callbacks, initial_epoch, resume_from)
 
-    tokens, vocab = load_tokens_and_vocab(proc_dir)
-    stoi = vocab
-    itos = {i:t for t,i in stoi.items()}
-    ids = [stoi[t] for t in tokens if t in stoi]
+def _train(cfg, callbacks, initial_epoch, resume_from):
+    seq_len = cfg['data']['sequence_length']
 
-    X_ids, y_ids = make_sequences(ids, seq_len)
-    X = np.array(X_ids, dtype=np.int32)
-    y = to_categorical(np.array(y_ids, dtype=np.int32), num_classes=len(stoi))
+    if resume_from and os.path.exists(resume_from):
+        print(f"Resuming from {resume_from} at epoch {initial_epoch + 1}")
+        model = load_model(resume_from)
+        batch_size, _ = resolve_batch_plan(cfg, model)
+    else:
+        with open(os.path.join(cfg['data']['processed_dir'], 'vocab.json'), 'r', encoding='utf-8') as f:
+            vocab_size = len(json.load(f))
+        model = build_rnn(vocab_size=vocab_size, seq_len=seq_len,
+                          embedding_dim=cfg['model']['embedding_dim'],
+                          rnn_units=cfg['model']['rnn_units'])
+        
+        # batch_size may be 'auto'; accumulation then reaches effective_batch_size
+        batch_size, accum_steps = resolve_batch_plan(cfg, model)
+        # Use a more efficient optimizer with a higher learning rate
+        optimizer = build_optimizer(cfg['train']['learning_rate'] * 2, accum_steps)
+        model.compile(optimizer=optimizer, loss='sparse_categorical_crossentropy')
 
-    model = build_rnn(vocab_size=len(stoi), seq_len=seq_len,
-                      embedding_dim=cfg['model']['embedding_dim'],
-                      rnn_units=cfg['model']['rnn_units'])
-    
-    # Use a more efficient optimizer with a higher learning rate
-    optimizer = Adam(learning_rate=cfg['train']['learning_rate'] * 2)
-    model.compile(optimizer=optimizer, loss='categorical_crossentropy')
+    # Windows/splits come from the on-disk dataset cache (built on first run)
+    train_dataset, val_dataset, meta = make_training_datasets(cfg, batch_size)
+    steps_per_epoch, sampling_callbacks = None, []
+    if importance_sampling_enabled(cfg):
+        # Loss-proportional window sampling with importance weights (see src/data/sampler.py)
+        train_dataset, steps_per_epoch, refresh = make_importance_sampling(cfg, batch_size)
+        sampling_callbacks.append(refresh)
 
     out_dir = os.path.join('outputs', 'rnn')
     os.makedirs(out_dir, exist_ok=True)
@@ -52,14 +73,17 @@ def main(config_path):
     rlr = ReduceLROnPlateau(monitor='loss', factor=0.5, patience=2, verbose=1)
     early_stop = EarlyStopping(monitor='loss', patience=4, verbose=1, restore_best_weights=True)
     
-    # Convert to TF Dataset for better performance
-    train_dataset = tf.data.Dataset.from_tensor_slices((X, y))
-    train_dataset = train_dataset.shuffle(buffer_size=len(X)).batch(cfg['train']['batch_size']).prefetch(tf.data.AUTOTUNE)
+    print(f"Training on {meta['sizes']['train']} sequences with vocab size {meta['vocab_size']}")
+    print(f"Batch size: {batch_size}, Epochs: {cfg['train']['epochs']}")
     
-    print(f"Training on {len(X)} sequences with vocab size {len(stoi)}")
-    print(f"Batch size: {cfg['train']['batch_size']}, Epochs: {cfg['train']['epochs']}")
-    
-    model.fit(train_dataset, epochs=cfg['train']['epochs'], callbacks=[ckpt, rlr, early_stop])
+    model.fit(train_dataset, validation_data=val_dataset, epochs=cfg['train']['epochs'],
+              steps_per_epoch=steps_per_epoch, initial_epoch=initial_epoch,
+              callbacks=sampling_callbacks + [ckpt, rlr, early_stop] + list(callbacks or []))
+    return model
+
+def main(config_path):
+    cfg = yaml.safe_load(open(config_path, 'r'))
+    train(cfg)
 
 if __name__ == '__main__':
     ap = argparse.ArgumentParser()
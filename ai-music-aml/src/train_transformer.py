@@ -1,42 +1,55 @@
 import argparse, os, json, numpy as np, yaml
 from tensorflow.keras.callbacks import ModelCheckpoint, ReduceLROnPlateau
-from tensorflow.keras.utils import to_categorical
-from src.utils.dataio import load_vocab, make_sequences
-from src.models.transformer import build_transformer
-
-def load_tokens_and_vocab(proc_dir):
-    with open(os.path.join(proc_dir, 'tokens.txt'), 'r', encoding='utf-8') as f:
-        tokens = [line.strip() for line in f if line.strip()]
-    vocab = load_vocab(os.path.join(proc_dir, 'vocab.json'))
-    return tokens, vocab
-
-def main(config_path):
-    cfg = yaml.safe_load(open(config_path, 'r'))
-    proc_dir = cfg['data']['processed_dir']
+from tensorflow.keras.models import load_model
+from src.data.dataset import make_training_datasets
+from src.data.sampler import importance_sampling_enabled, make_importance_sampling
+from src.models.transformer import build_transformer, build_causal_transformer, CUSTOM_OBJECTS
+from src.utils.batching import resolve_batch_plan, build_optimizer
+
+def train(cfg, callbacks=None, initial_epoch=0, resume_from=None):
+    """Train the transformer from a config dict (see src.train_rnn.train)."""
     seq_len = cfg['data']['sequence_length']
 
-    tokens, vocab = load_tokens_and_vocab(proc_dir)
-    stoi = vocab
-    ids = [stoi[t] for t in tokens if t in stoi]
-
-    X_ids, y_ids = make_sequences(ids, seq_len)
-    X = np.array(X_ids, dtype=np.int32)
-    y = to_categorical(np.array(y_ids, dtype=np.int32), num_classes=len(stoi))
-
-    model = build_transformer(vocab_size=len(stoi), seq_len=seq_len,
-                              d_model=cfg['model']['transformer']['d_model'],
-                              num_layers=cfg['model']['transformer']['num_layers'],
-                              num_heads=cfg['model']['transformer']['num_heads'],
-                              dff=cfg['model']['transformer']['dff'],
-                              dropout=cfg['model']['transformer']['dropout'])
-    model.compile(optimizer='adam', loss='categorical_crossentropy')
+    if resume_from and os.path.exists(resume_from):
+        print(f"Resuming from {resume_from} at epoch {initial_epoch + 1}")
+        model = load_model(resume_from, custom_objects=CUSTOM_OBJECTS)
+        batch_size, _ = resolve_batch_plan(cfg, model)
+    else:
+        with open(os.path.join(cfg['data']['processed_dir'], 'vocab.json'), 'r', encoding='utf-8') as f:
+            vocab_size = len(json.load(f))
+        # model.transformer.causal selects the decoder-only variant (KV-cached generation)
+        builder = build_causal_transformer if cfg['model']['transformer'].get('causal') else build_transformer
+        model = builder(vocab_size=vocab_size, seq_len=seq_len,
+                        d_model=cfg['model']['transformer']['d_model'],
+                        num_layers=cfg['model']['transformer']['num_layers'],
+                        num_heads=cfg['model']['transformer']['num_heads'],
+                        dff=cfg['model']['transformer']['dff'],
+                        dropout=cfg['model']['transformer']['dropout'])
+        # batch_size may be 'auto'; accumulation then reaches effective_batch_size
+        batch_size, accum_steps = resolve_batch_plan(cfg, model)
+        model.compile(optimizer=build_optimizer(accum_steps=accum_steps), loss='sparse_categorical_crossentropy')
+
+    # Windows/splits come from the on-disk dataset cache (built on first run)
+    train_dataset, val_dataset, meta = make_training_datasets(cfg, batch_size)
+    steps_per_epoch, sampling_callbacks = None, []
+    if importance_sampling_enabled(cfg):
+        # Loss-proportional window sampling with importance weights (see src/data/sampler.py)
+        train_dataset, steps_per_epoch, refresh = make_importance_sampling(cfg, batch_size)
+        sampling_callbacks.append(refresh)
 
     out_dir = os.path.join('outputs', 'transformer')
     os.makedirs(out_dir, exist_ok=True)
     ckpt = ModelCheckpoint(os.path.join(out_dir, 'best.keras'), monitor='loss', save_best_only=True, verbose=1)
     rlr = ReduceLROnPlateau(monitor='loss', factor=0.5, patience=5, verbose=1)
 
-    model.fit(X, y, batch_size=cfg['train']['batch_size'], epochs=cfg['train']['epochs'], callbacks=[ckpt, rlr])
+    model.fit(train_dataset, validation_data=val_dataset, epochs=cfg['train']['epochs'],
+              steps_per_epoch=steps_per_epoch, initial_epoch=initial_epoch,
+              callbacks=sampling_callbacks + [ckpt, rlr] + list(callbacks or []))
+    return model
+
+def main(config_path):
+    cfg = yaml.safe_load(open(config_path, 'r'))
+    train(cfg)
 
 if __name__ == '__main__':
     ap = argparse.ArgumentParser()
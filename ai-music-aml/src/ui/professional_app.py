@@ -16,7 +16,6 @@ import json
 import shutil
 import zipfile
 from io import BytesIO
-import tempfile
 
 # Set page config
 st.set_page_config(
@@ -32,7 +31,7 @@ sys.path.insert(0, str(project_root))
 
 # Import the working music generation module
 try:
-    from music_generation_ui import generate_music_ui
+    from music_generation_ui import generate_music_ui, stream_music_ui, continue_midi_ui
     WORKING_GENERATION_AVAILABLE = True
 except ImportError:
     WORKING_GENERATION_AVAILABLE = False
@@ -252,6 +251,13 @@ except ImportError:
             st.error(f"Preprocessing error: {e}")
             return False
 
+# Background training jobs (run in-process, polled by the training page)
+try:
+    from src.ui.training_jobs import JOB_MANAGER, resume_state
+    TRAINING_JOBS_AVAILABLE = True
+except ImportError:
+    TRAINING_JOBS_AVAILABLE = False
+
 # Initialize session state
 if 'uploaded_files' not in st.session_state:
     st.session_state.uploaded_files = []
@@ -455,17 +461,13 @@ def run_preprocessing_with_progress(midi_dir, proc_dir, min_notes=50, force_repr
         st.error(f"Error during preprocessing: {e}")
         return False
 
-def temperature_sample(probs, temperature=1.0):
+def temperature_sample(probs, temperature=1.0, top_k=0, top_p=1.0):
     """Sample from probability distribution with temperature"""
-    probs = np.asarray(probs).astype('float64')
-    if temperature <= 0:
-        return int(np.argmax(probs))
-    logits = np.log(probs + 1e-12) / temperature
-    exp = np.exp(logits)
-    probs = exp / np.sum(exp)
-    return int(np.random.choice(len(probs), p=probs))
+    from src.inference.sampling import sample_from_probs
+    return sample_from_probs(probs, temperature, top_k, top_p)
 
-def generate_music_with_progress(model_path, length=200, temperature=1.0, output_path="outputs/generated.mid"):
+def generate_music_with_progress(model_path, length=200, temperature=1.0, output_path="outputs/generated.mid",
+                                 beam_width=0, num_groups=1, no_repeat_ngram_size=0):
     """Generate music with progress tracking using working generation"""
     try:
         if not WORKING_GENERATION_AVAILABLE:
@@ -482,7 +484,9 @@ def generate_music_with_progress(model_path, length=200, temperature=1.0, output
         status_text.text("🎵 Loading model and generating music...")
         progress_bar.progress(0.1)
         
-        result = generate_music_ui(length, temperature, output_filename)
+        result = generate_music_ui(length, temperature, output_filename,
+                                   beam_width=beam_width, num_groups=num_groups,
+                                   no_repeat_ngram_size=no_repeat_ngram_size)
         
         progress_bar.progress(0.8)
         status_text.text("🎼 Converting to MIDI...")
@@ -501,6 +505,51 @@ def generate_music_with_progress(model_path, length=200, temperature=1.0, output
         st.error(f"Error generating music: {e}")
         return None, None
 
+def piano_roll_figure(events):
+    """Plotly piano roll of streamed note events (one line segment per pitch)"""
+    xs, ys = [], []
+    for ev in events:
+        for pitch in ev['pitches']:
+            xs += [ev['offset'], ev['offset'] + ev['duration'], None]
+            ys += [pitch, pitch, None]
+    fig = go.Figure(go.Scatter(x=xs, y=ys, mode='lines', line=dict(width=6, color='#667eea'), hoverinfo='skip'))
+    fig.update_layout(height=260, margin=dict(l=0, r=0, t=10, b=0), showlegend=False,
+                      xaxis_title="Beats", yaxis_title="MIDI pitch")
+    return fig
+
+def stream_music_with_progress(length=200, temperature=1.0, output_path="outputs/generated.mid", chunk_tokens=16):
+    """Sampling with live feedback: the piano roll grows and the MIDI file stays playable while generating"""
+    try:
+        if not WORKING_GENERATION_AVAILABLE:
+            st.error("Music generation not available - missing dependencies")
+            return None, None
+        
+        progress_bar = st.progress(0)
+        status_text = st.empty()
+        roll = st.empty()
+        status_text.text("🎵 Loading model...")
+        
+        tokens, events, first_note = [], [], None
+        for update in stream_music_ui(length, temperature, os.path.basename(output_path), chunk_tokens=chunk_tokens):
+            if update['id'] is not None:
+                tokens.append(update['token'])
+            if update['event']:
+                events.append(update['event'])
+                if first_note is None:
+                    first_note = update['elapsed']
+            if update['chunk']:
+                progress_bar.progress(min(len(tokens) / length, 1.0))
+                first = f", first note after {first_note * 1000:.0f} ms" if first_note is not None else ""
+                status_text.text(f"🎼 {len(tokens)}/{length} tokens, {len(events)} notes{first}")
+                roll.plotly_chart(piano_roll_figure(events), use_container_width=True)
+        
+        progress_bar.progress(1.0)
+        return output_path, tokens
+        
+    except Exception as e:
+        st.error(f"Error generating music: {e}")
+        return None, None
+
 def main():
     # Header
     st.markdown("""
@@ -954,7 +1003,8 @@ def model_training_page(cfg):
         col_a, col_b = st.columns(2)
         with col_a:
             epochs = st.slider("Training Epochs", 5, 50, 10)
-            batch_size = st.selectbox("Batch Size", [32, 64, 128, 256], index=2)
+            batch_size = st.selectbox("Batch Size", ["auto", 32, 64, 128, 256], index=3,
+                                      help="'auto' probes the largest batch that fits in memory")
         
         with col_b:
             learning_rate = st.selectbox("Learning Rate", [0.0005, 0.001, 0.002, 0.005], index=1)
@@ -1010,55 +1060,106 @@ def model_training_page(cfg):
     
     with col2:
         can_train = os.path.exists("outputs/processed/tokens.txt")
-        
-        if st.button("🚀 Start Training", key="start_training", disabled=not can_train):
+        running = TRAINING_JOBS_AVAILABLE and JOB_MANAGER.is_running(model_type)
+        resumable = TRAINING_JOBS_AVAILABLE and not running and resume_state(model_type) is not None
+        
+        col_start, col_resume, col_cancel = st.columns(3)
+        with col_start:
+            start_clicked = st.button("🚀 Start Training", key="start_training", disabled=not can_train or running)
+        with col_resume:
+            resume_clicked = st.button("⏯️ Resume", key="resume_training", disabled=not resumable,
+                                       help="Continue from the last completed epoch")
+        with col_cancel:
+            if st.button("⏹️ Cancel", key="cancel_training", disabled=not running):
+                JOB_MANAGER.cancel(model_type)
+        
+        if start_clicked or resume_clicked:
             if not can_train:
                 st.error("❌ Please process data first!")
+            elif not TRAINING_JOBS_AVAILABLE or not cfg:
+                st.error("❌ Training not available - missing dependencies or configuration")
             else:
                 # Update config
-                if cfg:
-                    cfg['train']['epochs'] = epochs
-                    cfg['train']['batch_size'] = batch_size
-                    cfg['train']['learning_rate'] = learning_rate
-                    
-                    if model_type == "rnn":
-                        cfg['model']['embedding_dim'] = embedding_dim
-                        cfg['model']['rnn_units'] = rnn_units
-                    elif model_type == "transformer":
-                        cfg['model']['transformer']['d_model'] = d_model
-                        cfg['model']['transformer']['num_layers'] = num_layers
-                        cfg['model']['transformer']['num_heads'] = num_heads
-                    
-                    save_config(cfg)
+                cfg['train']['epochs'] = epochs
+                cfg['train']['batch_size'] = batch_size
+                cfg['train']['learning_rate'] = learning_rate
                 
-                # Training simulation with progress
-                with st.spinner(f"🧠 Training {model_type.upper()} model..."):
-                    progress_bar = st.progress(0)
-                    status_text = st.empty()
-                    
-                    for epoch in range(epochs):
-                        progress = (epoch + 1) / epochs
-                        progress_bar.progress(progress)
-                        status_text.text(f"Epoch {epoch + 1}/{epochs}")
-                        time.sleep(0.5)  # Simulate training time
-                    
-                    # Run actual training command
-                    try:
-                        # Use the training wrapper script
-                        wrapper_path = project_root / "train_wrapper.py"
-                        cmd = f"py -3 \"{wrapper_path}\" {model_type}"
-                        result = subprocess.run(cmd, shell=True, capture_output=True, text=True, cwd=str(project_root))
-                        
-                        if result.returncode == 0:
-                            st.success(f"✅ {model_type.upper()} model trained successfully!")
-                            st.balloons()
-                        else:
-                            st.error(f"❌ Training failed: {result.stderr}")
-                            if result.stdout:
-                                st.text("Output:")
-                                st.code(result.stdout)
-                    except Exception as e:
-                        st.error(f"❌ Training error: {e}")
+                if model_type == "rnn":
+                    cfg['model']['embedding_dim'] = embedding_dim
+                    cfg['model']['rnn_units'] = rnn_units
+                elif model_type == "transformer":
+                    cfg['model']['transformer']['d_model'] = d_model
+                    cfg['model']['transformer']['num_layers'] = num_layers
+                    cfg['model']['transformer']['num_heads'] = num_heads
+                
+                save_config(cfg)
+                
+                # Training runs in a background thread; this page only polls its status
+                try:
+                    JOB_MANAGER.start(model_type, cfg, resume=resume_clicked)
+                except Exception as e:
+                    st.error(f"❌ Training error: {e}")
+    
+    if TRAINING_JOBS_AVAILABLE:
+        render_training_status(model_type)
+
+def format_eta(seconds):
+    """Format an ETA in seconds as h:mm:ss"""
+    if seconds is None:
+        return "–"
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+def render_training_status(model_type):
+    """Live view of the background training job for this model type"""
+    status = JOB_MANAGER.status(model_type)
+    if not status:
+        return
+    
+    state = status.get('state', 'starting')
+    st.subheader(f"📈 Live Training – {model_type.upper()} ({state})")
+    st.progress(float(status.get('progress') or 0.0))
+    
+    col_a, col_b, col_c, col_d = st.columns(4)
+    loss = status.get('loss')
+    samples_per_sec = status.get('samples_per_sec')
+    with col_a:
+        st.metric("Epoch", f"{status.get('epoch', 0)}/{status.get('epochs', '?')}")
+    with col_b:
+        st.metric("Loss", f"{loss:.4f}" if loss is not None else "–")
+    with col_c:
+        st.metric("Throughput", f"{samples_per_sec:,.0f} samples/s" if samples_per_sec else "–")
+    with col_d:
+        st.metric("ETA", format_eta(status.get('eta_sec')))
+    
+    history = status.get('history') or []
+    if history:
+        fig = go.Figure()
+        for key, name in (("loss", "Training loss"), ("val_loss", "Validation loss")):
+            points = [(h['epoch'], h[key]) for h in history if key in h]
+            if points:
+                fig.add_trace(go.Scatter(x=[p[0] for p in points], y=[p[1] for p in points],
+                                         mode="lines+markers", name=name))
+        fig.update_layout(xaxis_title="Epoch", yaxis_title="Loss", height=300, margin=dict(t=20, b=20))
+        st.plotly_chart(fig, use_container_width=True)
+    
+    if state == 'finished':
+        st.success(f"✅ {model_type.upper()} model trained successfully!")
+    elif state == 'cancelled':
+        if resume_state(model_type) is not None:
+            st.warning("⏹️ Training cancelled – use Resume to continue from the last completed epoch")
+        else:
+            st.warning("⏹️ Training cancelled")
+    elif state == 'failed':
+        st.error(f"❌ Training failed: {status.get('error')}")
+        with st.expander("Details"):
+            st.code(status.get('traceback', ''))
+    
+    if JOB_MANAGER.is_running(model_type):
+        if st.checkbox("🔄 Auto-refresh", value=True, key="training_autorefresh"):
+            # Poll the status store; any user interaction interrupts this and reruns immediately
+            time.sleep(2)
+            st.rerun()
 
 def music_generation_page(cfg):
     """Enhanced music generation with presets and controls"""
@@ -1117,6 +1218,17 @@ def music_generation_page(cfg):
                 temperature = preset_temps[preset]
                 st.metric("🌡️ Temperature", temperature)
             
+            # Decoding: random sampling or the most likely continuation
+            decoding = st.selectbox("🎯 Decoding", ["Sampling", "Beam search", "Diverse beam search"],
+                                    help="Beam search picks the most likely continuation instead of sampling")
+            beam_width, num_groups, no_repeat_ngram_size = 0, 1, 0
+            if decoding != "Sampling":
+                beam_width = st.slider("🔦 Beam Width", 2, 16, 4, 2)
+                if decoding == "Diverse beam search":
+                    num_groups = 2
+                no_repeat_ngram_size = st.slider("🔁 No-repeat n-gram size", 0, 8, 0,
+                                                 help="Never repeat a phrase of this many tokens (0 = off)")
+            
             # Output settings
             output_name = st.text_input("📁 Output Filename", "ai_composition.mid")
             if not output_name.endswith('.mid'):
@@ -1171,9 +1283,14 @@ def music_generation_page(cfg):
             with st.container():
                 model_type, model_path = selected_model
                 
-                generated_path, tokens = generate_music_with_progress(
-                    model_path, length, temperature, output_path
-                )
+                if beam_width:
+                    generated_path, tokens = generate_music_with_progress(
+                        model_path, length, temperature, output_path, beam_width, num_groups,
+                        no_repeat_ngram_size
+                    )
+                else:
+                    # Sampling streams: notes appear as they are generated
+                    generated_path, tokens = stream_music_with_progress(length, temperature, output_path)
                 
                 if generated_path:
                     st.success("🎉 Music generated successfully!")
@@ -1225,45 +1342,56 @@ def music_testing_page(cfg):
                 test_temperature = st.slider("Variation Style", 0.5, 1.5, 1.0)
             
             with col_b:
-                similarity = st.slider("Similarity to Original", 0.1, 1.0, 0.7)
-                output_format = st.selectbox("Output Format", ["MIDI", "Audio Preview"])
+                similarity = st.slider("Similarity to Original", 0.0, 1.0, 0.7)
+                test_mode = st.selectbox("Mode", ["Continuation", "Variation"],
+                                         help="Continue from the end of the file, or write a new piece "
+                                              "from its opening")
             
             # Generate variation
             if st.button("🎼 Generate Variation", key="test_generate"):
+                if not WORKING_GENERATION_AVAILABLE:
+                    st.error("Music generation not available - missing dependencies")
+                    return
                 with st.spinner("Processing test file..."):
-                    # Save uploaded file temporarily
-                    with tempfile.NamedTemporaryFile(delete=False, suffix='.mid') as tmp_file:
-                        tmp_file.write(test_file.getbuffer())
-                        tmp_path = tmp_file.name
+                    # The upload is tokenized straight from its bytes, no temp file needed
+                    mode = "continue" if test_mode == "Continuation" else "variation"
+                    result = continue_midi_ui(test_file.getvalue(), test_length, test_temperature, similarity, mode,
+                                              output_file=f"{Path(test_file.name).stem}_{mode}.mid")
+                
+                if result['success']:
+                    st.session_state.test_results = {'similarity': result['similarity'],
+                                                     'notes': result['notes'], 'time': result['time']}
+                    st.success(f"🎵 {test_mode} generated: {result['message']}")
+                    if result['truncated']:
+                        st.warning("⏱️ Stopped early to stay within the time budget")
                     
-                    try:
-                        # Process the file and generate variation
-                        st.success("🎵 Variation generated successfully!")
-                        
-                        # Show comparison
-                        col_orig, col_var = st.columns(2)
-                        with col_orig:
-                            st.write("📁 Original")
-                            st.write(f"File: {test_file.name}")
-                            st.write(f"Size: {test_file.size / 1024:.1f} KB")
-                        
-                        with col_var:
-                            st.write("🎼 Generated Variation")
-                            st.write(f"Length: {test_length} notes")
-                            st.write(f"Style: {test_temperature}")
-                        
-                    finally:
-                        # Clean up temporary file
-                        os.unlink(tmp_path)
+                    # Show comparison
+                    col_orig, col_var = st.columns(2)
+                    with col_orig:
+                        st.write("📁 Original")
+                        st.write(f"File: {test_file.name}")
+                        st.write(f"Size: {test_file.size / 1024:.1f} KB")
+                        st.write(f"Events: {result['source_events']}")
+                    
+                    with col_var:
+                        st.write(f"🎼 Generated {test_mode}")
+                        st.write(f"Length: {result['tokens_generated']} tokens, {result['notes']} notes")
+                        st.write(f"Style: {test_temperature}")
+                    
+                    st.plotly_chart(piano_roll_figure(result['events']), use_container_width=True)
+                    with open(result['output_path'], 'rb') as f:
+                        st.download_button("💾 Download MIDI", f.read(), file_name=os.path.basename(result['output_path']),
+                                           mime="audio/midi", key="test_download")
+                else:
+                    st.error(f"❌ {result['message']}")
     
     with col2:
         st.subheader("📊 Test Results")
         
-        # Show testing history
-        st.info("🧪 Upload a MIDI file to start testing")
-        
-        # Test metrics placeholder
-        if st.session_state.get('test_results'):
+        # Metrics of the last generated continuation / variation
+        if not st.session_state.get('test_results'):
+            st.info("🧪 Upload a MIDI file to start testing")
+        else:
             results = st.session_state.test_results
             
             st.metric("🎯 Similarity Score", f"{results.get('similarity', 0):.2f}")
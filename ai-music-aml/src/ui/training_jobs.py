@@ -0,0 +1,210 @@
+"""In-process background training jobs for the Streamlit UI.
+
+Training runs in a daemon thread inside the Streamlit server process, so the
+page script never blocks on it.  A Keras callback streams per-batch/epoch
+loss, throughput and ETA into a thread-safe status store which the page polls
+on every rerun.  Jobs can be cancelled (training stops at the next batch) and
+resumed from the checkpoint written at the end of the last completed epoch.
+
+Streamlit re-executes the page script on every interaction but keeps imported
+modules alive, so the module-level JOB_MANAGER persists across reruns.
+"""
+import copy
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+
+import tensorflow as tf
+
+class TrainingStatusStore:
+    """Thread-safe dict of job_id -> status snapshot."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._status = {}
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            self._status.setdefault(job_id, {}).update(fields)
+
+    def append(self, job_id, key, value):
+        with self._lock:
+            self._status.setdefault(job_id, {}).setdefault(key, []).append(value)
+
+    def get(self, job_id):
+        with self._lock:
+            return copy.deepcopy(self._status.get(job_id))
+
+def _float_logs(logs):
+    out = {}
+    for k, v in (logs or {}).items():
+        try:
+            out[k] = float(v)
+        except (TypeError, ValueError):
+            pass
+    return out
+
+class LiveMetricsCallback(tf.keras.callbacks.Callback):
+    """Pushes real training progress into a TrainingStatusStore.
+
+    Also honours a cancel event (checked after every batch) and, when
+    resume_path is set, saves a full checkpoint + state file after each epoch.
+    """
+    def __init__(self, store, job_id, cancel_event, resume_path=None, initial_epoch=0,
+                 batch_size=None, update_every=5):
+        super().__init__()
+        self.batch_size = batch_size
+        self.store = store
+        self.job_id = job_id
+        self.cancel_event = cancel_event
+        self.resume_path = resume_path
+        self.initial_epoch = initial_epoch
+        self.update_every = update_every
+
+    def on_train_begin(self, logs=None):
+        params = self.params or {}
+        self.epochs = params.get('epochs') or 1
+        self.steps = params.get('steps') or 0
+        self.train_start = time.perf_counter()
+        self.batches_done = 0
+        self.store.update(self.job_id, state='running', epochs=self.epochs, steps_per_epoch=self.steps)
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch = epoch
+        self.epoch_start = time.perf_counter()
+        self.epoch_batches = 0
+        self.store.update(self.job_id, epoch=epoch + 1, batch=0)
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.batches_done += 1
+        self.epoch_batches += 1
+        if self.cancel_event.is_set():
+            self.model.stop_training = True
+        if batch % self.update_every and not self.model.stop_training:
+            return
+        logs = _float_logs(logs)
+        loss = logs.get('loss', logs.get('g_loss'))
+        elapsed = time.perf_counter() - self.epoch_start
+        batches_per_sec = (batch + 1) / max(elapsed, 1e-9)
+        remaining = (self.epochs - self.epoch - 1) * self.steps + max(self.steps - batch - 1, 0)
+        progress = ((self.epoch - self.initial_epoch) * self.steps + batch + 1) / max(
+            (self.epochs - self.initial_epoch) * self.steps, 1)
+        self.store.update(self.job_id, batch=batch + 1,
+                          loss=loss, metrics=logs,
+                          batches_per_sec=batches_per_sec,
+                          samples_per_sec=batches_per_sec * self.batch_size if self.batch_size else None,
+                          eta_sec=remaining / batches_per_sec if self.steps else None,
+                          progress=min(progress, 1.0))
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = _float_logs(logs)
+        if not self.steps:
+            # Cardinality unknown up front: learn it from the first epoch
+            self.steps = self.batches_done
+        if self.epoch_batches < self.steps:
+            # Cancelled mid-epoch: resume from the last *complete* epoch instead
+            return
+        self.store.append(self.job_id, 'history', dict(logs, epoch=epoch + 1,
+                                                       seconds=time.perf_counter() - self.epoch_start))
+        self.store.update(self.job_id, last_completed_epoch=epoch + 1)
+        if self.resume_path:
+            self.model.save(self.resume_path)
+            with open(self.resume_path + '.json', 'w', encoding='utf-8') as f:
+                json.dump({'epoch': epoch + 1, 'logs': logs}, f)
+
+    def on_train_end(self, logs=None):
+        self.store.update(self.job_id, elapsed_sec=time.perf_counter() - self.train_start)
+
+def resume_checkpoint_path(model_type):
+    return os.path.join('outputs', model_type, 'resume.keras')
+
+def resume_state(model_type):
+    """Epoch recorded next to the resume checkpoint, or None if there is nothing to resume."""
+    path = resume_checkpoint_path(model_type)
+    if not (os.path.exists(path) and os.path.exists(path + '.json')):
+        return None
+    with open(path + '.json', 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def _train_fn(model_type):
+    # Imported lazily so the UI starts without building the training modules
+    if model_type == 'rnn':
+        from src.train_rnn import train
+    elif model_type == 'transformer':
+        from src.train_transformer import train
+    elif model_type == 'gan':
+        from src.train_gan import train
+    else:
+        raise ValueError(f"Unknown model type: {model_type}")
+    return train
+
+class TrainingJobManager:
+    """Starts, cancels and resumes one background training thread per model type."""
+    def __init__(self, store=None):
+        self.store = store or TrainingStatusStore()
+        self._lock = threading.Lock()
+        self._jobs = {}  # model_type -> (job_id, thread, cancel_event)
+
+    def start(self, model_type, cfg, resume=False):
+        with self._lock:
+            if self.is_running(model_type):
+                raise RuntimeError(f"A {model_type} training job is already running")
+            initial_epoch, resume_from = 0, None
+            # GAN training has no resumable Keras checkpoint
+            resume_path = resume_checkpoint_path(model_type) if model_type != 'gan' else None
+            if resume and resume_path:
+                state = resume_state(model_type)
+                if state:
+                    initial_epoch, resume_from = state['epoch'], resume_path
+            job_id = uuid.uuid4().hex[:8]
+            cancel_event = threading.Event()
+            self.store.update(job_id, id=job_id, model_type=model_type, state='starting',
+                              started_at=time.time(), initial_epoch=initial_epoch,
+                              epoch=initial_epoch, progress=0.0, history=[])
+            thread = threading.Thread(target=self._run, daemon=True, name=f"train-{model_type}-{job_id}",
+                                      args=(job_id, model_type, copy.deepcopy(cfg), cancel_event,
+                                            resume_path, initial_epoch, resume_from))
+            self._jobs[model_type] = (job_id, thread, cancel_event)
+            thread.start()
+            return job_id
+
+    def _run(self, job_id, model_type, cfg, cancel_event, resume_path, initial_epoch, resume_from):
+        if resume_path:
+            os.makedirs(os.path.dirname(resume_path), exist_ok=True)
+        cb = LiveMetricsCallback(self.store, job_id, cancel_event, resume_path, initial_epoch,
+                                 batch_size=cfg['train']['batch_size'] if cfg['train']['batch_size'] != 'auto' else None)
+        try:
+            train = _train_fn(model_type)
+            if model_type == 'gan':
+                train(cfg, callbacks=[cb], epochs=cfg['train']['epochs'])
+            else:
+                train(cfg, callbacks=[cb], initial_epoch=initial_epoch, resume_from=resume_from)
+            state = 'cancelled' if cancel_event.is_set() else 'finished'
+            self.store.update(job_id, state=state, finished_at=time.time())
+            if state == 'finished' and resume_path:
+                # A completed run has nothing left to resume
+                for path in (resume_path, resume_path + '.json'):
+                    if os.path.exists(path):
+                        os.remove(path)
+        except Exception as e:
+            self.store.update(job_id, state='failed', error=str(e), traceback=traceback.format_exc(),
+                              finished_at=time.time())
+
+    def cancel(self, model_type):
+        job = self._jobs.get(model_type)
+        if job and job[1].is_alive():
+            job[2].set()
+            self.store.update(job[0], state='cancelling')
+
+    def is_running(self, model_type):
+        job = self._jobs.get(model_type)
+        return bool(job and job[1].is_alive())
+
+    def status(self, model_type):
+        """Latest status snapshot for the most recent job of this model type."""
+        job = self._jobs.get(model_type)
+        return self.store.get(job[0]) if job else None
+
+JOB_MANAGER = TrainingJobManager()
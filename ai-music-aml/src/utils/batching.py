@@ -0,0 +1,157 @@
+"""Batch-size probing and gradient accumulation for machines with different RAM.
+
+`train.batch_size: auto` probes the largest power-of-two micro-batch whose
+training step fits in `train.memory_budget_mb`; `train.effective_batch_size`
+is then reached by accumulating gradients over several micro-batches, so one
+config trains with the same optimisation behaviour on any worker.
+"""
+import gc
+import math
+import os
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.optimizers import Adam
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+def _gpu_available():
+    return bool(tf.config.list_physical_devices('GPU'))
+
+def _reset_peak_memory():
+    """Restart peak tracking (GPU allocator stats, or the process's peak RSS on Linux); False if unsupported."""
+    if _gpu_available():
+        try:
+            tf.config.experimental.reset_memory_stats('GPU:0')
+            return True
+        except (ValueError, AttributeError):
+            return False
+    try:
+        # '5' resets VmHWM to the current RSS (Linux >= 4.0)
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def memory_used_mb():
+    """Peak GPU memory, or peak process RSS on Linux, since the last reset; None if unmeasurable."""
+    if _gpu_available():
+        try:
+            return tf.config.experimental.get_memory_info('GPU:0')['peak'] / 2 ** 20
+        except (ValueError, AttributeError):
+            return None
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 2 ** 10
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+def available_memory_mb():
+    """Free host memory, or None on platforms where it can't be read without psutil."""
+    if psutil is not None:
+        return psutil.virtual_memory().available / 2 ** 20
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def resolve_memory_budget(budget):
+    """`auto` -> 70% of currently free host memory (None on GPU: rely on OOM probing)."""
+    if budget in (None, 'auto'):
+        if _gpu_available():
+            return None
+        free = available_memory_mb()
+        return 0.7 * free if free else None
+    return float(budget)
+
+def probe_batch_size(model, seq_len, memory_budget_mb=None, min_batch=8, max_batch=1024, steps=2):
+    """Largest power-of-two batch in [min_batch, max_batch] whose train step fits the budget.
+
+    Runs a couple of real train steps on a throw-away clone of `model` for
+    growing batch sizes, stops on OOM or when measured (or linearly
+    extrapolated) memory would exceed the budget.  Each batch's usage is the
+    peak reached during its own steps above the memory in use before probing,
+    so the peak is reset before every batch.  On a CPU whose peak can't be
+    reset (no /proc, i.e. not Linux) no probe runs and min_batch is returned:
+    a process-lifetime peak (or plain RSS) says nothing about one batch.
+    Returns (batch, {batch: MB}).
+    """
+    if not _gpu_available() and not _reset_peak_memory():
+        return min_batch, {}
+    vocab_size = model.output_shape[-1]
+    probe = tf.keras.models.clone_model(model)
+    probe.compile(optimizer=Adam(), loss='sparse_categorical_crossentropy')
+    _reset_peak_memory()
+    baseline = memory_used_mb()
+
+    best, usage = None, {}
+    batch = min_batch
+    while batch <= max_batch:
+        x = np.random.randint(0, vocab_size, size=(batch, seq_len)).astype(np.int32)
+        y = np.random.randint(0, vocab_size, size=(batch,)).astype(np.int32)
+        try:
+            _reset_peak_memory()
+            for _ in range(steps):
+                probe.train_on_batch(x, y)
+        except (tf.errors.ResourceExhaustedError, MemoryError):
+            break
+        used = memory_used_mb()
+        if used is not None and baseline is not None:
+            usage[batch] = max(used - baseline, 0.0)
+            if memory_budget_mb and usage[batch] > memory_budget_mb:
+                break
+        best = batch
+        if memory_budget_mb and len(usage) >= 2:
+            (b1, u1), (b2, u2) = sorted(usage.items())[-2:]
+            per_sample = max((u2 - u1) / (b2 - b1), 0.0)
+            if u2 + per_sample * b2 > memory_budget_mb:  # predicted usage at 2 * b2
+                break
+        batch *= 2
+
+    del probe
+    gc.collect()
+    return best or min_batch, usage
+
+def resolve_batch_plan(cfg, model):
+    """(micro_batch, accum_steps) from cfg['train'].
+
+    batch_size may be an int or 'auto'; effective_batch_size (defaults to the
+    configured batch size) is reached with ceil(effective / micro) accumulation steps.
+    """
+    train_cfg = cfg['train']
+    batch = train_cfg.get('batch_size', 128)
+    effective = train_cfg.get('effective_batch_size') or (batch if batch != 'auto' else None)
+    if batch == 'auto':
+        budget = resolve_memory_budget(train_cfg.get('memory_budget_mb', 'auto'))
+        batch, usage = probe_batch_size(model, cfg['data']['sequence_length'], budget,
+                                        max_batch=train_cfg.get('max_batch_size', 1024))
+        if effective:
+            batch = min(batch, int(effective))
+        print(f"Auto batch size: {batch} (budget {budget:.0f} MB)" if budget else f"Auto batch size: {batch}")
+        for b, mb in sorted(usage.items()):
+            print(f"  batch {b:5d}: {mb:8.1f} MB")
+    batch = int(batch)
+    accum_steps = max(1, math.ceil(int(effective) / batch)) if effective else 1
+    if accum_steps > 1:
+        print(f"Gradient accumulation: {accum_steps} x {batch} = effective batch {accum_steps * batch}")
+    return batch, accum_steps
+
+def build_optimizer(learning_rate=0.001, accum_steps=1):
+    """Adam that applies the averaged gradient every `accum_steps` micro-batches.
+
+    Uses the optimizer's native gradient_accumulation_steps (Keras 3); older
+    Keras versions fall back to plain per-batch updates.
+    """
+    if accum_steps > 1:
+        try:
+            return Adam(learning_rate=learning_rate, gradient_accumulation_steps=accum_steps)
+        except TypeError:
+            print("Gradient accumulation needs Keras 3 (TensorFlow >= 2.16); training without it")
+    return Adam(learning_rate=learning_rate)
@@ -1,6 +1,8 @@
 from typing import List, Dict
 from music21 import converter, instrument, note, chord, stream
 
+from src.utils.token_table import NOTE, CHORD, parse_token
+
 def events_to_stream(events: List[dict]) -> stream.Stream:
     s = stream.Stream()
     offset = 0.0
@@ -29,21 +31,22 @@ def events_to_stream(events: List[dict]) -> stream.Stream:
 
 def tokens_to_events(tokens: List[str]):
     # Token format: P<pitch>|D<dur>|S<step> or CHORD:p1,p2|D<dur>|S<step>
+    # Prefer TokenTable.events(ids) when the ids are at hand: it doesn't re-parse strings
     events = []
     for t in tokens:
-        parts = t.split('|')
-        pitch_part = parts[0]
-        dur = float(parts[1][1:]) if parts[1].startswith('D') else float(parts[1])
-        step = float(parts[2][1:]) if parts[2].startswith('S') else float(parts[2])
-        if pitch_part.startswith('CHORD:'):
-            pitches = [p for p in pitch_part.replace('CHORD:', '').split(',') if p]
-            events.append({'pitch': pitches, 'duration': dur, 'step': step})
-        else:
-            pitch = pitch_part[1:] if pitch_part.startswith('P') else pitch_part
-            events.append({'pitch': pitch, 'duration': dur, 'step': step})
+        parsed = parse_token(t)
+        if parsed is None or parsed[0] not in (NOTE, CHORD):
+            continue
+        kind, names, dur, step = parsed
+        events.append({'pitch': list(names) if kind == CHORD else names[0], 'duration': dur, 'step': step})
     return events
 
 def save_midi_from_tokens(tokens: List[str], out_path: str):
     events = tokens_to_events(tokens)
     s = events_to_stream(events)
     s.write('midi', fp=out_path)
+
+def save_midi_from_ids(ids, table, out_path: str):
+    """Like save_midi_from_tokens, reading attributes from a TokenTable by id."""
+    s = events_to_stream(table.events(ids))
+    s.write('midi', fp=out_path)
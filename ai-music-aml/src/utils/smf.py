@@ -0,0 +1,178 @@
+"""Minimal Standard MIDI File writer (format 0, one piano track) and reader.
+
+music21's `stream.write('midi')` builds a full score object model and takes
+tens of milliseconds even for a few notes, too slow to re-render a file
+while a piece is still being generated.  This writes the bytes directly
+from (start, duration, pitch, velocity) tuples, in quarter notes:
+
+    data = smf_bytes([(0.0, 1.0, 60, 80), (1.0, 0.5, 64, 80)], tempo_bpm=120)
+
+`SMFWriter` appends notes to an open file as they arrive, in constant
+memory: note-ons are written straight away (onsets must not go backwards),
+note-offs wait in a heap of the notes still sounding, and every `flush()`
+ends the track and patches its length, so the file is complete and playable
+between flushes however long the piece grows.
+
+`read_smf_tracks` / `read_smf` go the other way for uploads: they walk the
+raw events of a format 0 or 1 file into the same (start, duration, pitch,
+velocity) tuples, in milliseconds where music21's `converter.parse` takes
+seconds.
+"""
+import heapq
+import io
+import os
+import struct
+
+_END_OF_TRACK = b'\x00\xff\x2f\x00'
+
+def _vlq(n):
+    """Variable-length quantity encoding of a delta time."""
+    out = [n & 0x7F]
+    n >>= 7
+    while n:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    return bytes(reversed(out))
+
+class SMFWriter:
+    """Streaming SMF writer over a path or a seekable binary file object."""
+    def __init__(self, file, tempo_bpm=120, ticks_per_beat=480, program=0):
+        self._own = isinstance(file, (str, os.PathLike))
+        self.f = open(file, 'w+b') if self._own else file
+        self.ticks_per_beat = ticks_per_beat
+        self.f.write(b'MThd' + struct.pack('>IHHH', 6, 0, 1, ticks_per_beat) + b'MTrk\x00\x00\x00\x00')
+        self._track_start = self.f.tell()
+        self._end = self._track_start     # file position where the next events go (before end-of-track)
+        self._buf = bytearray(b'\x00\xff\x51\x03' + int(round(60_000_000 / tempo_bpm)).to_bytes(3, 'big'))
+        self._buf += bytes((0x00, 0xC0, program))
+        self._tick = 0                    # tick of the last event written
+        self._offs = []                   # (tick, pitch) note-offs of sounding notes
+
+    def _event(self, tick, data):
+        self._buf += _vlq(tick - self._tick) + data
+        self._tick = tick
+
+    def _release(self, until):
+        while self._offs and self._offs[0][0] <= until:
+            tick, pitch = heapq.heappop(self._offs)
+            self._event(tick, bytes((0x80, pitch, 0)))
+
+    def add(self, start, duration, pitch, velocity=80):
+        """One note, start and duration in quarter notes; starts earlier than the last event are clamped."""
+        pitch = min(max(int(pitch), 0), 127)
+        on = max(int(round(start * self.ticks_per_beat)), self._tick)
+        off = max(int(round((start + duration) * self.ticks_per_beat)), on + 1)
+        self._release(on)  # note-offs before note-ons on the same tick
+        self._event(on, bytes((0x90, pitch, min(max(int(velocity), 1), 127))))
+        heapq.heappush(self._offs, (off, pitch))
+
+    def flush(self):
+        """Append the buffered events and end the track there; the file is valid afterwards."""
+        self.f.seek(self._end)
+        self.f.write(self._buf)
+        self._buf.clear()
+        self._end = self.f.tell()
+        self.f.write(_END_OF_TRACK)
+        self.f.seek(self._track_start - 4)
+        self.f.write(struct.pack('>I', self._end + len(_END_OF_TRACK) - self._track_start))
+        self.f.seek(0, io.SEEK_END)
+        self.f.flush()
+
+    def close(self):
+        """Release every sounding note and finish the file."""
+        self._release(float('inf'))
+        self.flush()
+        if self._own:
+            self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def smf_bytes(notes, tempo_bpm=120, ticks_per_beat=480, program=0):
+    """Notes (start, duration, pitch, velocity) in quarter notes -> SMF bytes."""
+    buf = io.BytesIO()
+    writer = SMFWriter(buf, tempo_bpm, ticks_per_beat, program)
+    for note in sorted(notes, key=lambda n: n[0]):
+        writer.add(*note)
+    writer.close()
+    return buf.getvalue()
+
+def _read_vlq(data, pos):
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, pos
+
+def read_smf_tracks(data, skip_drums=True):
+    """SMF bytes -> per track, notes (start, duration, pitch, velocity) in quarter notes, sorted by start.
+
+    Channel 10 (General MIDI drums) is skipped unless skip_drums=False.
+    Raises ValueError for data that isn't a (complete) MIDI file.
+    """
+    try:
+        return _read_tracks(bytes(data), skip_drums)
+    except (IndexError, struct.error):
+        raise ValueError("Truncated MIDI file") from None
+
+def _read_tracks(data, skip_drums):
+    if data[:4] != b'MThd':
+        raise ValueError("Not a Standard MIDI File")
+    header_len, _, n_tracks, division = struct.unpack('>IHHH', data[4:14])
+    if division & 0x8000:
+        raise ValueError("SMPTE time division is not supported")
+    tracks = []
+    pos = 8 + header_len
+    for _ in range(n_tracks):
+        if data[pos:pos + 4] != b'MTrk':
+            break
+        end = pos + 8 + struct.unpack('>I', data[pos + 4:pos + 8])[0]
+        pos += 8
+        tick, status, sounding, notes = 0, 0, {}, []
+        while pos < end:
+            delta, pos = _read_vlq(data, pos)
+            tick += delta
+            if data[pos] & 0x80:
+                status = data[pos]
+                pos += 1
+            if status == 0xFF:
+                pos += 1
+                length, pos = _read_vlq(data, pos)
+                pos += length
+                continue
+            if status in (0xF0, 0xF7):
+                length, pos = _read_vlq(data, pos)
+                pos += length
+                continue
+            kind, channel = status & 0xF0, status & 0x0F
+            if kind in (0xC0, 0xD0):
+                pos += 1
+                continue
+            key, velocity = data[pos], data[pos + 1]
+            pos += 2
+            if kind not in (0x80, 0x90) or (skip_drums and channel == 9):
+                continue
+            if kind == 0x90 and velocity:
+                sounding.setdefault((channel, key), []).append((tick, velocity))
+            elif sounding.get((channel, key)):
+                on, vel = sounding[(channel, key)].pop(0)
+                notes.append((on / division, (tick - on) / division, key, vel))
+        pos = end
+        tracks.append(sorted(notes))
+    return tracks
+
+def read_smf(data, skip_drums=True):
+    """SMF bytes -> notes of all tracks (start, duration, pitch, velocity), sorted by start."""
+    return sorted(n for track in read_smf_tracks(data, skip_drums) for n in track)
+
+def write_smf(path, notes, tempo_bpm=120):
+    """Write notes to `path` atomically, so readers never see a half-written file."""
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(smf_bytes(notes, tempo_bpm))
+    os.replace(tmp, path)
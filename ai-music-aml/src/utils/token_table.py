@@ -0,0 +1,159 @@
+"""Per-token musical attributes as columnar arrays, parsed once per vocabulary.
+
+Tokens are `P<pitch>|D<dur>|S<step>`, `CHORD:p1,p2,...|D<dur>|S<step>` or
+specials such as `<SEP>`.  Instead of every consumer re-splitting the token
+string on each use, `TokenTable` parses each vocab entry once and exposes
+arrays indexed by token id:
+
+    kind        int8   SPECIAL / NOTE / CHORD / REST
+    pitches     int16  (V, max_notes) MIDI numbers, padded with -1
+    n_pitches   int8   number of valid entries in `pitches`
+    low, high   int16  lowest / highest MIDI pitch
+    pc_mask     int16  bit p set when pitch class p sounds
+    duration    float32 quarter lengths
+    step        float32 offset from the previous event
+    names       tuple of pitch spellings per token (for music21 objects)
+
+`parse_token` is the one place token strings are split.
+"""
+import re
+
+import numpy as np
+
+SPECIAL, NOTE, CHORD, REST = 0, 1, 2, 3
+
+_STEPS = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+_PITCH = re.compile(r'^([A-Ga-g])([#b-]*)(-?\d+)?$')
+
+def _pitch_parts(name):
+    m = _PITCH.match(name.strip())
+    if not m:
+        raise ValueError(f"Unrecognised pitch name: {name!r}")
+    letter, accidentals, octave = m.groups()
+    shift = accidentals.count('#') - accidentals.count('-') - accidentals.count('b')
+    return _STEPS[letter.upper()] + shift, octave
+
+def pitch_class(name):
+    """'C#', 'B-', 'Eb' -> 0..11."""
+    return _pitch_parts(name)[0] % 12
+
+def pitch_to_midi(name):
+    """music21-style pitch name ('C#4', 'B-3', 'A2') -> MIDI number (C4 = 60)."""
+    semitone, octave = _pitch_parts(name)
+    if octave is None:
+        raise ValueError(f"Pitch name without octave: {name!r}")
+    return 12 * (int(octave) + 1) + semitone
+
+def parse_token(token):
+    """Token string -> (kind, pitch names, duration, step), or None for specials / malformed tokens."""
+    parts = str(token).split('|')
+    head = parts[0]
+    try:
+        duration = float(parts[1].lstrip('D')) if len(parts) > 1 else 0.5
+        step = float(parts[2].lstrip('S')) if len(parts) > 2 else 0.0
+    except ValueError:
+        return None
+    if head.startswith('CHORD:'):
+        names = tuple(n.strip() for n in head[len('CHORD:'):].split(',') if n.strip())
+        return (CHORD, names, duration, step) if names else None
+    if head.startswith('REST') or head == 'R':
+        return REST, (), duration, step
+    if head.startswith('P') and len(parts) > 1:
+        return NOTE, (head[1:],), duration, step
+    return None
+
+class TokenTable:
+    """Columnar token attributes for an id -> token mapping (see module docstring)."""
+    def __init__(self, itos, vocab_size=None):
+        size = vocab_size or (max(itos) + 1 if itos else 0)
+        parsed = {}
+        for idx, token in itos.items():
+            if idx < size:
+                p = parse_token(token)
+                try:
+                    midi = [pitch_to_midi(n) for n in p[1]] if p else []
+                except ValueError:
+                    p = None
+                if p:
+                    parsed[idx] = (p, midi)
+        width = max([len(m) for _, m in parsed.values()] or [1])
+
+        self.vocab_size = size
+        self.tokens = [itos.get(i) for i in range(size)]
+        self.kind = np.full(size, SPECIAL, dtype=np.int8)
+        self.pitches = np.full((size, width), -1, dtype=np.int16)
+        self.n_pitches = np.zeros(size, dtype=np.int8)
+        self.low = np.full(size, 127, dtype=np.int16)
+        self.high = np.zeros(size, dtype=np.int16)
+        self.pc_mask = np.zeros(size, dtype=np.int16)
+        self.duration = np.zeros(size, dtype=np.float32)
+        self.step = np.zeros(size, dtype=np.float32)
+        self.names = [()] * size
+        for idx, ((kind, names, duration, step), midi) in parsed.items():
+            self.kind[idx] = kind
+            self.duration[idx] = duration
+            self.step[idx] = step
+            self.names[idx] = names
+            if midi:
+                self.pitches[idx, :len(midi)] = midi
+                self.n_pitches[idx] = len(midi)
+                self.low[idx], self.high[idx] = min(midi), max(midi)
+                self.pc_mask[idx] = np.bitwise_or.reduce([1 << (m % 12) for m in midi])
+
+    @classmethod
+    def from_stoi(cls, stoi, vocab_size=None):
+        return cls({i: t for t, i in stoi.items()}, vocab_size)
+
+    @property
+    def is_chord(self):
+        return self.kind == CHORD
+
+    @property
+    def is_note(self):
+        return self.kind == NOTE
+
+    @property
+    def is_special(self):
+        return self.kind == SPECIAL
+
+    def events(self, ids):
+        """Event dicts as produced by src.utils.midi.tokens_to_events (specials and rests skipped)."""
+        events = []
+        for idx in np.asarray(ids, dtype=np.int64):
+            kind = self.kind[idx] if 0 <= idx < self.vocab_size else SPECIAL
+            if kind == NOTE:
+                pitch = self.names[idx][0]
+            elif kind == CHORD:
+                pitch = list(self.names[idx])
+            else:
+                continue
+            events.append({'pitch': pitch, 'duration': float(self.duration[idx]), 'step': float(self.step[idx])})
+        return events
+
+    def nearest_ids(self, events):
+        """Ids of the vocabulary tokens closest to event dicts (inverse of `events`).
+
+        An event whose token string is in the vocabulary maps to it exactly.
+        Otherwise the closest note/chord token wins: pitches not shared between
+        the event and the token weigh most, then the log-ratio of durations and
+        the step difference.  Specials and rests are never chosen.
+        """
+        if not hasattr(self, '_index'):
+            self._index = {t: i for i, t in enumerate(self.tokens) if t is not None}
+        playable = (self.kind == NOTE) | (self.kind == CHORD)
+        log_dur = np.log2(np.maximum(self.duration, 1 / 64))
+        ids = []
+        for ev in events:
+            names = ev['pitch'] if isinstance(ev['pitch'], (list, tuple)) else [ev['pitch']]
+            head = 'CHORD:' + ','.join(names) if isinstance(ev['pitch'], (list, tuple)) else 'P' + names[0]
+            exact = self._index.get(f"{head}|D{ev['duration']}|S{ev['step']}")
+            if exact is not None:
+                ids.append(exact)
+                continue
+            midi = np.array([pitch_to_midi(n) for n in names])
+            shared = (self.pitches[:, :, None] == midi[None, None, :]).any(axis=2).sum(axis=1)
+            cost = (2.0 * (self.n_pitches + len(midi) - 2 * shared)
+                    + np.abs(log_dur - np.log2(max(ev['duration'], 1 / 64)))
+                    + np.abs(self.step - ev['step']))
+            ids.append(int(np.argmin(np.where(playable, cost, np.inf))))
+        return ids
@@ -0,0 +1,45 @@
+"""Shared fixtures: tiny randomly initialised models, so the tests need no checkpoints.
+
+Run from ai-music-aml/:  python -m pytest -q tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+VOCAB = 40
+SEQ_LEN = 8
+# One note per id; odd ids advance the clock by a quarter beat, even ones don't
+TOKENS = [f"P{'CDEFGAB'[i % 7]}{3 + i // 7}|D0.5|S{0.25 if i % 2 else 0.0}" for i in range(VOCAB)]
+
+def _spread_embeddings(model, scale=20.0):
+    """Freshly initialised embeddings are tiny, so outputs barely depend on the input; widen them."""
+    from tensorflow.keras import layers
+    emb = next(l for l in model.layers if isinstance(l, layers.Embedding))
+    emb.embeddings.assign(emb.embeddings * scale)
+    return model
+
+@pytest.fixture(scope='session')
+def rnn_model():
+    import tensorflow as tf
+    from src.models.rnn import build_rnn
+    tf.keras.utils.set_random_seed(1)
+    return _spread_embeddings(build_rnn(vocab_size=VOCAB, seq_len=SEQ_LEN, embedding_dim=8, rnn_units=16))
+
+@pytest.fixture(scope='session')
+def transformer_model():
+    import tensorflow as tf
+    from src.models.transformer import build_transformer
+    tf.keras.utils.set_random_seed(2)
+    return _spread_embeddings(build_transformer(vocab_size=VOCAB, seq_len=SEQ_LEN, d_model=16, num_layers=1,
+                                                num_heads=2, dff=16, dropout=0.0))
+
+@pytest.fixture(scope='session')
+def causal_model():
+    import tensorflow as tf
+    from src.models.transformer import build_causal_transformer
+    tf.keras.utils.set_random_seed(3)
+    return _spread_embeddings(build_causal_transformer(vocab_size=VOCAB, seq_len=SEQ_LEN, d_model=16,
+                                                       num_layers=2, num_heads=2, dff=16, dropout=0.0))
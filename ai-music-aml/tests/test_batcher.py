@@ -0,0 +1,102 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from src.inference.batcher import (Batcher, DeadlineExceeded, GenerationRequest, QueueFull,
+                                   RequestCancelled)
+
+def _requests(vocab, n=6):
+    rng = np.random.default_rng(0)
+    # Different prompt lengths (short ones too) and lengths, so rows join and leave mid-batch
+    return [dict(prompt=rng.integers(0, vocab, size=3 + 2 * i), length=10 + 3 * i, temperature=0.8 + 0.1 * i,
+                 top_k=0 if i % 2 else 10, seed=100 + i) for i in range(n)]
+
+def _wait_started(request):
+    while request.started is None:
+        time.sleep(0.001)
+
+def _run(model, specs, max_batch, **kwargs):
+    batcher = Batcher(model, max_batch=max_batch, max_wait_ms=50, **kwargs)
+    try:
+        requests = [batcher.submit(GenerationRequest(**spec)) for spec in specs]
+        return [r.result(timeout=60) for r in requests], batcher.stats()
+    finally:
+        batcher.close()
+
+@pytest.mark.parametrize('model_name', ['rnn_model', 'causal_model', 'transformer_model'])
+def test_batched_matches_solo(request, model_name):
+    model = request.getfixturevalue(model_name)
+    specs = _requests(model.output_shape[-1])
+    batched, stats = _run(model, specs, max_batch=8)
+    assert stats['mean_batch'] > 1
+    solo, _ = _run(model, specs, max_batch=1)
+    assert batched == solo
+    assert [len(ids) for ids in batched] == [spec['length'] for spec in specs]
+
+def test_scoring_matches_solo(rnn_model):
+    specs = [dict(prompt=[1, 2, 3], forced=list(range(4, 4 + n))) for n in (5, 9, 12)]
+    batcher = Batcher(rnn_model, max_batch=8, max_wait_ms=50)
+    try:
+        batched = [batcher.submit(GenerationRequest(**spec)) for spec in specs]
+        for r in batched:
+            r.result(timeout=60)
+        for spec, r in zip(specs, batched):
+            solo = batcher.submit(GenerationRequest(**spec))
+            solo.result(timeout=60)
+            np.testing.assert_allclose(r.logprobs, solo.logprobs, rtol=1e-4, atol=1e-5)
+    finally:
+        batcher.close()
+
+def test_queue_full_and_cancel(rnn_model):
+    batcher = Batcher(rnn_model, max_batch=1, max_wait_ms=0, max_queue=1)
+    try:
+        gate = threading.Event()
+        # The first request blocks the worker in its on_token callback, so the next ones stay queued
+        first = batcher.submit(GenerationRequest([1, 2], 5, on_token=lambda r, i: gate.wait(10)))
+        _wait_started(first)
+        queued = batcher.submit(GenerationRequest([1, 2], 5))
+        with pytest.raises(QueueFull):
+            batcher.submit(GenerationRequest([1, 2], 5))
+        batcher.submit(GenerationRequest([1, 2], 5, priority='batch'))   # each priority has its own queue
+        queued.cancel()
+        gate.set()
+        assert len(first.result(timeout=30)) == 5
+        with pytest.raises(RequestCancelled):
+            queued.result(timeout=30)
+        stats = batcher.stats()
+        assert stats['rejected'] == 1 and stats['cancelled'] == 1
+    finally:
+        batcher.close()
+
+def test_deadline_keeps_generated_ids(rnn_model):
+    batcher = Batcher(rnn_model, max_batch=4, max_wait_ms=0)
+    try:
+        slow = lambda r, i: time.sleep(0.01) if len(r.ids) >= 5 else None
+        request = batcher.submit(GenerationRequest([1, 2], 1000, deadline_s=0.2, on_token=slow))
+        with pytest.raises(DeadlineExceeded):
+            request.result(timeout=30)
+        assert 5 <= len(request.ids) < 1000
+        assert batcher.stats()['expired'] == 1
+    finally:
+        batcher.close()
+
+@pytest.mark.parametrize('model_name', ['rnn_model', 'causal_model'])
+def test_preempted_batch_rows_resume_exactly(request, model_name):
+    model = request.getfixturevalue(model_name)
+    vocab = model.output_shape[-1]
+    background = [dict(prompt=[1, 2, 3 + i], length=150, seed=i, priority='batch') for i in range(2)]
+    solo, _ = _run(model, [{k: v for k, v in spec.items() if k != 'priority'} for spec in background], 1)
+    batcher = Batcher(model, max_batch=2, max_wait_ms=20, batch_share=0.5)
+    try:
+        running = [batcher.submit(GenerationRequest(**spec)) for spec in background]
+        for r in running:
+            _wait_started(r)
+        interactive = [batcher.submit(GenerationRequest(**spec)) for spec in _requests(vocab, 3)]
+        for r in interactive:
+            r.result(timeout=60)
+        assert [r.result(timeout=60) for r in running] == solo
+        assert batcher.stats()['preempted'] >= 1
+    finally:
+        batcher.close()
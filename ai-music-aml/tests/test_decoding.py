@@ -0,0 +1,72 @@
+import gc
+import weakref
+
+import numpy as np
+import pytest
+
+from src.inference.beam import beam_search
+from src.inference.engine import generate_ids
+from src.inference.graph_loop import generate_graph
+from src.inference.kv_cache import KVCacheDecoder
+from src.inference.speculative import speculative_generate
+from src.models.rnn import build_rnn
+from src.models.transformer import build_causal_transformer
+
+@pytest.mark.parametrize('model_name', ['rnn_model', 'transformer_model'])
+@pytest.mark.parametrize('prompt_len', [3, 8, 12])
+def test_graph_window_decoding_matches_eager(request, model_name, prompt_len):
+    model = request.getfixturevalue(model_name)
+    prompt = list(range(1, prompt_len + 1))
+    eager = generate_ids(model, prompt, 12, stateful=False, temperature=0)
+    graph = generate_graph(model, [prompt], 12, temperatures=0, stateful=False)[0]
+    assert graph == list(eager)
+
+def test_graph_window_decoding_rejects_short_prompts_it_cannot_grow(rnn_model, causal_model):
+    with pytest.raises(ValueError):
+        generate_graph(causal_model, [[1, 2, 3]], 4, stateful=False)
+    with pytest.raises(ValueError):
+        generate_graph(rnn_model, [[1, 2, 3]], 4, stateful=False, jit_compile=True)
+
+def test_kv_cache_matches_full_window(causal_model):
+    decoder = KVCacheDecoder(causal_model)
+    window = np.random.default_rng(0).integers(0, causal_model.output_shape[-1], size=(2, decoder.seq_len))
+    full = causal_model(window.astype(np.int32), training=False).numpy()
+    probs, _ = decoder.prefill(window)
+    np.testing.assert_allclose(probs, full, rtol=1e-4, atol=1e-6)
+    # Prefill a short prompt and feed the rest one token at a time
+    probs, state = decoder.prefill(window[:, :3])
+    for t in range(3, decoder.seq_len):
+        probs, state = decoder.step(window[:, t], state)
+    np.testing.assert_allclose(probs, full, rtol=1e-4, atol=1e-6)
+
+@pytest.mark.parametrize('model_name', ['rnn_model', 'causal_model'])
+def test_beam_width_one_is_greedy(request, model_name):
+    model = request.getfixturevalue(model_name)
+    prompts = np.random.default_rng(1).integers(0, model.output_shape[-1], size=(3, 8))
+    results = beam_search(model, prompts, 10, beam_width=1)
+    for prompt, result in zip(prompts, results):
+        assert result[0][0] == list(generate_ids(model, prompt, 10, temperature=0))
+
+@pytest.mark.parametrize('build', [lambda: build_rnn(40, 8, 8, 16),
+                                   lambda: build_causal_transformer(40, 8, 16, 1, 2, 16, 0.0)])
+@pytest.mark.parametrize('stateful', [True, False])
+def test_engine_caches_free_the_model(build, stateful):
+    model = build()
+    generate_ids(model, list(range(1, 9)), 5, stateful=stateful)
+    generate_graph(model, [list(range(1, 9))], 5, stateful=stateful)
+    beam_search(model, [list(range(1, 9))], 3, beam_width=2, stateful=stateful)
+    ref = weakref.ref(model)
+    del model
+    gc.collect()
+    assert ref() is None
+
+def test_speculative_rounds_free_the_draft(causal_model):
+    prompt = list(range(1, 10))
+    greedy = generate_ids(causal_model, prompt, 10, stateful=False, temperature=0)
+    draft = build_rnn(40, 8, 8, 16)
+    assert speculative_generate(causal_model, draft, prompt, 10, k=3, temperature=0)[0] == greedy
+    ref = weakref.ref(draft)
+    del draft
+    gc.collect()
+    assert ref() is None
+    assert speculative_generate(causal_model, build_rnn(40, 8, 8, 16), prompt, 10, k=3, temperature=0)[0] == greedy
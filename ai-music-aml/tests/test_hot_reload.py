@@ -0,0 +1,100 @@
+import gc
+import os
+import threading
+import time
+import weakref
+
+import pytest
+import tensorflow as tf
+
+from src.inference.batcher import Batcher, GenerationRequest
+from src.inference.hot_reload import CheckpointWatcher
+from src.inference.registry import ModelRegistry
+from src.models.rnn import build_rnn
+
+from conftest import SEQ_LEN, VOCAB, _spread_embeddings
+
+def _model(seed):
+    tf.keras.utils.set_random_seed(seed)
+    return _spread_embeddings(build_rnn(vocab_size=VOCAB, seq_len=SEQ_LEN, embedding_dim=8, rnn_units=16))
+
+def _save(model, path):
+    model.save(str(path))
+    # A distinct mtime even on filesystems with coarse timestamps
+    stamp = time.time_ns() + 10 ** 9
+    os.utime(path, ns=(stamp, stamp))
+
+def _ids(batcher, seed, length=30):
+    return batcher.submit(GenerationRequest([1, 2, 3], length, seed=seed)).result(timeout=60)
+
+@pytest.fixture
+def watched(tmp_path):
+    path = tmp_path / 'best.keras'
+    _save(_model(1), path)
+    reloads = []
+    watcher = CheckpointWatcher(interval=0, settle=0.3, registry=ModelRegistry())
+    watcher.watch(str(path), on_reload=lambda p, model: reloads.append(model))
+    return watcher, path, reloads
+
+def test_reload_waits_for_the_file_to_settle(watched):
+    watcher, path, reloads = watched
+    assert watcher.check() == []                  # unchanged since watch()
+    _save(_model(2), path)
+    assert watcher.check() == []                  # change first seen
+    assert watcher.check() == []                  # settle period not over yet
+    time.sleep(0.35)
+    assert watcher.check() == [str(path)]
+    assert len(reloads) == 1 and watcher.stats()[str(path)] == {'reloads': 1, 'error': None}
+    assert watcher.check() == []                  # the new version is now the loaded one
+
+def test_failed_load_keeps_the_old_model(watched):
+    watcher, path, reloads = watched
+    path.write_bytes(b'not a checkpoint')
+    watcher.check()
+    time.sleep(0.35)
+    assert watcher.check() == []
+    assert reloads == [] and watcher.stats()[str(path)]['error']
+    time.sleep(0.35)
+    assert watcher.check() == []                  # the broken version isn't retried until it changes
+    _save(_model(2), path)
+    watcher.check()
+    time.sleep(0.35)
+    assert watcher.check() == [str(path)]
+    assert len(reloads) == 1 and watcher.stats()[str(path)]['error'] is None
+
+def test_swap_model_finishes_in_flight_requests_on_the_old_model():
+    old, new = _model(1), _model(2)
+    expected_old, expected_new = [], []
+    for model, out in ((old, expected_old), (new, expected_new)):
+        batcher = Batcher(model, max_wait_ms=0)
+        out.extend(_ids(batcher, seed=7))
+        batcher.close()
+    assert expected_old != expected_new
+
+    batcher = Batcher(old, max_wait_ms=0)
+    try:
+        gate = threading.Event()
+        running = batcher.submit(GenerationRequest([1, 2, 3], 30, seed=7,
+                                                   on_token=lambda r, i: len(r.ids) == 5 and gate.wait(30)))
+        while len(running.ids) < 5:
+            time.sleep(0.001)
+        batcher.swap_model(new)
+        later = batcher.submit(GenerationRequest([1, 2, 3], 30, seed=7))
+        gate.set()
+        assert running.result(timeout=60) == expected_old
+        assert later.result(timeout=60) == expected_new
+        assert batcher.stats()['swaps'] == 1
+    finally:
+        batcher.close()
+
+def test_swap_model_releases_the_old_model():
+    batcher = Batcher(_model(1), max_wait_ms=0)
+    try:
+        _ids(batcher, seed=1)
+        ref = weakref.ref(batcher.model)
+        batcher.swap_model(_model(2))
+        _ids(batcher, seed=1)
+        gc.collect()
+        assert ref() is None
+    finally:
+        batcher.close()
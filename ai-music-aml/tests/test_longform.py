@@ -0,0 +1,25 @@
+import numpy as np
+
+from src.inference.longform import generate_long
+from src.inference.sampling import NEG_INF
+from src.utils.token_table import TokenTable
+
+from conftest import TOKENS, VOCAB
+
+def _table():
+    return TokenTable(dict(enumerate(TOKENS)))
+
+def test_generate_long_reaches_target(rnn_model, tmp_path):
+    info = generate_long(rnn_model, _table(), str(tmp_path / 'long.mid'), minutes=0.1, seed_ids=[1, 2, 3],
+                         rng=np.random.default_rng(0))
+    assert info['stopped'] == 'minutes'
+    assert (tmp_path / 'long.mid').stat().st_size > 0
+
+def test_generate_long_stops_on_zero_step_tokens(rnn_model, tmp_path):
+    mask = np.where(np.arange(VOCAB) % 2, NEG_INF, 0.0).astype(np.float32)   # only S0.0 tokens
+    info = generate_long(rnn_model, _table(), str(tmp_path / 'stuck.mid'), minutes=1.0, seed_ids=[1, 2, 3],
+                         logit_mask=mask, max_stalled=50, rng=np.random.default_rng(0))
+    assert info['stopped'] == 'stalled' and info['tokens'] == 50
+    info = generate_long(rnn_model, _table(), str(tmp_path / 'stuck.mid'), minutes=0.01, seed_ids=[1, 2, 3],
+                         logit_mask=mask, max_stalled=0, rng=np.random.default_rng(0))
+    assert info['stopped'] == 'max_tokens' and info['tokens'] == 20   # 1.2 beats * 16
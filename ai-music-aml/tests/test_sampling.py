@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+import tensorflow as tf
+
+from src.inference.graph_loop import generate_graph
+from src.inference.sampling import (NEG_INF, Sampler, apply_repetition_penalty, apply_temperature,
+                                    apply_top_k, apply_top_p, tf_apply_repetition_penalty,
+                                    tf_apply_temperature, tf_apply_top_k, tf_apply_top_p,
+                                    tf_no_repeat_ngram_mask)
+
+V = 12
+
+def _banned(logits):
+    return np.asarray(logits) <= NEG_INF / 2
+
+def test_filters_match_numpy():
+    rng = np.random.default_rng(0)
+    logits = rng.normal(size=(4, V)).astype(np.float32) * 3
+    t = np.array([0.5, 1.0, 1.7, 0.0], dtype=np.float32)
+    np.testing.assert_allclose(tf_apply_temperature(logits, t).numpy(), apply_temperature(logits, t), rtol=1e-6)
+    for k in (1, 3, V - 1, V, V + 5):
+        np.testing.assert_array_equal(_banned(tf_apply_top_k(logits, k)), _banned(apply_top_k(logits, k)))
+    for p in (0.1, 0.5, 0.9):
+        np.testing.assert_array_equal(_banned(tf_apply_top_p(logits, p)), _banned(apply_top_p(logits, p)))
+    counts = rng.integers(0, 2, size=(4, V)).astype(np.int32)
+    np.testing.assert_allclose(tf_apply_repetition_penalty(logits, counts, 1.3).numpy(),
+                               apply_repetition_penalty(logits, counts, 1.3), rtol=1e-6)
+
+@pytest.mark.parametrize('n', [2, 3, 4])
+def test_no_repeat_ngram_mask_matches_sampler(n):
+    rng = np.random.default_rng(n)
+    history = rng.integers(0, 3, size=(3, 14)).astype(np.int32)   # small alphabet: plenty of repeats
+    for length in range(history.shape[1] + 1):                     # includes histories shorter than n-1
+        sampler = Sampler(3, V, no_repeat_ngram_size=n)
+        sampler.observe_prompt(history[:, :length])
+        expected = _banned(sampler.process(np.zeros((3, V), dtype=np.float32)))
+        mask = tf_no_repeat_ngram_mask(tf.constant(history), tf.constant(length), n, V)
+        np.testing.assert_array_equal(_banned(mask), expected, err_msg=f"length={length}")
+
+def test_generate_graph_short_prompt_with_ngram_ban(rnn_model):
+    out = generate_graph(rnn_model, [[5, 6]], 10, seed=1, no_repeat_ngram_size=4)
+    assert len(out[0]) == 10
@@ -0,0 +1,118 @@
+import json
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from src.inference.batcher import GenerationRequest
+from src.inference.client import ServerClient, ServerError
+from src.inference.server import InferenceServer
+from src.utils.smf import read_smf
+
+from conftest import TOKENS, VOCAB
+
+def _serve(tmp_path_factory, model, **options):
+    root = tmp_path_factory.mktemp('serve')
+    model.save(str(root / 'model.keras'))
+    with open(root / 'vocab.json', 'w', encoding='utf-8') as f:
+        json.dump({token: i for i, token in enumerate(TOKENS)}, f)
+    server = InferenceServer({'rnn': str(root / 'model.keras')}, str(root / 'vocab.json'), port=0,
+                             reload_interval_s=0, **options)
+    return server.start_in_thread()
+
+@pytest.fixture(scope='module')
+def client(rnn_model, tmp_path_factory):
+    server = _serve(tmp_path_factory, rnn_model, max_batch=8, max_wait_ms=2, max_length=100)
+    yield ServerClient(f'http://127.0.0.1:{server.port}', timeout=60)
+    server.close()
+
+def test_health(client):
+    health = client.health()
+    assert health['status'] == 'ok' and health['models']['rnn']['seq_len'] == 8
+
+def test_generate(client):
+    piece = client.generate(length=20, temperature=0.9, seed=3, as_midi=True)
+    assert len(piece['ids']) == len(piece['tokens']) == 20
+    assert client.generate(length=20, temperature=0.9, seed=3)['ids'] == piece['ids']
+    assert len(read_smf(piece['midi'])) > 0
+    prompted = client.generate(length=5, prompt=[1, 2, 3], temperature=0)
+    assert client.generate(length=5, prompt_tokens=TOKENS[1:4], temperature=0)['ids'] == prompted['ids']
+
+def test_stream_matches_generate(client):
+    events = list(client.stream(length=12, temperature=0.9, seed=4))
+    assert [e for e, _ in events] == ['token'] * 12 + ['done']
+    assert [d['id'] for _, d in events[:-1]] == events[-1][1]['ids']
+    assert events[-1][1]['ids'] == client.generate(length=12, temperature=0.9, seed=4)['ids']
+
+def test_score(client):
+    piece = client.generate(length=15, temperature=1.0, seed=5)
+    scored = client.score(ids=piece['ids'])
+    assert scored['scored'] == 14 and len(scored['logprobs']) == 14
+    assert np.all(np.array(scored['logprobs']) <= 0)
+    assert scored['perplexity'] == pytest.approx(np.exp(-scored['mean_logprob']))
+    assert client.score(tokens=piece['tokens'])['logprob'] == pytest.approx(scored['logprob'])
+
+@pytest.mark.parametrize('path, body, status', [
+    ('/generate', {'length': 101}, 400),
+    ('/generate', {'model': 'missing'}, 404),
+    ('/generate', {'prompt': [VOCAB]}, 400),
+    ('/score', {'ids': [1]}, 400),
+])
+def test_bad_requests(client, path, body, status):
+    with pytest.raises(ServerError) as e:
+        client._request(path, body)
+    assert e.value.status == status
+
+@pytest.fixture
+def blocked(rnn_model, tmp_path_factory):
+    """A server with one batch row and room for one queued request per priority, its worker held by a gate."""
+    server = _serve(tmp_path_factory, rnn_model, max_batch=1, max_wait_ms=0, max_queue=1)
+    gate = threading.Event()
+    blocker = server.slots['rnn'].batcher.submit(GenerationRequest([1, 2], 2, on_token=lambda r, i: gate.wait(30)))
+    while blocker.started is None:
+        time.sleep(0.001)
+    yield ServerClient(f'http://127.0.0.1:{server.port}', timeout=60), gate
+    gate.set()
+    server.close()
+
+def test_queue_full_and_deadline(blocked):
+    client, gate = blocked
+    errors = []
+
+    def queued():
+        try:
+            client.generate(length=5, deadline_s=0.1)
+        except ServerError as e:
+            errors.append(e.status)
+    thread = threading.Thread(target=queued)
+    thread.start()
+    while client.health()['models']['rnn']['queued'] < 1:
+        time.sleep(0.005)
+    with pytest.raises(ServerError) as e:
+        client.generate(length=5)
+    assert e.value.status == 503
+    time.sleep(0.2)
+    gate.set()
+    thread.join(30)
+    assert errors == [504]
+    assert len(client.generate(length=5)['ids']) == 5
+    stats = client.health()['models']['rnn']
+    assert stats['rejected'] == 1 and stats['expired'] == 1
+
+def test_closed_stream_cancels_its_request(rnn_model, tmp_path_factory):
+    server = _serve(tmp_path_factory, rnn_model, max_batch=4, max_wait_ms=0, max_length=100000)
+    try:
+        client = ServerClient(f'http://127.0.0.1:{server.port}', timeout=60)
+        events = client.stream(length=100000, seed=6)
+        for _ in range(3):
+            assert next(events)[0] == 'token'
+        assert client.health()['models']['rnn']['active'] == 1
+        events.close()
+        deadline = time.monotonic() + 30
+        while client.health()['models']['rnn']['active'] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        stats = client.health()['models']['rnn']
+        assert stats['active'] == 0 and stats['cancelled'] == 1 and stats['completed'] == 0
+    finally:
+        server.close()
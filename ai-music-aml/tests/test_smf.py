@@ -0,0 +1,56 @@
+import io
+
+import numpy as np
+import pytest
+
+from src.utils.smf import SMFWriter, read_smf, read_smf_tracks, smf_bytes, write_smf
+
+def _notes(n=200, seed=0):
+    rng = np.random.default_rng(seed)
+    starts = np.cumsum(rng.choice([0.0, 0.25, 0.5, 1 / 3], size=n))
+    durations = rng.choice([0.25, 0.5, 1.0, 2.0, 2 / 3], size=n)
+    pitches = rng.integers(36, 96, size=n)
+    velocities = rng.integers(1, 128, size=n)
+    return [(float(s), float(d), int(p), int(v)) for s, d, p, v in zip(starts, durations, pitches, velocities)]
+
+def _assert_same(got, expected):
+    assert len(got) == len(expected)
+    key = lambda n: (round(n[0], 3), n[2], round(n[1], 3))
+    for g, e in zip(sorted(got, key=key), sorted(expected, key=key)):
+        assert g[2:] == e[2:]
+        assert g[0] == pytest.approx(e[0], abs=1e-3) and g[1] == pytest.approx(e[1], abs=1e-3)
+
+def test_round_trip():
+    notes = _notes()
+    _assert_same(read_smf(smf_bytes(notes, tempo_bpm=100)), notes)
+
+def test_repeated_pitch_back_to_back():
+    notes = [(0.0, 1.0, 60, 80), (1.0, 1.0, 60, 90), (2.0, 0.5, 60, 70)]
+    assert read_smf(smf_bytes(notes)) == notes
+
+def test_writer_is_playable_after_every_flush():
+    notes = _notes(120, seed=1)
+    buf = io.BytesIO()
+    writer = SMFWriter(buf)
+    for i, note in enumerate(notes, 1):
+        writer.add(*note)
+        if i % 40 == 0:
+            writer.flush()
+            # A valid file holding (at least) every note that has ended; sounding ones follow later
+            finished = sum(s + d < note[0] - 1e-3 for s, d, _, _ in notes[:i])
+            assert finished <= len(read_smf(buf.getvalue())) <= i
+    writer.close()
+    _assert_same(read_smf(buf.getvalue()), notes)
+
+def test_write_smf_file(tmp_path):
+    notes = _notes(50, seed=2)
+    path = tmp_path / 'piece.mid'
+    write_smf(str(path), notes)
+    assert len(read_smf_tracks(path.read_bytes())) == 1
+    _assert_same(read_smf(path.read_bytes()), notes)
+
+def test_rejects_non_midi():
+    with pytest.raises(ValueError):
+        read_smf(b'not a midi file')
+    with pytest.raises(ValueError):
+        read_smf(smf_bytes(_notes(10))[:-10])
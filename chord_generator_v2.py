@@ -100,25 +100,21 @@ def generate_chord_progression_song(progression_input, length=250, creativity=1.
         # Import TensorFlow dynamically to avoid version issues
         import tensorflow as tf
         
-        # Try different ways to load the model
-        model = None
-        try:
-            model = tf.keras.models.load_model('ai-music-aml/outputs/rnn/best.keras')
-        except:
-            try:
-                from tensorflow.keras import models
-                model = models.load_model('ai-music-aml/outputs/rnn/best.keras')
-            except:
-                print("❌ Could not load TensorFlow model")
-                return False
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ai-music-aml'))
+        from src.inference.registry import get_model, get_vocab, get_token_table
         
-        with open('ai-music-aml/outputs/processed/vocab.json', 'r') as f:
-            vocab = json.load(f)
+        # Model and vocabulary are cached for the lifetime of the process
+        try:
+            model = get_model('ai-music-aml/outputs/rnn/best.keras')
+        except Exception:
+            print("❌ Could not load TensorFlow model")
+            return False
         
-        with open('ai-music-aml/outputs/processed/itos.pkl', 'rb') as f:
-            itos = pickle.load(f)
+        vocab = get_vocab('ai-music-aml/outputs/processed/vocab.json')
+        itos = get_vocab('ai-music-aml/outputs/processed/itos.pkl')
         
         stoi = {v: k for k, v in itos.items()}
+        table = get_token_table('ai-music-aml/outputs/processed/itos.pkl', model.output_shape[-1])
         print(f"✅ Model loaded. Vocabulary size: {len(vocab)}")
         
     except Exception as e:
@@ -135,11 +131,11 @@ def generate_chord_progression_song(progression_input, length=250, creativity=1.
     
     # Generate extended sequence
     print(f"🎼 Generating music based on chord progression...")
-    generated = generate_chord_based_sequence(model, seed_tokens, length, creativity, itos)
+    generated = generate_chord_based_sequence(model, seed_tokens, length, creativity, table)
     
     # Create advanced MIDI with chord progression
     print(f"🎵 Creating advanced MIDI file...")
-    success = create_chord_progression_midi(generated, itos, chord_progression, tempo_bpm, output_file)
+    success = create_chord_progression_midi(generated, table, chord_progression, tempo_bpm, output_file)
     
     if success:
         file_size = os.path.getsize(f'outputs/{output_file}')
@@ -250,46 +246,31 @@ def convert_chord_notes_to_tokens(note_sequences, stoi):
     print(f"✅ Converted {len(tokens)} chord notes to tokens")
     return tokens
 
-def generate_chord_based_sequence(model, seed_tokens, length, temperature, itos):
+def generate_chord_based_sequence(model, seed_tokens, length, temperature, table):
     """Generate music sequence emphasizing chord progressions"""
-    sequence = seed_tokens.copy()
-    vocab_size = len(itos)
-    
-    for i in range(length - len(seed_tokens)):
-        # Prepare input
-        input_seq = sequence[-64:] if len(sequence) >= 64 else sequence
-        if len(input_seq) < 64:
-            input_seq = input_seq + [0] * (64 - len(input_seq))
-        
-        # Predict next token
-        prediction = model.predict(np.array([input_seq]), verbose=0)[0]
-        
-        # Apply temperature
-        if temperature != 1.0:
-            prediction = np.log(prediction + 1e-8) / temperature
-            prediction = np.exp(prediction)
-        
-        # Slightly bias towards chord tokens
-        for token_idx, token in enumerate(itos.values()):
-            if 'CHORD:' in str(token):
-                prediction[token_idx] *= 1.1  # Small boost to chord probability
-        
-        # Normalize and sample
-        prediction = prediction / np.sum(prediction)
-        next_token = np.random.choice(vocab_size, p=prediction)
-        sequence.append(next_token)
-        
-        # Progress indicator
+    from src.inference.engine import generate_ids
+    from src.inference.constraints import VocabConstraints
+    
+    total = length - len(seed_tokens)
+    
+    # Slight bias towards chord tokens, compiled once into an additive logit mask
+    vocab_size = model.output_shape[-1]
+    chord_bias = VocabConstraints(table, vocab_size).logit_mask(bias={'chords': np.log(1.1)})
+    
+    def progress(i, token):
         if (i + 1) % 30 == 0:
-            progress = (i + 1) / (length - len(seed_tokens)) * 100
-            print(f"  Progress: {progress:.0f}% ({i + 1}/{length - len(seed_tokens)} tokens)")
+            print(f"  Progress: {(i + 1) / total * 100:.0f}% ({i + 1}/{total} tokens)")
     
-    return sequence
+    # The chord seed is prefilled in one pass (however short), then decoding carries the state
+    generated = generate_ids(model, seed_tokens, total, on_token=progress, temperature=temperature,
+                             logit_mask=chord_bias)
+    return list(seed_tokens) + generated
 
-def create_chord_progression_midi(tokens, itos, chord_progression, tempo_bpm, output_file):
-    """Create MIDI with enhanced chord progression structure"""
+def create_chord_progression_midi(tokens, table, chord_progression, tempo_bpm, output_file):
+    """Create MIDI with enhanced chord progression structure (token attributes from the TokenTable)"""
     try:
         from music21 import stream, note, chord, tempo
+        from src.utils.token_table import NOTE
         
         score = stream.Stream()
         score.append(tempo.MetronomeMark(number=tempo_bpm))
@@ -319,16 +300,12 @@ def create_chord_progression_midi(tokens, itos, chord_progression, tempo_bpm, ou
         # Add generated melody from tokens
         melody_time = 0
         for token_idx in tokens:
-            token = itos.get(token_idx, "")
-            
-            # Parse single notes for melody
-            if token.startswith("P") and "|D" in token:
+            # Single notes for melody
+            if 0 <= token_idx < table.vocab_size and table.kind[token_idx] == NOTE:
                 try:
-                    parts = token.split("|")
-                    note_part = parts[0][1:]  # Remove 'P'
-                    duration_val = float(parts[1][1:]) if len(parts) > 1 else 0.5
+                    duration_val = float(table.duration[token_idx])
                     
-                    n = note.Note(note_part)
+                    n = note.Note(table.names[token_idx][0])
                     n.duration.quarterLength = max(0.125, min(2.0, duration_val))
                     n.offset = melody_time
                     melody_part.append(n)
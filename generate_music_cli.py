@@ -13,16 +13,18 @@ def generate_music_cli(length=200, temperature=1.0, output_name="generated_test.
     try:
         # Change to ai-music-aml directory
         ai_music_dir = Path("ai-music-aml")
-        os.chdir(ai_music_dir)
+        if ai_music_dir.is_dir():  # already inside it on repeat calls
+            os.chdir(ai_music_dir)
         
         # Add to Python path
-        sys.path.insert(0, ".")
+        if os.path.abspath(".") not in sys.path:
+            sys.path.insert(0, os.path.abspath("."))
         
         print("🎵 Loading trained RNN model...")
         
         # Import required modules
-        from tensorflow.keras.models import load_model
-        from src.utils.dataio import load_vocab
+        from src.inference.registry import get_model, get_vocab, get_itos
+        from src.inference.engine import generate_ids
         from src.utils.midi import save_midi_from_tokens
         
         # Load model and vocabulary
@@ -38,63 +40,30 @@ def generate_music_cli(length=200, temperature=1.0, output_name="generated_test.
             return False
         
         print("📚 Loading vocabulary...")
-        with open(vocab_path, 'r') as f:
-            stoi = json.load(f)
-        itos = {i: t for t, i in stoi.items()}
+        stoi = get_vocab(vocab_path)
+        itos = get_itos(vocab_path)
         
         print(f"📊 Vocabulary size: {len(stoi)}")
         
         print("🧠 Loading model...")
-        model = load_model(model_path, compile=False)
+        model = get_model(model_path)
         
         print(f"🎼 Generating music: {length} tokens, temperature: {temperature}")
         
         # Generate sequence
-        seq_len = 64  # Default sequence length
-        seq = np.random.randint(0, len(stoi), size=(1, seq_len))
-        tokens = []
+        seq_len = model.input_shape[1]  # window length the model was trained with
+        seq = np.random.randint(0, len(stoi), size=seq_len)
         
-        for i in range(length):
+        def progress(i, token):
             if i % 10 == 0:
                 print(f"Progress: {i}/{length} tokens...")
-            
-            # Predict next token
-            probs = model.predict(seq, verbose=0)[0, -1]
-            
-            # Ensure probs is float32 and has proper shape
-            probs = np.array(probs, dtype=np.float32)
-            
-            # Debug: print probability shape and sample
-            if i == 0:
-                print(f"🔍 Debug: Probability shape: {probs.shape}")
-                print(f"🔍 Debug: Sample probs: {probs[:5]}")
-            
-            if len(probs.shape) == 0 or len(probs) == 0:  # If scalar or empty, skip
-                print(f"⚠️ Warning: Empty probabilities at step {i}")
-                next_token = np.random.randint(0, len(stoi))
-            else:
-                # Apply temperature
-                if temperature > 0:
-                    probs = np.log(probs + 1e-8) / temperature
-                    probs = np.exp(probs)
-                    probs = probs / np.sum(probs)
-                    
-                    # Ensure probabilities are valid
-                    if np.any(np.isnan(probs)) or np.sum(probs) == 0:
-                        next_token = np.random.randint(0, len(stoi))
-                    else:
-                        next_token = np.random.choice(len(probs), p=probs)
-                else:
-                    next_token = np.argmax(probs)
-            
-            # Ensure next_token is valid
-            if next_token >= len(itos):
-                next_token = next_token % len(itos)
-                
-            # Convert to int if needed
-            next_token = int(next_token)
-            
-            # Add token to list
+        
+        # The seed is encoded once, then each token costs a single decoder step
+        # (argmax when temperature <= 0)
+        ids = generate_ids(model, seq, length, on_token=progress, temperature=temperature)
+        
+        tokens = []
+        for i, next_token in enumerate(ids):
             if next_token in itos:
                 token_str = itos[next_token]
                 tokens.append(token_str)
@@ -105,10 +74,6 @@ def generate_music_cli(length=200, temperature=1.0, output_name="generated_test.
             else:
                 print(f"⚠️ Warning: Invalid token index {next_token}")
                 tokens.append(f"UNK_{next_token}")
-            
-            # Update sequence
-            seq = np.roll(seq, -1, axis=1)
-            seq[0, -1] = next_token
         
         print("🎵 Converting to MIDI...")
         
@@ -12,59 +12,23 @@ from music21 import stream, note, chord, tempo, meter
 
 # Add the ai-music-aml src to path
 sys.path.append(os.path.join(os.path.dirname(__file__), 'ai-music-aml', 'src'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ai-music-aml'))
 
 try:
     import tensorflow as tf
     from tensorflow.keras import models
+    from src.inference.registry import get_model, get_vocab, get_token_table
+    from src.utils.token_table import NOTE, CHORD, REST
+    from src.inference.engine import generate_ids
+    from src.inference.beam import beam_search
+    from src.inference.streaming import stream_music, iter_events, VELOCITY
+    from src.inference.continuation import continue_midi
+    from src.utils.smf import write_smf
 except ImportError as e:
     print(f"❌ Error importing TensorFlow: {e}")
 
-def parse_token(token_str):
-    """Parse a token string into musical elements"""
-    try:
-        if token_str.startswith('P'):  # Single note
-            # Format: PD4|D0.25|S0.75
-            parts = token_str.split('|')
-            note_part = parts[0][1:]  # Remove 'P'
-            duration_part = float(parts[1][1:]) if len(parts) > 1 else 0.5  # Remove 'D'
-            
-            return {
-                'type': 'note',
-                'pitch': note_part,
-                'duration': duration_part
-            }
-            
-        elif token_str.startswith('CHORD:'):
-            # Format: CHORD:G#5,D6,E6|D0.5|S0.25
-            parts = token_str.split('|')
-            chord_part = parts[0][6:]  # Remove 'CHORD:'
-            duration_part = float(parts[1][1:]) if len(parts) > 1 else 0.5  # Remove 'D'
-            
-            notes = chord_part.split(',')
-            return {
-                'type': 'chord',
-                'notes': notes,
-                'duration': duration_part
-            }
-            
-        elif 'REST' in token_str or 'R' == token_str[0]:
-            # Rest token
-            duration_part = 0.5
-            if '|D' in token_str:
-                duration_part = float(token_str.split('|D')[1].split('|')[0])
-            
-            return {
-                'type': 'rest',
-                'duration': duration_part
-            }
-            
-    except Exception as e:
-        pass
-        
-    return None
-
-def tokens_to_midi_ui(tokens, output_path):
-    """Convert tokens to MIDI for UI use"""
+def tokens_to_midi_ui(token_ids, output_path, table):
+    """Convert token ids to MIDI for UI use (attributes come from the TokenTable)"""
     try:
         # Create a music21 stream
         s = stream.Stream()
@@ -75,36 +39,27 @@ def tokens_to_midi_ui(tokens, output_path):
         chord_count = 0
         rest_count = 0
         
-        for token in tokens:
-            parsed = parse_token(str(token))
-            
-            if parsed is None:
+        for idx in token_ids:
+            if not 0 <= idx < table.vocab_size:
                 continue
+            kind, duration = table.kind[idx], float(table.duration[idx])
                 
             try:
-                if parsed['type'] == 'note':
+                if kind == NOTE:
                     # Create a single note
-                    n = note.Note(parsed['pitch'], quarterLength=parsed['duration'])
+                    n = note.Note(table.names[idx][0], quarterLength=duration)
                     s.append(n)
                     note_count += 1
                     
-                elif parsed['type'] == 'chord':
+                elif kind == CHORD:
                     # Create a chord
-                    chord_notes = []
-                    for note_name in parsed['notes']:
-                        try:
-                            chord_notes.append(note_name.strip())
-                        except:
-                            continue
-                            
-                    if chord_notes:
-                        c = chord.Chord(chord_notes, quarterLength=parsed['duration'])
-                        s.append(c)
-                        chord_count += 1
+                    c = chord.Chord(list(table.names[idx]), quarterLength=duration)
+                    s.append(c)
+                    chord_count += 1
                         
-                elif parsed['type'] == 'rest':
+                elif kind == REST:
                     # Create a rest
-                    r = note.Rest(quarterLength=parsed['duration'])
+                    r = note.Rest(quarterLength=duration)
                     s.append(r)
                     rest_count += 1
                     
@@ -143,8 +98,15 @@ def tokens_to_midi_ui(tokens, output_path):
             'message': f"Error creating MIDI: {e}"
         }
 
-def generate_music_ui(length=50, temperature=0.8, output_file="ui_generated.mid"):
-    """Generate music for UI integration"""
+def generate_music_ui(length=50, temperature=0.8, output_file="ui_generated.mid",
+                      top_k=0, top_p=1.0, repetition_penalty=1.0, beam_width=0, num_groups=1,
+                      no_repeat_ngram_size=0):
+    """Generate music for UI integration (top_k / top_p / repetition_penalty are optional filters)
+
+    beam_width > 0 returns the most likely continuation via beam search instead
+    of sampling (diverse beam search when num_groups > 1).  no_repeat_ngram_size > 0
+    bans repeating any n-gram of that size, in either mode.
+    """
     
     try:
         # Define paths
@@ -153,59 +115,39 @@ def generate_music_ui(length=50, temperature=0.8, output_file="ui_generated.mid"
         itos_path = os.path.join("ai-music-aml", "outputs", "processed", "itos.pkl")
         output_path = os.path.join("outputs", output_file)
         
-        # Load vocabulary
-        with open(vocab_path, 'r') as f:
-            vocab = json.load(f)
-        with open(itos_path, 'rb') as f:
-            itos = pickle.load(f)
-        
-        # Load model
-        model = models.load_model(model_path)
+        # Model and vocabulary stay cached in-process across button clicks
+        vocab = get_vocab(vocab_path)
+        model = get_model(model_path)
+        table = get_token_table(itos_path, model.output_shape[-1])
         
         # Generate sequence
         sequence_length = model.input_shape[1]  # Should be 64
         seed_sequence = np.random.randint(0, len(vocab), size=sequence_length)
         
-        generated_tokens = []
-        current_sequence = seed_sequence.copy()
-        
-        for i in range(length):
-            # Prepare input
-            input_seq = current_sequence.reshape(1, sequence_length)
-            
-            # Get prediction
-            prediction = model.predict(input_seq, verbose=0)
-            
-            # Apply temperature
-            if temperature != 1.0:
-                prediction = np.log(prediction + 1e-8) / temperature
-                prediction = np.exp(prediction)
-            
-            # Normalize probabilities
-            prediction = prediction / np.sum(prediction)
-            
-            # Sample next token
-            next_token_idx = np.random.choice(len(prediction[0]), p=prediction[0])
-            
-            # Convert to token string
-            if next_token_idx < len(itos):
-                token_str = itos[next_token_idx]
-                generated_tokens.append(token_str)
-            
-            # Update sequence for next iteration
-            current_sequence = np.append(current_sequence[1:], next_token_idx)
+        generated_ids = []
+        if beam_width:
+            # All beams advance in one batched forward pass per token
+            results = beam_search(model, [seed_sequence], length, beam_width=beam_width, num_groups=num_groups,
+                                  diversity_penalty=0.5 if num_groups > 1 else 0.0,
+                                  repetition_penalty=repetition_penalty, no_repeat_ngram_size=no_repeat_ngram_size)
+            generated_ids = results[0][0][0]
+        else:
+            # The seed is encoded once, then each token costs a single decoder step
+            generated_ids = generate_ids(model, seed_sequence, length, temperature=temperature, top_k=top_k,
+                                         top_p=top_p, repetition_penalty=repetition_penalty,
+                                         no_repeat_ngram_size=no_repeat_ngram_size)
         
         # Convert to MIDI
-        result = tokens_to_midi_ui(generated_tokens, output_path)
+        result = tokens_to_midi_ui(generated_ids, output_path, table)
         
         if result['success']:
             return {
                 'success': True,
                 'output_path': output_path,
-                'tokens_generated': len(generated_tokens),
-                'sample_tokens': generated_tokens[:5],
+                'tokens_generated': len(generated_ids),
+                'sample_tokens': [table.tokens[idx] for idx in generated_ids[:5]],
                 'midi_info': result,
-                'message': f"Successfully generated {len(generated_tokens)} tokens and created MIDI"
+                'message': f"Successfully generated {len(generated_ids)} tokens and created MIDI"
             }
         else:
             return {
@@ -221,6 +163,72 @@ def generate_music_ui(length=50, temperature=0.8, output_file="ui_generated.mid"
             'message': f"Generation failed: {e}"
         }
 
+def stream_music_ui(length=50, temperature=0.8, output_file="ui_generated.mid",
+                    top_k=0, top_p=1.0, repetition_penalty=1.0, chunk_tokens=16):
+    """Like generate_music_ui (sampling only), but yields an update per token while generating
+
+    Updates come from src/inference/streaming.py: the sampled token, its note
+    event and, every `chunk_tokens` tokens, a MIDI chunk.  outputs/<output_file>
+    is rewritten at every chunk, so it is playable while the piece grows.
+    """
+    model_path = os.path.join("ai-music-aml", "outputs", "rnn", "best.keras")
+    vocab_path = os.path.join("ai-music-aml", "outputs", "processed", "vocab.json")
+    itos_path = os.path.join("ai-music-aml", "outputs", "processed", "itos.pkl")
+    output_path = os.path.join("outputs", output_file)
+    os.makedirs("outputs", exist_ok=True)
+    
+    vocab = get_vocab(vocab_path)
+    model = get_model(model_path)
+    table = get_token_table(itos_path, model.output_shape[-1])
+    seed_sequence = np.random.randint(0, len(vocab), size=model.input_shape[1])
+    
+    yield from stream_music(model, table, seed_sequence, length, chunk_tokens, midi_path=output_path,
+                            temperature=temperature, top_k=top_k, top_p=top_p,
+                            repetition_penalty=repetition_penalty)
+
+def continue_midi_ui(midi_bytes, length=150, temperature=1.0, similarity=0.7, mode="continue",
+                     output_file="ui_continuation.mid", time_budget=10.0):
+    """Continue or vary an uploaded MIDI file (see src/inference/continuation.py)
+
+    A continuation is saved together with the prompt it continues, so the
+    transition can be heard; a variation is saved on its own.
+    """
+    try:
+        model_path = os.path.join("ai-music-aml", "outputs", "rnn", "best.keras")
+        itos_path = os.path.join("ai-music-aml", "outputs", "processed", "itos.pkl")
+        output_path = os.path.join("outputs", output_file)
+        os.makedirs("outputs", exist_ok=True)
+        
+        model = get_model(model_path)
+        table = get_token_table(itos_path, model.output_shape[-1])
+        result = continue_midi(model, table, midi_bytes, length, mode=mode, similarity=similarity,
+                               time_budget=time_budget, temperature=temperature)
+        
+        ids = result['prompt'] + result['ids'] if mode == "continue" else result['ids']
+        events = [ev for _, ev in iter_events(ids, table) if ev is not None]
+        write_smf(output_path, [(ev['offset'], ev['duration'], p, VELOCITY) for ev in events for p in ev['pitches']])
+        
+        return {
+            'success': True,
+            'output_path': output_path,
+            'events': events,
+            'prompt_tokens': len(result['prompt']),
+            'tokens_generated': len(result['ids']),
+            'notes': sum(len(ev['pitches']) for _, ev in iter_events(result['ids'], table) if ev is not None),
+            'similarity': result['similarity'],
+            'time': result['elapsed'],
+            'truncated': result['truncated'],
+            'source_events': result['source_events'],
+            'message': f"Generated {len(result['ids'])} tokens from a {len(result['prompt'])}-token prompt"
+        }
+    
+    except Exception as e:
+        return {
+            'success': False,
+            'error': str(e),
+            'message': f"Continuation failed: {e}"
+        }
+
 # Test function
 if __name__ == "__main__":
     print("Testing UI Music Generation...")
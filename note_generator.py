@@ -12,7 +12,14 @@ import numpy as np
 import tensorflow as tf
 from music21 import stream, note, chord, duration, tempo, meter
 
-def generate_with_seed_notes(seed_notes, length=200, creativity=1.0, output_file="seeded_song.mid"):
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ai-music-aml'))
+from src.inference.registry import get_model, get_vocab, get_token_table
+from src.utils.token_table import NOTE, CHORD
+from src.inference.engine import generate_ids
+from src.inference.beam import beam_search
+
+def generate_with_seed_notes(seed_notes, length=200, creativity=1.0, output_file="seeded_song.mid",
+                             beam_width=0, num_groups=1, no_repeat_ngram_size=0):
     """
     Generate music starting with specific notes
     
@@ -21,6 +28,9 @@ def generate_with_seed_notes(seed_notes, length=200, creativity=1.0, output_file
         length: Number of tokens to generate
         creativity: Temperature for randomness (0.1-2.0)
         output_file: Output filename
+        beam_width: > 0 for the most likely continuation via beam search (creativity is then unused)
+        num_groups: > 1 for diverse beam search with that many beam groups
+        no_repeat_ngram_size: > 0 stops beams from repeating any n-gram of this size (0 = off)
     """
     
     print(f"🎼 Note-Based AI Music Generator")
@@ -33,16 +43,13 @@ def generate_with_seed_notes(seed_notes, length=200, creativity=1.0, output_file
     print(f"🧠 Loading AI model...")
     
     try:
-        # Load model and data
-        model = tf.keras.models.load_model('ai-music-aml/outputs/rnn/best.keras')
-        
-        with open('ai-music-aml/outputs/processed/vocab.json', 'r') as f:
-            vocab = json.load(f)
-        
-        with open('ai-music-aml/outputs/processed/itos.pkl', 'rb') as f:
-            itos = pickle.load(f)
+        # Load model and data (cached for the lifetime of the process)
+        model = get_model('ai-music-aml/outputs/rnn/best.keras')
+        vocab = get_vocab('ai-music-aml/outputs/processed/vocab.json')
+        itos = get_vocab('ai-music-aml/outputs/processed/itos.pkl')
         
         stoi = {v: k for k, v in itos.items()}
+        table = get_token_table('ai-music-aml/outputs/processed/itos.pkl', model.output_shape[-1])
         
         print(f"✅ Model loaded. Vocabulary size: {len(vocab)}")
         
@@ -60,14 +67,18 @@ def generate_with_seed_notes(seed_notes, length=200, creativity=1.0, output_file
     else:
         print(f"✅ Converted {len(seed_tokens)} seed notes to tokens")
     
-    print(f"🎼 Generating {length} tokens with creativity {creativity}...")
-    
     # Generate sequence
-    generated = generate_music_sequence(model, seed_tokens, length, creativity, itos)
+    if beam_width:
+        print(f"🎼 Generating {length} tokens with beam search (width {beam_width}, groups {num_groups})...")
+        generated = generate_beam_sequence(model, seed_tokens, length, beam_width, num_groups,
+                                           no_repeat_ngram_size=no_repeat_ngram_size)
+    else:
+        print(f"🎼 Generating {length} tokens with creativity {creativity}...")
+        generated = generate_music_sequence(model, seed_tokens, length, creativity, itos)
     
     # Create MIDI
     print(f"🎵 Creating MIDI file...")
-    success = tokens_to_midi_advanced(generated, itos, output_file)
+    success = tokens_to_midi_advanced(generated, table, output_file)
     
     if success:
         file_size = os.path.getsize(f'outputs/{output_file}')
@@ -128,41 +139,32 @@ def convert_notes_to_tokens(seed_notes, stoi, vocab):
     
     return tokens
 
-def generate_music_sequence(model, seed_tokens, length, temperature, itos):
-    """Generate music sequence with seed"""
-    sequence = seed_tokens.copy()
-    vocab_size = len(itos)
+def generate_music_sequence(model, seed_tokens, length, temperature, itos,
+                            top_k=0, top_p=1.0, repetition_penalty=1.0):
+    """Generate music sequence with seed (top_k / top_p / repetition_penalty are optional filters)"""
+    total = length - len(seed_tokens)
     
-    for i in range(length - len(seed_tokens)):
-        # Prepare input (use last 64 tokens as model expects)
-        input_seq = sequence[-64:] if len(sequence) >= 64 else sequence
-        if len(input_seq) < 64:
-            input_seq = input_seq + [0] * (64 - len(input_seq))
-        
-        # Predict next token
-        prediction = model.predict(np.array([input_seq]), verbose=0)[0]
-        
-        # Apply temperature for creativity control
-        if temperature != 1.0:
-            prediction = np.log(prediction + 1e-8) / temperature
-            prediction = np.exp(prediction)
-        
-        # Normalize probabilities
-        prediction = prediction / np.sum(prediction)
-        
-        # Sample next token
-        next_token = np.random.choice(vocab_size, p=prediction)
-        sequence.append(next_token)
-        
-        # Progress indicator
+    def progress(i, token):
         if (i + 1) % 25 == 0:
-            progress = (i + 1) / (length - len(seed_tokens)) * 100
-            print(f"  Progress: {progress:.0f}% ({i + 1}/{length - len(seed_tokens)} tokens)")
+            print(f"  Progress: {(i + 1) / total * 100:.0f}% ({i + 1}/{total} tokens)")
     
-    return sequence
+    # The seed is prefilled in one pass (however short), then decoding carries the state
+    generated = generate_ids(model, seed_tokens, total, on_token=progress, temperature=temperature,
+                             top_k=top_k, top_p=top_p, repetition_penalty=repetition_penalty)
+    return list(seed_tokens) + generated
 
-def tokens_to_midi_advanced(tokens, itos, output_file):
-    """Convert tokens to MIDI with advanced parsing"""
+def generate_beam_sequence(model, seed_tokens, length, beam_width=4, num_groups=1, diversity_penalty=0.5,
+                           no_repeat_ngram_size=0):
+    """Most likely continuation of the seed (diverse beam search when num_groups > 1)"""
+    results = beam_search(model, [seed_tokens], length - len(seed_tokens), beam_width=beam_width,
+                          num_groups=num_groups, diversity_penalty=diversity_penalty if num_groups > 1 else 0.0,
+                          no_repeat_ngram_size=no_repeat_ngram_size)
+    continuation, score = results[0][0]
+    print(f"  Best beam: {len(continuation)} tokens, avg log-prob {score:.3f}")
+    return list(seed_tokens) + continuation
+
+def tokens_to_midi_advanced(tokens, table, output_file):
+    """Convert token ids to MIDI (attributes come from the TokenTable)"""
     try:
         score = stream.Stream()
         score.append(tempo.MetronomeMark(number=120))
@@ -173,17 +175,15 @@ def tokens_to_midi_advanced(tokens, itos, output_file):
         chord_count = 0
         
         for token_idx in tokens:
-            token = itos.get(token_idx, "")
+            if not 0 <= token_idx < table.vocab_size:
+                continue
+            kind = table.kind[token_idx]
+            duration_val = float(table.duration[token_idx])
             
-            # Parse single notes (P format)
-            if token.startswith("P") and "|D" in token:
+            # Single notes (P format)
+            if kind == NOTE:
                 try:
-                    # Parse P{note}|D{duration}|S{start}
-                    parts = token.split("|")
-                    note_part = parts[0][1:]  # Remove 'P'
-                    duration_val = float(parts[1][1:]) if len(parts) > 1 else 0.5  # Remove 'D'
-                    
-                    n = note.Note(note_part)
+                    n = note.Note(table.names[token_idx][0])
                     n.duration.quarterLength = max(0.125, min(4.0, duration_val))
                     n.offset = current_time
                     score.append(n)
@@ -194,16 +194,10 @@ def tokens_to_midi_advanced(tokens, itos, output_file):
                 except Exception as e:
                     pass
                     
-            # Parse chords (CHORD format)
-            elif token.startswith("CHORD:") and "|D" in token:
+            # Chords (CHORD format)
+            elif kind == CHORD:
                 try:
-                    # Parse CHORD:{notes}|D{duration}|S{start}
-                    parts = token.split("|")
-                    chord_part = parts[0][6:]  # Remove 'CHORD:'
-                    duration_val = float(parts[1][1:]) if len(parts) > 1 else 0.5  # Remove 'D'
-                    
-                    chord_notes = chord_part.split(",")
-                    c = chord.Chord(chord_notes)
+                    c = chord.Chord(list(table.names[token_idx]))
                     c.duration.quarterLength = max(0.125, min(4.0, duration_val))
                     c.offset = current_time
                     score.append(c)
@@ -242,12 +236,15 @@ def show_usage():
     print("🎵 Note-Based AI Music Generator")
     print("=" * 50)
     print("\nUsage:")
-    print("  py -3 note_generator.py <notes> [length] [creativity] [output]")
+    print("  py -3 note_generator.py <notes> [length] [creativity] [output] [--beam N] [--groups G] [--no-repeat N]")
     print("\n📝 Examples:")
     print("  py -3 note_generator.py \"C4 E4 G4\"")
     print("  py -3 note_generator.py \"C4,E4,G4,C5\" 150 1.2")
     print("  py -3 note_generator.py \"C4 D4 E4 F4\" 200 0.8 my_melody.mid")
     print("  py -3 note_generator.py \"A4 B4 C5 D5\" 300 1.5 scale_song.mid")
+    print("  py -3 note_generator.py \"C4 E4 G4\" 200 1.0 likely.mid --beam 4")
+    print("  py -3 note_generator.py \"C4 E4 G4\" 200 1.0 diverse.mid --beam 4 --groups 2")
+    print("  py -3 note_generator.py \"C4 E4 G4\" 200 1.0 varied.mid --beam 4 --no-repeat 4")
     print("\n🎹 Note Formats:")
     print("  Single notes: C4, D#4, F5, G3")
     print("  Multiple notes: \"C4 E4 G4\" or \"C4,E4,G4\"")
@@ -257,6 +254,9 @@ def show_usage():
     print("  length: Tokens to generate (default: 200)")
     print("  creativity: 0.1 (conservative) to 2.0 (very creative, default: 1.0)")
     print("  output: Filename (default: seeded_song.mid)")
+    print("  --beam N: most likely continuation with N beams instead of random sampling")
+    print("  --groups G: diverse beam search with G groups (N must be a multiple of G)")
+    print("  --no-repeat N: with --beam, never repeat an N-token phrase (default: 0, off)")
     print("\n🎯 Creativity Guide:")
     print("  0.1-0.5: Very conservative, stays close to training")
     print("  0.6-0.9: Balanced, good musical structure")
@@ -268,11 +268,21 @@ if __name__ == "__main__":
         show_usage()
         sys.exit(1)
     
-    # Parse arguments
-    notes_input = sys.argv[1]
-    length = int(sys.argv[2]) if len(sys.argv) > 2 else 200
-    creativity = float(sys.argv[3]) if len(sys.argv) > 3 else 1.0
-    output_file = sys.argv[4] if len(sys.argv) > 4 else "seeded_song.mid"
+    # Parse arguments (--beam / --groups / --no-repeat may appear anywhere after the notes)
+    args = sys.argv[1:]
+    options = {}
+    for flag in ("--beam", "--groups", "--no-repeat"):
+        if flag in args:
+            i = args.index(flag)
+            options[flag] = int(args[i + 1])
+            del args[i:i + 2]
+    notes_input = args[0]
+    length = int(args[1]) if len(args) > 1 else 200
+    creativity = float(args[2]) if len(args) > 2 else 1.0
+    output_file = args[3] if len(args) > 3 else "seeded_song.mid"
+    beam_width = options.get("--beam", 0)
+    num_groups = options.get("--groups", 1)
+    no_repeat_ngram_size = options.get("--no-repeat", 0)
     
     # Validate parameters
     if length < 10 or length > 1000:
@@ -293,6 +303,11 @@ if __name__ == "__main__":
         print("❌ No notes provided")
         sys.exit(1)
     
+    if beam_width and beam_width % num_groups:
+        print("❌ Beam width must be a multiple of the number of groups")
+        sys.exit(1)
+    
     # Generate music
-    success = generate_with_seed_notes(notes, length, creativity, output_file)
+    success = generate_with_seed_notes(notes, length, creativity, output_file, beam_width, num_groups,
+                                       no_repeat_ngram_size)
     sys.exit(0 if success else 1)
\ No newline at end of file